@@ -1,57 +1,55 @@
+import asyncio
 import datetime
+import logging
 import os
-import threading
-import time
+import signal
 import jwt
 import telebot
-import schedule
 from dotenv import load_dotenv
-from models import PostgreSQLQueries
+from telebot import asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+from checklists import ChecklistCache
+from models import DjangoQueries, queries
+from outbound import OutboundDispatcher
+from reminders import ReminderScheduler
+from runtime import UpdateRunner
+from sessions import SessionCache
+from webhook import serve_webhook
 
 load_dotenv('.env.bot')
 
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'))
+
 TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 
 if TOKEN is None:
     raise ValueError("Telegram bot token is not defined. Please check your .env.bot file.")
 
-bot = telebot.TeleBot(TOKEN)
-
-MODEL = PostgreSQLQueries(os.getenv('DB_NAME'), os.getenv('DB_USER'), os.getenv('DB_PASSWORD'), os.getenv('DB_HOST'),
-                          os.getenv('DB_PORT'))
+# Адрес Bot API можно заменить, например, на локальный тестовый сервер
+asyncio_helper.API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org').rstrip('/') + '/bot{0}/{1}'
 
+bot = AsyncTeleBot(TOKEN)
 
-def tic_tac():
-    while True:
+OUTBOUND = OutboundDispatcher(bot,
+                              global_rate=float(os.getenv('OUTBOUND_GLOBAL_RATE', 30)),
+                              chat_rate=float(os.getenv('OUTBOUND_CHAT_RATE', 1)),
+                              chat_burst=int(os.getenv('OUTBOUND_CHAT_BURST', 3)),
+                              workers=int(os.getenv('OUTBOUND_WORKERS', 8)))
 
-        this_moment = datetime.datetime.now()
-        routes = MODEL.get_routes()
-        for route in list(routes):
-            if (this_moment.hour == 12 and this_moment.minute == 0 and this_moment.second == 0 and
-                    this_moment - datetime.timedelta(days=1) == route[2].day):
-                for user in MODEL.get_users():
-                    if route[7] == user[0]:
-                        bot.send_message(user[12], "Завтра Вас ждёт путешествие!")
+MODEL = DjangoQueries(pool_size=int(os.getenv('DB_POOL_SIZE', 10)))
 
+SESSIONS = SessionCache(MODEL, ttl=float(os.getenv('BOT_SESSION_TTL', 5 * 60)))
 
-def run_schedule():
-    schedule.every().day.at("12:00").do(tic_tac)
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+CHECKLISTS = ChecklistCache(MODEL, SESSIONS, OUTBOUND, delay=float(os.getenv('CHECKLIST_FLUSH_DELAY', 0.5)))
 
 
-def login_checker(chat_id):
-    user = MODEL.get_user_by_tg_username(chat_id)
-    if user is None:
-        return False
-    else:
-        return True
+async def login_checker(chat_id):
+    return await SESSIONS.user_id(chat_id) is not None
 
 
-def get_keyboard(chat_id, back):
+async def get_keyboard(chat_id, back):
     keyboard = telebot.types.InlineKeyboardMarkup()
-    if login_checker(chat_id):
+    if await login_checker(chat_id):
         if back:
             return telebot.types.InlineKeyboardMarkup().add(
                 telebot.types.InlineKeyboardButton(text="Назад", callback_data='main'))
@@ -73,144 +71,204 @@ def get_keyboard(chat_id, back):
 
 
 @bot.message_handler(commands=['start'])
-def save_chat_id(message):
-    bot.send_message(message.chat.id,
-                     'Здравствуйте, я бот Тутуновка! Я здесь, чтобы напоминать вам о ваших путешествиях и багаже,'
-                     ' который вы хотели взять с собой. Со мной вы точно ничего не забудуете!',
-                     reply_to_message_id=message.message_id, reply_markup=get_keyboard(message.chat.id, False))
+async def save_chat_id(message):
+    OUTBOUND.send_message(message.chat.id,
+                          'Здравствуйте, я бот Тутуновка! Я здесь, чтобы напоминать вам о ваших путешествиях и багаже,'
+                          ' который вы хотели взять с собой. Со мной вы точно ничего не забудуете!',
+                          reply_to_message_id=message.message_id, reply_markup=await get_keyboard(message.chat.id, False))
 
 
 @bot.message_handler(content_types=["text"])
-def send_text(message):
+async def send_text(message):
     try:
         payload = jwt.decode(jwt=message.text, key=os.getenv('SECRET_KEY_JWT'), algorithms=["HS256"])
-        data = MODEL.get_user_fields(payload["username"])
+        data = await MODEL.get_user_fields(payload["username"])
         if data is not None:
-            MODEL.update_tg_username(data[0], message.chat.id)
-        bot.send_message(message.chat.id,
-                         "Вы авторизованы!",
-                         reply_to_message_id=message.message_id,
-                         reply_markup=get_keyboard(message.chat.id, False)
-                         )
+            await MODEL.update_tg_username(data.id, message.chat.id)
+            SESSIONS.invalidate(message.chat.id)
+        OUTBOUND.send_message(message.chat.id,
+                              "Вы авторизованы!",
+                              reply_to_message_id=message.message_id,
+                              reply_markup=await get_keyboard(message.chat.id, False)
+                              )
     except jwt.ExpiredSignatureError:
-        bot.send_message(message.chat.id,
-                         f'Токен истёк',
-                         reply_to_message_id=message.message_id)
+        OUTBOUND.send_message(message.chat.id,
+                              f'Токен истёк',
+                              reply_to_message_id=message.message_id)
     except jwt.InvalidTokenError:
-        bot.send_message(message.chat.id,
-                         f'Неверный токен',
-                         reply_to_message_id=message.message_id)
+        OUTBOUND.send_message(message.chat.id,
+                              f'Неверный токен',
+                              reply_to_message_id=message.message_id)
 
 
 @bot.callback_query_handler(func=lambda call: call.data == "main")
-def main_menu(call):
-    bot.send_message(call.message.chat.id,
-                     'Я в Вашем распоряжении! Что бы Вы хотели?',
-                     reply_markup=get_keyboard(call.message.chat.id, False))
+async def main_menu(call):
+    OUTBOUND.send_message(call.message.chat.id,
+                          'Я в Вашем распоряжении! Что бы Вы хотели?',
+                          reply_markup=await get_keyboard(call.message.chat.id, False))
 
 
 @bot.callback_query_handler(func=lambda call: call.data == "flight")
-def but_flight_pressed(call):
-    try:
-        context = MODEL.get_route_fields(MODEL.get_user_by_tg_username(call.message.chat.id)[0])
-    except:
-        bot.send_message(call.message.chat.id, "Ошибка: пользователь не найден.")
+async def but_flight_pressed(call):
+    if not await login_checker(call.message.chat.id):
+        OUTBOUND.send_message(call.message.chat.id, "Ошибка: пользователь не найден.")
+        return
+    context = await SESSIONS.route(call.message.chat.id)
     if context is None:
-        bot.send_message(call.message.chat.id, 'У Вас нет предстоящих путешествий(',
-                         reply_markup=get_keyboard(call.message.chat.id, True))
+        OUTBOUND.send_message(call.message.chat.id, 'У Вас нет предстоящих путешествий(',
+                              reply_markup=await get_keyboard(call.message.chat.id, True))
     else:
-        if context[5] == '' and context[4] == '':
-            bot.send_message(call.message.chat.id,
-                             "Ваше следующее путешествие: " + str(context[1]) + "\n"
-                             + "Дата начала путешествия: " + str(context[2]) + "\n"
-                             + "Дата возвращения: " + str(context[3]) + "\n"
-                             + "Вы не записали что хотите взять с собой" + "\n"
-                             + "Вы не оставили дополнительных сведений о маршруте",
-                             reply_markup=get_keyboard(call.message.chat.id, True)
-                             )
-        elif context[5] != '' and context[4] == '':
-            bot.send_message(call.message.chat.id,
-                             "Ваше следующее путешествие: " + str(context[1]) + "\n"
-                             + "Дата начала путешествия: " + str(context[2]) + "\n"
-                             + "Дата возвращения: " + str(context[3]) + "\n"
-                             + "Вы хотели взять: " + str(context[5]) + "\n"
-                             + "Вы не оставили дополнительных сведений о маршруте",
-                             reply_markup=get_keyboard(call.message.chat.id, True)
-                             )
-        elif context[5] == '' and context[4] != '':
-            bot.send_message(call.message.chat.id,
-                             "Ваше следующее путешествие: " + str(context[1]) + "\n"
-                             + "Дата начала путешествия: " + str(context[2]) + "\n"
-                             + "Дата возвращения: " + str(context[3]) + "\n"
-                             + "Вы не оставили дополнительных сведений о маршруте" + "\n"
-                             + "Комментарий: " + str(context[4]),
-                             reply_markup=get_keyboard(call.message.chat.id, True)
-                             )
+        if not context.baggage and not context.comment:
+            OUTBOUND.send_message(call.message.chat.id,
+                                  "Ваше следующее путешествие: " + context.name + "\n"
+                                  + "Дата начала путешествия: " + str(context.date_in) + "\n"
+                                  + "Дата возвращения: " + str(context.date_out) + "\n"
+                                  + "Вы не записали что хотите взять с собой" + "\n"
+                                  + "Вы не оставили дополнительных сведений о маршруте",
+                                  reply_markup=await get_keyboard(call.message.chat.id, True)
+                                  )
+        elif context.baggage and not context.comment:
+            OUTBOUND.send_message(call.message.chat.id,
+                                  "Ваше следующее путешествие: " + context.name + "\n"
+                                  + "Дата начала путешествия: " + str(context.date_in) + "\n"
+                                  + "Дата возвращения: " + str(context.date_out) + "\n"
+                                  + "Вы хотели взять: " + str(context.baggage) + "\n"
+                                  + "Вы не оставили дополнительных сведений о маршруте",
+                                  reply_markup=await get_keyboard(call.message.chat.id, True)
+                                  )
+        elif not context.baggage and context.comment:
+            OUTBOUND.send_message(call.message.chat.id,
+                                  "Ваше следующее путешествие: " + context.name + "\n"
+                                  + "Дата начала путешествия: " + str(context.date_in) + "\n"
+                                  + "Дата возвращения: " + str(context.date_out) + "\n"
+                                  + "Вы не оставили дополнительных сведений о маршруте" + "\n"
+                                  + "Комментарий: " + str(context.comment),
+                                  reply_markup=await get_keyboard(call.message.chat.id, True)
+                                  )
         else:
-            bot.send_message(call.message.chat.id,
-                             "Ваше следующее путешествие: " + str(context[1]) + "\n"
-                             + "Дата начала путешествия: " + str(context[2]) + "\n"
-                             + "Дата возвращения: " + str(context[3]) + "\n"
-                             + "Вы хотели взять: " + str(context[5]) + "\n"
-                             + "Комментарий: " + str(context[4]),
-                             reply_markup=get_keyboard(call.message.chat.id, True)
-                             )
+            OUTBOUND.send_message(call.message.chat.id,
+                                  "Ваше следующее путешествие: " + context.name + "\n"
+                                  + "Дата начала путешествия: " + str(context.date_in) + "\n"
+                                  + "Дата возвращения: " + str(context.date_out) + "\n"
+                                  + "Вы хотели взять: " + str(context.baggage) + "\n"
+                                  + "Комментарий: " + str(context.comment),
+                                  reply_markup=await get_keyboard(call.message.chat.id, True)
+                                  )
 
 
 @bot.callback_query_handler(func=lambda call: call.data == "auth")
-def but_auth_pressed(call):
-    bot.send_message(call.message.chat.id, "Пришлите токен для автоизации, получить его Вы можете на нашем сайте.")
+async def but_auth_pressed(call):
+    OUTBOUND.send_message(call.message.chat.id, "Пришлите токен для автоизации, получить его Вы можете на нашем сайте.")
 
 
 @bot.callback_query_handler(func=lambda call: call.data == "logout")
-def but_logout_pressed(call):
-    status = MODEL.delete_tg_username(call.message.chat.id)
+async def but_logout_pressed(call):
+    status = await MODEL.delete_tg_username(call.message.chat.id)
+    SESSIONS.invalidate(call.message.chat.id)
     if status:
-        bot.send_message(call.message.chat.id, "Вы успешно вышли из аккаунта, ждём Вас снова!",
-                         reply_markup=get_keyboard(call.message.chat.id, False))
+        OUTBOUND.send_message(call.message.chat.id, "Вы успешно вышли из аккаунта, ждём Вас снова!",
+                              reply_markup=await get_keyboard(call.message.chat.id, False))
     else:
-        bot.send_message(call.message.chat.id, "Произошла непредвиденная ошибка, попробуйте позже",
-                         reply_markup=get_keyboard(call.message.chat.id, False))
+        OUTBOUND.send_message(call.message.chat.id, "Произошла непредвиденная ошибка, попробуйте позже",
+                              reply_markup=await get_keyboard(call.message.chat.id, False))
 
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith("note_"))
-def toggle_note_status(call):
+async def toggle_note_status(call):
     note_id = int(call.data.split("_")[1])
-    status = MODEL.toggle_note_status(note_id)
-    if status:
-        bot.answer_callback_query(call.id, "Статус заметки изменён")
+    if await CHECKLISTS.toggle(call.message.chat.id, call.message.message_id, note_id):
+        OUTBOUND.answer_callback_query(call.message.chat.id, call.id, "Статус заметки изменён")
     else:
-        bot.answer_callback_query(call.id, "Ошибка изменения статуса")
-
-    show_notes(call)
+        OUTBOUND.answer_callback_query(call.message.chat.id, call.id, "Ошибка изменения статуса")
 
 
 @bot.callback_query_handler(func=lambda call: call.data == "show_notes")
-def show_notes(call):
-    try:
-        context = MODEL.get_route_fields(MODEL.get_user_by_tg_username(call.message.chat.id)[0])
-    except:
-        bot.send_message(call.message.chat.id, "Ошибка: пользователь не найден.")
-    if context is None:
-        bot.send_message(call.message.chat.id, 'У Вас нет предстоящих путешествий(',
-                         reply_markup=get_keyboard(call.message.chat.id))
+async def show_notes(call):
+    if not await login_checker(call.message.chat.id):
+        OUTBOUND.send_message(call.message.chat.id, "Ошибка: пользователь не найден.")
+        return
+    checklist = await CHECKLISTS.open(call.message.chat.id)
+    if checklist is None:
+        OUTBOUND.send_message(call.message.chat.id, 'У Вас нет предстоящих путешествий(',
+                              reply_markup=await get_keyboard(call.message.chat.id, True))
+        return
 
-    notes = MODEL.get_notes_for_route(context[0])
-    if not notes:
-        bot.send_message(call.message.chat.id, "У маршрута нет заметок.")
+    if not checklist.notes:
+        OUTBOUND.send_message(call.message.chat.id, "У маршрута нет заметок.")
         return
 
-    keyboard = telebot.types.InlineKeyboardMarkup()
-    for note in notes:
-        status_text = "✔️ " if note[1] else "❌ "
-        button = telebot.types.InlineKeyboardButton(
-            text=f"{status_text}{note[2]}", callback_data=f"note_{note[0]}"
-        )
-        keyboard.add(button)
-    keyboard.add(telebot.types.InlineKeyboardButton(text="Назад", callback_data='main'))
-    bot.send_message(call.message.chat.id, "Ваши заметки:", reply_markup=keyboard)
-
-
-schedule_thread = threading.Thread(target=run_schedule)
-schedule_thread.start()
-bot.polling(none_stop=True, timeout=60)
+    sent = OUTBOUND.send_message(call.message.chat.id, "Ваши заметки:", reply_markup=CHECKLISTS.keyboard(checklist))
+    # Обработчик не ждёт отправки, id сообщения со списком запоминается, когда оно уйдёт
+    sent.add_done_callback(lambda future: CHECKLISTS.sent(checklist, future))
+
+
+def routes_changed(user_id):
+    CHECKLISTS.refresh(SESSIONS.invalidate_user(user_id))
+
+
+def changes_lost():
+    SESSIONS.clear()
+    CHECKLISTS.refresh()
+
+
+def connect_change_hooks(loop):
+    # Хуки приходят из потоков запросов и слушателя, кэши меняются только в цикле событий.
+    # Сессии сбрасываются при любых изменениях маршрутов, а списки заметок перечитываются
+    # только при изменениях из других процессов: свои изменения в них уже учтены
+    queries.routes_changed.connect(
+        lambda sender, user_id, **kwargs: loop.call_soon_threadsafe(routes_changed, user_id),
+        weak=False, dispatch_uid='bot_routes_changed')
+    queries.notes_changed.connect(
+        lambda sender, note_ids, **kwargs: loop.call_soon_threadsafe(CHECKLISTS.refresh_notes, note_ids),
+        sender=queries.ChangeListener, weak=False, dispatch_uid='bot_notes_changed')
+    queries.changes_lost.connect(
+        lambda sender, **kwargs: loop.call_soon_threadsafe(changes_lost),
+        weak=False, dispatch_uid='bot_changes_lost')
+
+
+async def main():
+    # BOT_MODE=webhook - обновления приходят POST-запросами, иначе long polling
+    webhook = os.getenv('BOT_MODE', 'polling') == 'webhook'
+    if webhook and not os.getenv('WEBHOOK_SECRET'):
+        raise SystemExit("WEBHOOK_SECRET is required when BOT_MODE=webhook")
+
+    await MODEL.connect()
+    OUTBOUND.start()
+    connect_change_hooks(asyncio.get_running_loop())
+    listener = queries.ChangeListener()
+    listener_task = asyncio.create_task(asyncio.to_thread(listener.run))
+    reminders = ReminderScheduler(OUTBOUND, MODEL,
+                                  datetime.time.fromisoformat(os.getenv('REMINDER_TIME', '12:00')),
+                                  batch_size=int(os.getenv('REMINDER_BATCH_SIZE', 25)),
+                                  batch_interval=float(os.getenv('REMINDER_BATCH_INTERVAL', 1)))
+    reminders_task = asyncio.create_task(reminders.run())
+    runner = UpdateRunner(bot, int(os.getenv('BOT_CONCURRENCY', 16)), poll_timeout=60)
+    try:
+        if webhook:
+            await serve_webhook(bot, runner, os.getenv('WEBHOOK_URL'), os.getenv('WEBHOOK_SECRET'),
+                                os.getenv('WEBHOOK_HOST', '0.0.0.0'), int(os.getenv('WEBHOOK_PORT', 8443)),
+                                path=os.getenv('WEBHOOK_PATH', '/webhook'))
+        else:
+            await bot.remove_webhook()
+            # В режиме webhook SIGTERM обрабатывает uvicorn, здесь по SIGTERM прекращаем
+            # получать обновления и дорабатываем уже полученные
+            loop = asyncio.get_running_loop()
+            polling = asyncio.create_task(runner.run())
+            loop.add_signal_handler(signal.SIGTERM, polling.cancel)
+            try:
+                await asyncio.wait([polling])
+            finally:
+                loop.remove_signal_handler(signal.SIGTERM)
+                polling.cancel()
+    finally:
+        listener.stop()
+        reminders_task.cancel()
+        await runner.drain()
+        await OUTBOUND.stop()
+        await bot.close_session()
+        await listener_task
+        await MODEL.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,150 @@
+import asyncio
+
+import telebot
+
+
+class ChecklistNote:
+    __slots__ = ('text', 'done', 'saved')
+
+    def __init__(self, text, done):
+        self.text = text
+        self.done = done
+        # Отметка, записанная в базу данных
+        self.saved = done
+
+
+class Checklist:
+    __slots__ = ('route_id', 'notes', 'message_id', 'flush')
+
+    def __init__(self, route_id, notes):
+        self.route_id = route_id
+        self.notes = {note.id: ChecklistNote(note.text, note.done) for note in notes}
+        self.message_id = None
+        self.flush = None
+
+
+class ChecklistCache:
+    # Списки заметок ближайшего маршрута по чатам. Нажатие на заметку меняет отметку
+    # в памяти, а через delay секунд все накопившиеся изменения записываются одним UPDATE
+    # и клавиатура сообщения редактируется на месте
+    def __init__(self, model, sessions, sender, delay=0.5, max_size=10000):
+        self.model = model
+        self.sessions = sessions
+        self.sender = sender
+        self.delay = delay
+        self.max_size = max_size
+        self._checklists = {}
+
+    async def open(self, chat_id):
+        # Список заново читается из базы данных при каждом открытии
+        route_id = await self.sessions.route_id(chat_id)
+        if route_id is None:
+            return None
+
+        previous = self._checklists.get(chat_id)
+        if previous is not None and previous.flush is not None:
+            # Несохранённые отметки записываются до чтения списка
+            await previous.flush
+
+        notes = await self.model.get_notes_for_route(route_id)
+        if notes is None:
+            return None
+
+        if len(self._checklists) >= self.max_size:
+            # Сначала удаляются списки без несохранённых изменений, открытые раньше других
+            for key in [key for key, value in self._checklists.items() if value.flush is None][:self.max_size // 2]:
+                del self._checklists[key]
+        checklist = self._checklists[chat_id] = Checklist(route_id, notes)
+        return checklist
+
+    def refresh_notes(self, note_ids):
+        # Заметки изменены в другом месте: открытые списки с ними перечитываются
+        note_ids = set(note_ids)
+        self.refresh([chat_id for chat_id, checklist in self._checklists.items() if note_ids & checklist.notes.keys()])
+
+    def refresh(self, chat_ids=None):
+        for chat_id in list(self._checklists) if chat_ids is None else chat_ids:
+            if chat_id in self._checklists:
+                asyncio.create_task(self._refresh(chat_id))
+
+    async def _refresh(self, chat_id):
+        checklist = self._checklists.get(chat_id)
+        if checklist is None:
+            return
+        fresh = await self.open(chat_id)
+
+        if fresh is None or fresh.route_id != checklist.route_id:
+            # Ближайший маршрут сменился, старое сообщение не трогаем
+            if self._checklists.get(chat_id) is fresh:
+                del self._checklists[chat_id]
+            return
+
+        fresh.message_id = checklist.message_id
+        if fresh.message_id is not None:
+            await self._edit(chat_id, fresh)
+
+    @staticmethod
+    def sent(checklist, future):
+        # Сообщение со списком отправлено: его клавиатура будет редактироваться на месте
+        if not future.cancelled() and future.exception() is None and checklist.message_id is None:
+            checklist.message_id = future.result().message_id
+
+    @staticmethod
+    def keyboard(checklist):
+        keyboard = telebot.types.InlineKeyboardMarkup()
+        for note_id, note in checklist.notes.items():
+            status_text = "✔️ " if note.done else "❌ "
+            keyboard.add(telebot.types.InlineKeyboardButton(text=f"{status_text}{note.text}",
+                                                            callback_data=f"note_{note_id}"))
+        keyboard.add(telebot.types.InlineKeyboardButton(text="Назад", callback_data='main'))
+        return keyboard
+
+    async def toggle(self, chat_id, message_id, note_id):
+        checklist = self._checklists.get(chat_id)
+        if checklist is None or note_id not in checklist.notes:
+            # Например, кнопка старого сообщения после перезапуска бота
+            checklist = await self.open(chat_id)
+            if checklist is None or note_id not in checklist.notes:
+                return False
+
+        note = checklist.notes[note_id]
+        note.done = not note.done
+        checklist.message_id = message_id
+
+        if checklist.flush is None:
+            checklist.flush = asyncio.create_task(self._flush_later(chat_id, checklist))
+        return True
+
+    async def _flush_later(self, chat_id, checklist):
+        # Нажатия во время записи попадают в следующую запись той же задачи
+        try:
+            while True:
+                await asyncio.sleep(self.delay)
+                changed = {note_id: note.done for note_id, note in checklist.notes.items() if note.done != note.saved}
+                if changed:
+                    await self._save(checklist, changed)
+                await self._edit(chat_id, checklist)
+
+                if all(note.done == note.saved for note in checklist.notes.values()):
+                    return
+        finally:
+            checklist.flush = None
+
+    async def _save(self, checklist, changed):
+        if await self.model.set_notes_done(checklist.route_id, changed) is None:
+            # Запись не удалась: возвращаем отметки, записанные в базу данных
+            for note_id in changed:
+                note = checklist.notes[note_id]
+                note.done = note.saved
+            return
+
+        for note_id, done in changed.items():
+            checklist.notes[note_id].saved = done
+
+    async def _edit(self, chat_id, checklist):
+        try:
+            await self.sender.edit_message_reply_markup(chat_id, checklist.message_id,
+                                                        reply_markup=self.keyboard(checklist))
+        except Exception:
+            # Ошибку уже записала в лог очередь исходящих запросов
+            pass
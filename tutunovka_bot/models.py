@@ -1,219 +1,82 @@
-import psycopg2
-from psycopg2 import sql
+import asyncio
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
 
+import django
 
-class PostgreSQLQueries:
-    def __init__(self, dbname, user, password, host, port):
-        self.dbname = dbname
-        self.user = user
-        self.password = password
-        self.host = host
-        self.port = port
+# Запросы бота - общие функции веб-приложения (tutun_app.queries) поверх моделей Django.
+# В контейнере код веб-приложения лежит в PYTHONPATH, локально берётся соседний каталог
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tutunovka_web'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tutun.settings')
+# Соединение потока переиспользуется полчаса, если не задано другое
+os.environ.setdefault('DB_CONN_MAX_AGE', str(30 * 60))
+django.setup()
 
-    def connect(self):
+from django.db import Error, close_old_connections  # noqa: E402
+from tutun_app import queries  # noqa: E402
+
+# Ошибки базы данных и соединения, после которых запрос считается неудавшимся
+DB_ERRORS = (Error, OSError)
+
+logger = logging.getLogger(__name__)
+
+
+class DjangoQueries:
+    # ORM Django синхронный, поэтому запросы выполняются в пуле из pool_size потоков.
+    # У каждого потока своё соединение: оно переиспользуется, пока не истечёт
+    # DB_CONN_MAX_AGE, и пересоздаётся, если стало непригодным
+    def __init__(self, pool_size=10):
+        self.pool_size = pool_size
+        self.executor = None
+
+    async def connect(self):
+        self.executor = ThreadPoolExecutor(self.pool_size, thread_name_prefix='db')
+
+    async def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+
+    @staticmethod
+    def _run(function, args, default):
+        close_old_connections()
         try:
-            conn = psycopg2.connect(
-                dbname=self.dbname,
-                user=self.user,
-                password=self.password,
-                host=self.host,
-                port=self.port
-            )
-            return conn
-        except psycopg2.Error as e:
-            print("Unable to connect to the database:", e)
-
-    def get_users(self):
-        conn = self.connect()
-        if conn is not None:
-            try:
-                cursor = conn.cursor()
-                cursor.execute(
-                    """
-                    SELECT *
-                    FROM "public"."auth_user"
-                    """,
-                )
-                user_data = cursor.fetchone()
-                cursor.close()
-                conn.close()
-                return user_data
-            except psycopg2.Error as e:
-                print("Error executing SQL statement:", e)
-                return None
-
-    def get_user_fields(self, username):
-        conn = self.connect()
-        if conn is not None:
-            try:
-                cursor = conn.cursor()
-                cursor.execute(
-                    """
-                    SELECT *
-                    FROM "public"."auth_user"
-                    WHERE (username = %s)
-                    """,
-                    (str(username),)
-                )
-                user_data = cursor.fetchone()
-                cursor.close()
-                conn.close()
-                return user_data
-            except psycopg2.Error as e:
-                print("Error executing SQL statement:", e)
-                return None
-
-    def get_route_fields(self, user_id):
-        conn = self.connect()
-        if conn is not None:
-            try:
-                cursor = conn.cursor()
-                cursor.execute(
-                    """
-                    SELECT *
-                    FROM "public"."Private_Routes"
-                    WHERE author_id = %s
-                    AND date_in = (
-                        SELECT min(date_in)
-                        FROM "public"."Private_Routes"
-                        WHERE date_in >= CURRENT_DATE
-                    )
-                    """,
-                    (user_id,)
-                )
-                user_data = cursor.fetchone()
-                cursor.close()
-                conn.close()
-                return user_data if user_data else None
-            except psycopg2.Error as e:
-                print("Error executing SQL statement:", e)
-                return None
-
-    def get_routes(self):
-        conn = self.connect()
-        if conn is not None:
-            try:
-                cursor = conn.cursor()
-                cursor.execute(
-                    """
-                    SELECT *
-                    FROM "public"."Private_Routes"
-                    """,
-                )
-                user_data = cursor.fetchone()
-                cursor.close()
-                conn.close()
-                return user_data
-            except psycopg2.Error as e:
-                print("Error executing SQL statement:", e)
-                return None
-
-    def get_user_by_tg_username(self, tg_username):
-        conn = self.connect()
-        if conn is not None:
-            try:
-                cursor = conn.cursor()
-                cursor.execute(
-                    """
-                    SELECT *
-                    FROM "auth_user"
-                    WHERE tg_username = %s
-                    """,
-                    (str(tg_username),)
-                )
-                user_data = cursor.fetchone()
-                cursor.close()
-                conn.close()
-                return user_data
-            except psycopg2.Error as e:
-                print("Error executing SQL statement:", e)
-                return None
-
-    def update_tg_username(self, user_id, new_tg_username):
-        conn = self.connect()
-        if conn is not None:
-            try:
-                cursor = conn.cursor()
-                cursor.execute(
-                    """
-                    UPDATE "auth_user"
-                    SET tg_username = %s
-                    WHERE id = %s
-                    """,
-                    (new_tg_username, user_id)
-                )
-                conn.commit()
-                cursor.close()
-                conn.close()
-                return True
-            except psycopg2.Error as e:
-                print("Error executing SQL statement:", e)
-                return False
-
-    def delete_tg_username(self, tg_user_id):
-        conn = self.connect()
-        if conn is not None:
-            try:
-                cursor = conn.cursor()
-                cursor.execute(
-                    """
-                    UPDATE "auth_user"
-                    SET tg_username = NULL
-                    WHERE tg_username = %s
-                    """,
-                    (str(tg_user_id),)
-                )
-                conn.commit()
-                cursor.close()
-                conn.close()
-                return True
-            except psycopg2.Error as e:
-                print("Error executing SQL statement:", e)
-                return False
-
-    def get_notes_for_route(self, route_id):
-        conn = self.connect()
-        if conn is not None:
-            try:
-                cursor = conn.cursor()
-                cursor.execute(
-                    """
-                    SELECT id, done, text FROM "public"."Notes"
-                    WHERE id IN (
-                        SELECT note_id FROM "public"."Private_Routes_note"
-                        WHERE privateroute_id = %s
-                    )
-                    ORDER BY id ASC
-                    """,
-                    (route_id,)
-                )
-                notes = cursor.fetchall()
-                cursor.close()
-                conn.close()
-                return notes
-            except psycopg2.Error as e:
-                print("Error executing SQL statement:", e)
-                return None
-
-    def toggle_note_status(self, note_id):
-        conn = self.connect()
-        if conn is not None:
-            try:
-                cursor = conn.cursor()
-                cursor.execute(
-                    """
-                    UPDATE "public"."Notes"
-                    SET done = NOT done
-                    WHERE id = %s
-                    RETURNING done
-                    """,
-                    (note_id,)
-                )
-                new_status = cursor.fetchone()
-                conn.commit()
-                cursor.close()
-                conn.close()
-                return new_status is not None
-            except psycopg2.Error as e:
-                print("Error executing SQL statement:", e)
-                return False
+            return function(*args)
+        except DB_ERRORS as e:
+            logger.exception("Error executing SQL statement: %s", e)
+            return default
+
+    async def _call(self, function, *args, default=None):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._run, function, args, default)
+
+    async def get_user_fields(self, username):
+        return await self._call(queries.get_user_by_username, str(username))
+
+    async def get_route_fields(self, user_id):
+        return await self._call(queries.get_nearest_route, user_id)
+
+    async def get_reminders(self, date_in):
+        return await self._call(queries.get_reminders, date_in)
+
+    async def claim_reminders(self, route_ids, date_in):
+        return await self._call(queries.claim_reminders, list(route_ids), date_in, default=set())
+
+    async def release_reminders(self, route_ids, date_in):
+        return await self._call(queries.release_reminders, list(route_ids), date_in)
+
+    async def get_user_by_tg_username(self, chat_id):
+        return await self._call(queries.get_user_by_chat, chat_id)
+
+    async def update_tg_username(self, user_id, chat_id):
+        return await self._call(queries.link_chat, user_id, chat_id, default=False)
+
+    async def delete_tg_username(self, chat_id):
+        # Выход из непривязанного чата тоже считается успешным
+        return await self._call(queries.unlink_chat, chat_id) is not None
+
+    async def get_notes_for_route(self, route_id):
+        return await self._call(queries.get_route_notes, route_id)
+
+    async def set_notes_done(self, route_id, states):
+        return await self._call(queries.set_notes_done, route_id, dict(states))
@@ -0,0 +1,203 @@
+import asyncio
+import collections
+import logging
+import time
+
+import aiohttp
+from telebot.asyncio_helper import ApiTelegramException, RequestTimeout
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    # rate токенов в секунду, не больше capacity подряд
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def take(self, now):
+        # Возвращает 0, если токен взят, иначе сколько секунд подождать
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def idle(self, now):
+        return now >= self.blocked_until and self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class OutboundDispatcher:
+    # Очередь исходящих запросов к Telegram: общий лимит global_rate запросов в секунду,
+    # лимит chat_rate на чат, при ответе 429 запрос повторяется через retry_after секунд.
+    # Обработчики только ставят запрос в очередь, а воркеры не ждут лимитов чатов и повторов:
+    # запрос откладывается вместе со следующими запросами того же чата, чтобы не нарушить их порядок
+    def __init__(self, bot, global_rate=30, chat_rate=1, chat_burst=3, workers=8, max_retries=5,
+                 metrics_interval=60):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.workers = workers
+        self.max_retries = max_retries
+        self.metrics_interval = metrics_interval
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_buckets = {}
+        self.metrics = dict.fromkeys(['submitted', 'sent', 'failed', 'retried', 'rate_limited', 'deferred',
+                                      'max_queue'], 0)
+        self.wait_time = 0.0
+        self._queue = asyncio.Queue()
+        # chat_id -> (отложенные запросы чата по порядку, таймер их возврата в очередь)
+        self._deferred = {}
+        self._released = asyncio.Event()
+        self._tasks = []
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._report_metrics()))
+
+    async def stop(self):
+        # Дожидаемся отправки уже принятых сообщений, в том числе отложенных
+        while True:
+            await self._queue.join()
+            if not self._deferred:
+                break
+            self._released.clear()
+            await self._released.wait()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def submit(self, chat_id, method, *args, **kwargs):
+        # Возвращает future с ответом Telegram, ждать его не обязательно
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((chat_id, method, args, kwargs, future, time.monotonic(), 0))
+        self.metrics['submitted'] += 1
+        self.metrics['max_queue'] = max(self.metrics['max_queue'], self._queue.qsize())
+        return future
+
+    def send_message(self, chat_id, text, **kwargs):
+        return self.submit(chat_id, self.bot.send_message, chat_id, text, **kwargs)
+
+    def answer_callback_query(self, chat_id, callback_query_id, text=None, **kwargs):
+        # Ответ на нажатие кнопки не сообщение в чат, на него действует только общий лимит
+        return self.submit(None, self.bot.answer_callback_query, callback_query_id, text, **kwargs)
+
+    def edit_message_reply_markup(self, chat_id, message_id, reply_markup=None, **kwargs):
+        return self.submit(chat_id, self.bot.edit_message_reply_markup, chat_id, message_id,
+                           reply_markup=reply_markup, **kwargs)
+
+    def _chat_bucket(self, chat_id, now):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) > 10000:
+                self.chat_buckets = {key: value for key, value in self.chat_buckets.items() if not value.idle(now)}
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _acquire(self, chat_id):
+        # Возвращает 0, если запрос можно отправлять, иначе на сколько секунд отложить запросы чата.
+        # Общего лимита воркер дожидается сам: он одинаков для всех запросов в очереди
+        if chat_id is not None:
+            now = time.monotonic()
+            delay = self._chat_bucket(chat_id, now).take(now)
+            if delay:
+                return delay
+
+        while True:
+            delay = self.global_bucket.take(time.monotonic())
+            if not delay:
+                return 0
+            await asyncio.sleep(delay)
+
+    async def _worker(self):
+        while True:
+            item = await self._queue.get()
+            chat_id = item[0]
+            try:
+                if chat_id in self._deferred:
+                    # Более ранний запрос чата отложен, этот встаёт за ним
+                    self._deferred[chat_id][0].append(item)
+                    continue
+                delay = await self._acquire(chat_id)
+                if delay:
+                    self._defer(chat_id, delay, item)
+                    continue
+                await self._send(item)
+            except Exception as e:
+                self._fail(item, e)
+            finally:
+                self._queue.task_done()
+
+    async def _send(self, item):
+        chat_id, method, args, kwargs, future, submitted, attempt = item
+        try:
+            result = await method(*args, **kwargs)
+        except ApiTelegramException as e:
+            if e.error_code != 429 or attempt >= self.max_retries:
+                raise
+            retry_after = e.result_json.get('parameters', {}).get('retry_after', 1)
+            self.metrics['rate_limited'] += 1
+            bucket = self.global_bucket if chat_id is None else self._chat_bucket(chat_id, time.monotonic())
+            bucket.blocked_until = time.monotonic() + retry_after
+            self._retry(item, retry_after)
+        except (aiohttp.ClientError, asyncio.TimeoutError, RequestTimeout):
+            if attempt >= self.max_retries:
+                raise
+            self._retry(item, 2 ** attempt)
+        else:
+            self.metrics['sent'] += 1
+            self.wait_time += time.monotonic() - submitted
+            if not future.done():
+                future.set_result(result)
+
+    def _fail(self, item, error):
+        chat_id, method, args, kwargs, future, submitted, attempt = item
+        self.metrics['failed'] += 1
+        # Обработчики не ждут отправки, поэтому ошибка записывается здесь.
+        # Клавиатура, которую включили и выключили обратно, не изменилась - это не ошибка
+        if not (isinstance(error, ApiTelegramException) and 'message is not modified' in error.description):
+            logger.warning("Outbound %s to chat %s failed: %s", method.__name__, chat_id, error)
+        if not future.done():
+            future.set_exception(error)
+            # Исключение уже в логе, asyncio не должен ругаться на непрочитанное
+            future.exception()
+
+    def _retry(self, item, delay):
+        self.metrics['retried'] += 1
+        chat_id, method, args, kwargs, future, submitted, attempt = item
+        self._defer(chat_id, delay, (chat_id, method, args, kwargs, future, submitted, attempt + 1))
+
+    def _defer(self, chat_id, delay, item):
+        # Запрос встаёт первым в отложенные запросы чата, они вернутся в очередь через delay секунд
+        loop = asyncio.get_running_loop()
+        items, handle = self._deferred.get(chat_id, (None, None))
+        if items is None:
+            items = collections.deque()
+        items.appendleft(item)
+        when = loop.time() + delay
+        if handle is None or handle.when() < when:
+            if handle is not None:
+                handle.cancel()
+            handle = loop.call_at(when, self._release, chat_id)
+        self._deferred[chat_id] = (items, handle)
+        self.metrics['deferred'] += 1
+
+    def _release(self, chat_id):
+        items, handle = self._deferred.pop(chat_id)
+        for item in items:
+            self._queue.put_nowait(item)
+        self._released.set()
+
+    async def _report_metrics(self):
+        while True:
+            await asyncio.sleep(self.metrics_interval)
+            sent = self.metrics['sent']
+            logger.info("Outbound: %s, queue %s, deferred chats %s, average wait %.3fs", self.metrics,
+                        self._queue.qsize(), len(self._deferred), self.wait_time / sent if sent else 0)
@@ -0,0 +1,72 @@
+import asyncio
+import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+REMINDER_TEXT = "Завтра Вас ждёт путешествие!"
+
+
+class ReminderScheduler:
+    # Напоминания о поездках, начинающихся завтра: просыпается раз в сутки в slot,
+    # выбирает маршруты одним запросом и отправляет напоминания пачками по batch_size
+    # не чаще одной пачки в batch_interval секунд
+    def __init__(self, sender, model, slot, batch_size=25, batch_interval=1.0):
+        self.sender = sender
+        self.model = model
+        self.slot = slot
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+
+    def seconds_until_slot(self, now):
+        slot = datetime.datetime.combine(now.date(), self.slot)
+        if slot <= now:
+            slot += datetime.timedelta(days=1)
+        return (slot - now).total_seconds()
+
+    async def send_reminders(self, today):
+        date_in = today + datetime.timedelta(days=1)
+        routes = await self.model.get_reminders(date_in)
+        if not routes:
+            return 0
+
+        sent = 0
+        for start in range(0, len(routes), self.batch_size):
+            batch = routes[start:start + self.batch_size]
+            # Напоминание записывается до отправки, чтобы другой бот его не повторил.
+            # Если бот упадёт между записью и отправкой, напоминание не придёт:
+            # доставка не более одного раза
+            claimed = await self.model.claim_reminders([reminder.route_id for reminder in batch], date_in)
+            batch = [reminder for reminder in batch if reminder.route_id in claimed]
+            results = await asyncio.gather(*[
+                self.sender.send_message(reminder.chat_id, REMINDER_TEXT) for reminder in batch
+            ], return_exceptions=True)
+
+            failed = []
+            for reminder, result in zip(batch, results):
+                if isinstance(result, Exception):
+                    logger.warning("Reminder for route %s was not delivered: %s", reminder.route_id, result)
+                    failed.append(reminder.route_id)
+                else:
+                    sent += 1
+
+            # Запись о неотправленном напоминании удаляется: временные ошибки очередь исходящих
+            # запросов уже повторила, а после перезапуска бота в тот же день напоминание уйдёт снова
+            if failed and await self.model.release_reminders(failed, date_in) is None:
+                logger.warning("Reminders for routes %s are lost: claim was not released", failed)
+
+            await asyncio.sleep(self.batch_interval)
+
+        return sent
+
+    async def run(self):
+        # После перезапуска пропущенный сегодняшний слот отрабатывается сразу,
+        # уже отправленные напоминания пропускаются по таблице Sent_Reminders
+        now = datetime.datetime.now()
+        if now.time() >= self.slot:
+            await self.send_reminders(now.date())
+
+        while True:
+            await asyncio.sleep(self.seconds_until_slot(datetime.datetime.now()))
+            sent = await self.send_reminders(datetime.date.today())
+            logger.info("Sent %s reminders", sent)
@@ -0,0 +1,77 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def update_chat_id(update):
+    if update.message is not None:
+        return update.message.chat.id
+    if update.callback_query is not None and update.callback_query.message is not None:
+        return update.callback_query.message.chat.id
+    return None
+
+
+class UpdateRunner:
+    # Цикл получения обновлений: обновления одного чата обрабатываются строго по очереди,
+    # разные чаты - параллельно, но не больше concurrency обработчиков одновременно
+    def __init__(self, bot, concurrency, poll_timeout=60):
+        self.bot = bot
+        self.poll_timeout = poll_timeout
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._queues = {}
+        self._workers = set()
+
+    def submit(self, update):
+        chat_id = update_chat_id(update)
+        queue = self._queues.get(chat_id)
+
+        if queue is None:
+            queue = self._queues[chat_id] = asyncio.Queue()
+            worker = asyncio.create_task(self._chat_worker(chat_id, queue))
+            self._workers.add(worker)
+            worker.add_done_callback(self._workers.discard)
+
+        queue.put_nowait(update)
+
+    async def _chat_worker(self, chat_id, queue):
+        # Воркер живёт, пока у чата есть необработанные обновления
+        while not queue.empty():
+            update = queue.get_nowait()
+
+            async with self._semaphore:
+                try:
+                    await self.bot.process_new_updates([update])
+                except Exception:
+                    logger.exception("Error processing update %s", update.update_id)
+
+        del self._queues[chat_id]
+
+    async def drain(self):
+        while self._workers:
+            await asyncio.gather(*self._workers, return_exceptions=True)
+
+    async def run(self):
+        offset = None
+
+        try:
+            while True:
+                try:
+                    updates = await self.bot.get_updates(offset=offset, timeout=self.poll_timeout,
+                                                         request_timeout=self.poll_timeout + 10)
+                except Exception:
+                    logger.exception("Error getting updates")
+                    await asyncio.sleep(3)
+                    continue
+
+                for update in updates:
+                    offset = update.update_id + 1
+                    self.submit(update)
+        except asyncio.CancelledError:
+            # Подтверждаем полученные обновления, иначе после перезапуска они придут снова
+            if offset is not None:
+                try:
+                    await self.bot.get_updates(offset=offset, limit=1, timeout=0)
+                except Exception:
+                    logger.exception("Error confirming updates")
+            raise
@@ -0,0 +1,81 @@
+import time
+
+# Ближайший маршрут ещё не загружался
+UNKNOWN = object()
+
+
+class ChatSession:
+    __slots__ = ('user_id', 'route_id', 'expires')
+
+    def __init__(self, user_id, expires):
+        self.user_id = user_id
+        self.route_id = UNKNOWN
+        self.expires = expires
+
+
+class SessionCache:
+    # Сессии чатов в памяти процесса: id пользователя, привязанного к чату,
+    # и id его ближайшего маршрута. Сессия живёт ttl секунд, поэтому изменения,
+    # сделанные на сайте, видны боту не позже чем через ttl
+    def __init__(self, model, ttl=300, max_size=10000):
+        self.model = model
+        self.ttl = ttl
+        self.max_size = max_size
+        self._sessions = {}
+
+    def _get(self, chat_id):
+        session = self._sessions.get(chat_id)
+        if session is not None and session.expires < time.monotonic():
+            del self._sessions[chat_id]
+            return None
+        return session
+
+    def _purge(self):
+        now = time.monotonic()
+        self._sessions = {key: value for key, value in self._sessions.items() if value.expires >= now}
+
+    async def user_id(self, chat_id):
+        # Неавторизованные чаты не кэшируются: None возвращается и при ошибке базы данных
+        session = self._get(chat_id)
+        if session is not None:
+            return session.user_id
+
+        user = await self.model.get_user_by_tg_username(chat_id)
+        if user is None:
+            return None
+
+        if len(self._sessions) >= self.max_size:
+            self._purge()
+        self._sessions[chat_id] = ChatSession(user.id, time.monotonic() + self.ttl)
+        return user.id
+
+    async def route(self, chat_id):
+        user_id = await self.user_id(chat_id)
+        if user_id is None:
+            return None
+
+        route = await self.model.get_route_fields(user_id)
+        session = self._get(chat_id)
+        if session is not None:
+            session.route_id = route.id if route else None
+        return route
+
+    async def route_id(self, chat_id):
+        session = self._get(chat_id)
+        if session is None or session.route_id is UNKNOWN:
+            route = await self.route(chat_id)
+            return route.id if route else None
+        return session.route_id
+
+    def invalidate(self, chat_id):
+        self._sessions.pop(chat_id, None)
+
+    def invalidate_user(self, user_id):
+        # Для изменений маршрутов пользователя, возвращает чаты пользователя
+        chat_ids = [key for key, value in self._sessions.items() if value.user_id == user_id]
+        for chat_id in chat_ids:
+            del self._sessions[chat_id]
+        return chat_ids
+
+    def clear(self):
+        self._sessions = {}
@@ -0,0 +1,333 @@
+import asyncio
+import datetime
+import json
+import pathlib
+import time
+import unittest
+from types import SimpleNamespace
+
+from telebot.asyncio_helper import ApiTelegramException
+
+from checklists import ChecklistCache
+from outbound import OutboundDispatcher
+from reminders import ReminderScheduler
+from webhook import WebhookApp
+
+ROUTE_ID = 7
+CHAT_ID = 42
+SECRET = 'test-secret'
+UPDATES = pathlib.Path(__file__).parent / 'fixtures' / 'updates'
+
+
+class FakeModel:
+    # Заметки маршрута в "базе данных" и порядок обращений к ней
+    def __init__(self):
+        self.done = {1: False, 2: False}
+        self.calls = []
+        self.fail = False
+
+    async def get_notes_for_route(self, route_id):
+        self.calls.append('read')
+        return [SimpleNamespace(id=note_id, text=f'Заметка {note_id}', done=done) for note_id, done in self.done.items()]
+
+    async def set_notes_done(self, route_id, changed):
+        self.calls.append(('save', dict(changed)))
+        await asyncio.sleep(0.01)
+        if self.fail:
+            return None
+        self.done.update(changed)
+        return len(changed)
+
+
+class FakeSessions:
+    async def route_id(self, chat_id):
+        return ROUTE_ID
+
+
+class FakeSender:
+    def __init__(self):
+        self.edits = []
+
+    async def edit_message_reply_markup(self, chat_id, message_id, reply_markup=None):
+        self.edits.append([button[0].text for button in reply_markup.keyboard])
+
+
+class ChecklistCacheTest(unittest.IsolatedAsyncioTestCase):
+    # Отметки заметок копятся в памяти и записываются одним UPDATE
+
+    async def asyncSetUp(self):
+        self.model = FakeModel()
+        self.sender = FakeSender()
+        self.checklists = ChecklistCache(self.model, FakeSessions(), self.sender, delay=0.01)
+        self.checklist = await self.checklists.open(CHAT_ID)
+
+    async def tap(self, note_id):
+        self.assertTrue(await self.checklists.toggle(CHAT_ID, 100, note_id))
+
+    async def test_taps_are_coalesced(self):
+        for note_id in (1, 2, 2, 2, 1, 1):
+            await self.tap(note_id)
+        flush = self.checklist.flush
+        await flush
+
+        self.assertEqual(self.model.calls, ['read', ('save', {1: True, 2: True})])
+        self.assertEqual(self.model.done, {1: True, 2: True})
+        self.assertEqual(len(self.sender.edits), 1)
+        self.assertIsNone(self.checklist.flush)
+
+    async def test_failed_save_is_rolled_back(self):
+        self.model.fail = True
+        await self.tap(1)
+        await self.checklist.flush
+
+        self.assertFalse(self.checklist.notes[1].done)
+        self.assertEqual(self.model.done, {1: False, 2: False})
+        # клавиатура показывает то, что записано в базе данных
+        self.assertEqual(self.sender.edits, [['❌ Заметка 1', '❌ Заметка 2', 'Назад']])
+
+    async def test_open_waits_for_pending_flush(self):
+        await self.tap(1)
+        checklist = await self.checklists.open(CHAT_ID)
+
+        self.assertEqual(self.model.calls, ['read', ('save', {1: True}), 'read'])
+        self.assertTrue(checklist.notes[1].done)
+        self.assertTrue(checklist.notes[1].saved)
+
+
+class FakeRunner:
+    def __init__(self):
+        self.updates = []
+        self.drained = False
+
+    def submit(self, update):
+        self.updates.append(update)
+
+    async def drain(self):
+        self.drained = True
+
+
+class WebhookAppTest(unittest.IsolatedAsyncioTestCase):
+    # Обновления приходят в WebhookApp так же, как их передаёт uvicorn
+
+    def setUp(self):
+        self.runner = FakeRunner()
+        self.app = WebhookApp(self.runner, SECRET, max_body_size=4096)
+
+    async def post(self, body, secret=SECRET, path='/webhook', chunk=None):
+        headers = [(b'content-type', b'application/json')]
+        if secret is not None:
+            headers.append((b'x-telegram-bot-api-secret-token', secret.encode()))
+        scope = {'type': 'http', 'method': 'POST', 'path': path, 'headers': headers}
+        chunk = chunk or len(body) or 1
+        messages = [{'type': 'http.request', 'body': body[start:start + chunk],
+                     'more_body': start + chunk < len(body)} for start in range(0, len(body) or 1, chunk)]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        await self.app(scope, receive, send)
+        return sent[0]['status']
+
+    async def lifespan(self, *types):
+        messages = [{'type': message_type} for message_type in types]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        await self.app({'type': 'lifespan'}, receive, send)
+        return sent
+
+    @staticmethod
+    def fixture(name):
+        return (UPDATES / name).read_bytes()
+
+    async def test_fixtures_are_submitted(self):
+        self.assertEqual(await self.post(self.fixture('start.json')), 200)
+        self.assertEqual(len(self.runner.updates), 1)
+        self.assertEqual(await self.post(self.fixture('callback_flight.json'), chunk=64), 200)
+
+        self.assertEqual([update.update_id for update in self.runner.updates], [100000001, 100000002])
+        self.assertEqual(self.runner.updates[0].message.text, '/start')
+        self.assertIsNotNone(self.runner.updates[1].callback_query)
+
+    async def test_secret_is_required(self):
+        self.assertEqual(await self.post(self.fixture('start.json'), secret=None), 403)
+        self.assertEqual(await self.post(self.fixture('start.json'), secret='wrong-secret'), 403)
+        self.assertEqual(self.runner.updates, [])
+
+    async def test_body_too_large(self):
+        body = json.dumps({'update_id': 1, 'padding': 'x' * 5000}).encode()
+
+        self.assertEqual(await self.post(body, chunk=1024), 413)
+        self.assertEqual(self.runner.updates, [])
+
+    async def test_malformed_json(self):
+        with self.assertLogs('webhook', 'WARNING'):
+            self.assertEqual(await self.post(b'{"update_id": '), 400)
+            self.assertEqual(await self.post(b'[1, 2]'), 400)
+        self.assertEqual(self.runner.updates, [])
+
+    async def test_rejected_after_shutdown(self):
+        self.assertEqual(await self.lifespan('lifespan.startup', 'lifespan.shutdown'),
+                         ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+
+        self.assertTrue(self.runner.drained)
+        self.assertEqual(await self.post(self.fixture('start.json')), 503)
+        self.assertEqual(self.runner.updates, [])
+
+
+def too_many_requests(retry_after):
+    return ApiTelegramException('sendMessage', None, {'error_code': 429, 'description': 'Too Many Requests',
+                                                      'parameters': {'retry_after': retry_after}})
+
+
+class FakeApi:
+    # Метод бота: первые ответы на текст берутся из errors, затем сообщение "отправлено"
+    def __init__(self):
+        self.errors = {}
+        self.calls = []
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        self.calls.append(text)
+        errors = self.errors.get(text)
+        if errors:
+            raise errors.pop(0)
+        self.sent.append((time.monotonic(), chat_id, text))
+        return text
+
+
+class OutboundDispatcherTest(unittest.IsolatedAsyncioTestCase):
+    # Лимиты Telegram и повторы после ответа 429
+
+    def dispatcher(self, **kwargs):
+        self.api = FakeApi()
+        kwargs = {'global_rate': 1000, 'chat_rate': 1000, 'chat_burst': 1000, 'workers': 4, **kwargs}
+        outbound = OutboundDispatcher(SimpleNamespace(send_message=self.api.send_message), **kwargs)
+        outbound.start()
+        self.addAsyncCleanup(outbound.stop)
+        return outbound
+
+    def sent_texts(self, chat_id):
+        return [text for _, sent_chat_id, text in self.api.sent if sent_chat_id == chat_id]
+
+    async def test_retry_after_defers_chat_in_order(self):
+        outbound = self.dispatcher()
+        self.api.errors['a'] = [too_many_requests(0.1)]
+        started = time.monotonic()
+
+        futures = [outbound.send_message(1, text) for text in 'abc']
+        futures.append(outbound.send_message(2, 'x'))
+        await asyncio.gather(*futures)
+
+        self.assertEqual(self.sent_texts(1), ['a', 'b', 'c'])
+        self.assertEqual(self.api.sent[0][1:], (2, 'x'))
+        self.assertGreaterEqual(self.api.sent[1][0] - started, 0.1)
+        self.assertEqual(outbound.metrics['rate_limited'], 1)
+
+    async def test_chat_bucket(self):
+        outbound = self.dispatcher(chat_rate=20, chat_burst=1)
+
+        await asyncio.gather(*[outbound.send_message(1, text) for text in 'abc'])
+
+        times = [sent_at for sent_at, _, _ in self.api.sent]
+        self.assertEqual(self.sent_texts(1), ['a', 'b', 'c'])
+        self.assertGreaterEqual(times[1] - times[0], 0.04)
+        self.assertGreaterEqual(times[2] - times[1], 0.04)
+
+    async def test_global_bucket(self):
+        outbound = self.dispatcher(global_rate=10)
+        started = time.monotonic()
+
+        await asyncio.gather(*[outbound.send_message(chat_id, 'text') for chat_id in range(15)])
+
+        # 10 запросов сразу, остальные 5 по одному в 0.1 секунды
+        self.assertEqual(len(self.api.sent), 15)
+        self.assertEqual(len([sent_at for sent_at, _, _ in self.api.sent if sent_at - started < 0.05]), 10)
+        self.assertGreaterEqual(self.api.sent[-1][0] - started, 0.45)
+
+    async def test_max_retries(self):
+        outbound = self.dispatcher(max_retries=2)
+        self.api.errors['a'] = [too_many_requests(0.01) for _ in range(5)]
+
+        with self.assertLogs('outbound', 'WARNING'):
+            with self.assertRaises(ApiTelegramException):
+                await outbound.send_message(1, 'a')
+
+        self.assertEqual(self.api.calls, ['a', 'a', 'a'])
+        self.assertEqual(outbound.metrics['retried'], 2)
+        self.assertEqual(outbound.metrics['failed'], 1)
+
+    async def test_stop_waits_for_deferred(self):
+        outbound = self.dispatcher()
+        self.api.errors['a'] = [too_many_requests(0.1)]
+
+        futures = [outbound.send_message(1, text) for text in 'ab']
+        await asyncio.sleep(0.01)
+        self.assertTrue(outbound._deferred)
+        await outbound.stop()
+
+        self.assertEqual([future.result() for future in futures], ['a', 'b'])
+        self.assertEqual(self.sent_texts(1), ['a', 'b'])
+
+
+class FakeReminders:
+    # Таблица Sent_Reminders в памяти
+    def __init__(self, route_ids):
+        self.routes = [SimpleNamespace(route_id=route_id, chat_id=route_id * 10, name='Маршрут')
+                       for route_id in route_ids]
+        self.claimed = set()
+
+    async def get_reminders(self, date_in):
+        return [route for route in self.routes if route.route_id not in self.claimed]
+
+    async def claim_reminders(self, route_ids, date_in):
+        claimed = set(route_ids) - self.claimed
+        self.claimed |= claimed
+        return claimed
+
+    async def release_reminders(self, route_ids, date_in):
+        self.claimed -= set(route_ids)
+        return len(route_ids)
+
+
+class FailingSender:
+    def __init__(self, failing):
+        self.failing = set(failing)
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        if chat_id in self.failing:
+            raise ConnectionError('network is down')
+        self.sent.append(chat_id)
+
+
+class ReminderSchedulerTest(unittest.IsolatedAsyncioTestCase):
+    # Напоминание записывается до отправки, запись о неотправленном удаляется
+
+    async def test_failed_reminder_is_released(self):
+        model = FakeReminders([1, 2, 3])
+        sender = FailingSender([20])
+        reminders = ReminderScheduler(sender, model, datetime.time(10), batch_size=2, batch_interval=0)
+        today = datetime.date(2024, 5, 1)
+
+        with self.assertLogs('reminders', 'WARNING'):
+            self.assertEqual(await reminders.send_reminders(today), 2)
+        self.assertEqual(model.claimed, {1, 3})
+
+        sender.failing.clear()
+        self.assertEqual(await reminders.send_reminders(today), 1)
+        self.assertEqual(sender.sent, [10, 30, 20])
+        self.assertEqual(await reminders.send_reminders(today), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
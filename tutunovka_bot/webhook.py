@@ -0,0 +1,113 @@
+import hmac
+import json
+import logging
+import re
+
+import telebot
+import uvicorn
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = b'x-telegram-bot-api-secret-token'
+# Допустимый секрет setWebhook: 1-256 символов A-Z, a-z, 0-9, _ и -
+SECRET_PATTERN = re.compile(r'[A-Za-z0-9_-]{1,256}')
+
+
+class WebhookApp:
+    # ASGI-приложение для режима webhook: принимает обновления POST-запросом на path,
+    # проверяет секрет из заголовка и ставит обновление в очередь UpdateRunner.
+    # Ответ отправляется сразу после постановки в очередь, не дожидаясь обработки.
+    # Без секрета любой, кто узнал адрес, мог бы присылать поддельные обновления
+    # от имени чужих чатов, поэтому секрет обязателен
+    def __init__(self, runner, secret_token, path='/webhook', max_body_size=1024 * 1024):
+        if not secret_token or not SECRET_PATTERN.fullmatch(secret_token):
+            raise ValueError("Webhook secret must be 1-256 characters of A-Z, a-z, 0-9, _ and -")
+        self.runner = runner
+        self.secret_token = secret_token.encode()
+        self.path = path
+        self.max_body_size = max_body_size
+        self.accepting = True
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        if scope['path'] == '/healthz' and scope['method'] == 'GET':
+            await self._respond(send, 200 if self.accepting else 503)
+            return
+        if scope['path'] != self.path:
+            await self._respond(send, 404)
+            return
+        if scope['method'] != 'POST':
+            await self._respond(send, 405)
+            return
+        if not self.accepting:
+            # Telegram повторит запрос, и его примет другая реплика
+            await self._respond(send, 503)
+            return
+        if not self._check_secret(scope['headers']):
+            await self._respond(send, 403)
+            return
+
+        body = await self._read_body(receive)
+        if body is None:
+            await self._respond(send, 413)
+            return
+
+        try:
+            update = telebot.types.Update.de_json(json.loads(body))
+        except (ValueError, TypeError, KeyError, AttributeError):
+            logger.warning("Malformed update: %r", body[:200])
+            await self._respond(send, 400)
+            return
+
+        self.runner.submit(update)
+        await self._respond(send, 200)
+
+    def _check_secret(self, headers):
+        for name, value in headers:
+            if name == SECRET_HEADER:
+                return hmac.compare_digest(value, self.secret_token)
+        return False
+
+    async def _read_body(self, receive):
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if len(body) > self.max_body_size:
+                return None
+            if not message.get('more_body', False):
+                return body
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                # Новые обновления больше не принимаются, принятые дообрабатываются
+                self.accepting = False
+                await self.runner.drain()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    async def _respond(send, status):
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'text/plain'), (b'content-length', b'0')]})
+        await send({'type': 'http.response.body', 'body': b''})
+
+
+async def serve_webhook(bot, runner, url, secret_token, host, port, path='/webhook', graceful_timeout=30):
+    # Все реплики регистрируют один и тот же url за балансировщиком, повторный
+    # setWebhook с теми же параметрами ничего не меняет
+    app = WebhookApp(runner, secret_token, path=path)
+    await bot.set_webhook(url=url, secret_token=secret_token)
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, lifespan='on',
+                                           timeout_graceful_shutdown=graceful_timeout,
+                                           log_config=None))
+    await server.serve()
@@ -0,0 +1,46 @@
+"""
+gunicorn configuration for the tutun project
+
+Запуск: gunicorn (файл читается из текущего каталога).
+Миграции здесь не выполняются, для них есть отдельный шаг manage.py migrate.
+"""
+
+import os
+
+bind = os.environ.get('WEB_BIND', '0.0.0.0:8000')
+
+# Ядра, доступные контейнеру, а не всей машине
+cores = len(os.sched_getaffinity(0))
+
+# Запросы в основном ждут базу данных, поэтому воркеров больше, чем ядер
+workers = int(os.environ.get('WEB_WORKERS', cores * 2 + 1))
+
+# wsgi (по умолчанию) - tutun/wsgi.py на потоках: каждый воркер обслуживает threads
+# синхронных запросов, а почти все представления синхронные.
+# asgi - tutun/asgi.py на воркерах uvicorn: синхронные представления там выполняются
+# по одному на воркер, поэтому asgi подходит только для отдельного экземпляра,
+# которому прокси передаёт асинхронный /api_yn_map/.
+# В docker-compose такого экземпляра нет, и /api_yn_map/ работает под wsgi через
+# async_to_sync: скрипт карт отдаётся из копии в памяти или на диске, а к Яндексу
+# обращается только первый запрос после истечения MAPS_BUNDLE_TTL. Цикл событий
+# и HTTP-клиент на запрос под wsgi стоят только при этом обновлении,
+# фоновое обновление заранее включается только под asgi
+if os.environ.get('WEB_INTERFACE', 'wsgi') == 'asgi':
+    wsgi_app = 'tutun.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'tutun.wsgi:application'
+    worker_class = 'gthread'
+    threads = int(os.environ.get('WEB_THREADS', 4))
+
+timeout = int(os.environ.get('WEB_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('WEB_KEEPALIVE', 5))
+
+# Воркер перезапускается после max_requests запросов, разброс не даёт всем перезапуститься разом
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('WEB_MAX_REQUESTS_JITTER', 100))
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('WEB_LOG_LEVEL', 'info')
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -29,7 +30,7 @@ SECRET_KEY = os.environ.get('SECRET_KEY')
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = os.environ.get('DEBUG')
 
-ALLOWED_HOSTS = []
+ALLOWED_HOSTS = os.environ.get('ALLOWED_HOSTS', 'localhost,127.0.0.1,[::1]').split(',')
 
 # Application definition
 
@@ -40,6 +41,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'tutun_app',
     'taggit',
 ]
@@ -87,10 +89,35 @@ DATABASES = {
         'USER': os.environ.get('DB_USER'),
         'PASSWORD': os.environ.get('DB_PASSWORD'),
         'HOST': os.environ.get('DB_HOST'),
-        'POST': os.environ.get('DB_PORT')
+        'PORT': os.environ.get('DB_PORT'),
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 0)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# locmem - memory of one process, file - directory shared by the workers of one host,
+# redis - Redis server shared by all hosts (needs the redis package)
+
+CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'tutun'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', os.path.join(tempfile.gettempdir(), 'tutun_cache')),
+    'redis': ('django.core.cache.backends.redis.RedisCache', 'redis://localhost:6379/1'),
+}
+CACHE_BACKEND, CACHE_DEFAULT_LOCATION = CACHE_BACKENDS[os.environ.get('CACHE_BACKEND', 'locmem')]
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.environ.get('CACHE_LOCATION', CACHE_DEFAULT_LOCATION),
+        'KEY_PREFIX': 'tutun',
+    }
+}
+
+if not CACHE_BACKEND.endswith('RedisCache'):
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': int(os.environ.get('CACHE_MAX_ENTRIES', 10000))}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -139,3 +166,46 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 API_YANDEX_MAPS_KEY = os.environ['API_YANDEX_MAPS_KEY']
 SECRET_JWT_KEY = os.environ['SECRET_KEY_JWT']
+
+# Geocoder cache: process LRU size and lifetime (seconds) of found and not found addresses
+GEOCODE_CACHE_SIZE = int(os.environ.get('GEOCODE_CACHE_SIZE', 10000))
+GEOCODE_CACHE_TTL = int(os.environ.get('GEOCODE_CACHE_TTL', 24 * 60 * 60))
+GEOCODE_NEGATIVE_TTL = int(os.environ.get('GEOCODE_NEGATIVE_TTL', 60 * 60))
+# Geocoder requests: timeout (seconds) of one request and max simultaneous requests per process
+GEOCODE_TIMEOUT = float(os.environ.get('GEOCODE_TIMEOUT', 3))
+GEOCODE_CONCURRENCY = int(os.environ.get('GEOCODE_CONCURRENCY', 16))
+
+# How the web process is served: wsgi (gthread, default) or asgi (uvicorn, tutun/asgi.py).
+# Under asgi the worker's event loop outlives requests, under wsgi async views
+# get a new event loop per request
+WEB_INTERFACE = os.environ.get('WEB_INTERFACE', 'wsgi')
+
+# Shared async HTTP client: timeouts (seconds) and max simultaneous connections per process
+HTTP_TIMEOUT = float(os.environ.get('HTTP_TIMEOUT', 10))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 3))
+HTTP_MAX_CONNECTIONS = int(os.environ.get('HTTP_MAX_CONNECTIONS', 100))
+
+# Yandex Maps script cache: lifetime and background refresh lead on the server,
+# browser cache lifetime (seconds) and the directory shared by the workers
+MAPS_BUNDLE_TTL = int(os.environ.get('MAPS_BUNDLE_TTL', 6 * 60 * 60))
+MAPS_BUNDLE_REFRESH_AHEAD = int(os.environ.get('MAPS_BUNDLE_REFRESH_AHEAD', 10 * 60))
+MAPS_BUNDLE_MAX_AGE = int(os.environ.get('MAPS_BUNDLE_MAX_AGE', 60 * 60))
+MAPS_BUNDLE_CACHE_DIR = os.environ.get('MAPS_BUNDLE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'tutun'))
+
+# Number of tags shown in the tag cloud before "load more"
+TAG_CLOUD_SIZE = int(os.environ.get('TAG_CLOUD_SIZE', 20))
+
+# Lifetime (seconds) of cached anonymous public pages and route cards,
+# both are also invalidated when public routes or tags change
+PUBLIC_PAGE_CACHE_TTL = int(os.environ.get('PUBLIC_PAGE_CACHE_TTL', 10 * 60))
+ROUTE_CARD_CACHE_TTL = int(os.environ.get('ROUTE_CARD_CACHE_TTL', 60 * 60))
+# Lifetime (seconds) of cached public route details, also invalidated
+# when the route, its dots or its tags change
+PUBLIC_ROUTE_CACHE_TTL = int(os.environ.get('PUBLIC_ROUTE_CACHE_TTL', 24 * 60 * 60))
+
+# Background job queue (manage.py run_worker): empty queue poll interval, how long a job
+# stays claimed by a worker and retry backoff, all in seconds
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 1))
+JOB_VISIBILITY_TIMEOUT = int(os.environ.get('JOB_VISIBILITY_TIMEOUT', 5 * 60))
+JOB_RETRY_BACKOFF = int(os.environ.get('JOB_RETRY_BACKOFF', 10))
+JOB_RETRY_BACKOFF_MAX = int(os.environ.get('JOB_RETRY_BACKOFF_MAX', 60 * 60))
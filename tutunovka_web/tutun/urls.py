@@ -40,6 +40,8 @@ urlpatterns = [
     path('create_complaint', views.create_complaint, name='create_complaint'),
     path('complaint_answer/<int:complaint_id>', views.complaint_answer, name='complaint_answer'),
     path('public_routes/', views.PublicRoutesPage.as_view(), name='public_routes'),
+    path('public_routes/facets/', views.public_routes_facets, name='public_routes_facets'),
+    path('public_routes/tag_cloud/', views.public_routes_tag_cloud, name='public_routes_tag_cloud'),
     path('public_routes/tags/<str:tag>/', views.PublicRoutesTagsPage.as_view(), name='public_routes_by_tags'),
     path('public_routes_search/', views.PublicRoutesSearchResults.as_view(), name='search_results_public'),
     path('public_routes_search/', views.PublicRoutesSearchResults.as_view(), name='search_results_public'),
@@ -48,4 +50,6 @@ urlpatterns = [
     path('get_tg_bot_token/', views.get_tg_token, name='tg_token'),
     path('get_tg_bot_token/', views.get_tg_token, name='tg_token'),
     path('api_yn_map/', views.yandex_maps, name='api_yn_map'),
+    path('healthz/live/', views.health_live, name='health_live'),
+    path('healthz/ready/', views.health_ready, name='health_ready'),
 ]
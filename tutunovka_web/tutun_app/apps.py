@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class TutunAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tutun_app'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,166 @@
+"""
+faceted filtering of public routes for the tutun_app application
+"""
+
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import F, Q
+
+from .models import PublicRoute, PublicRouteFacet
+
+# Диапазоны продолжительности поездки: ключ, название, от и до (включительно) дней
+LENGTH_RANGES = [
+    ('0-3', 'До 3 дней', 0, 3),
+    ('4-7', '4–7 дней', 4, 7),
+    ('8-14', '8–14 дней', 8, 14),
+    ('15-', 'Больше 2 недель', 15, None),
+]
+
+FACETS = ('tag', 'month', 'year', 'length')
+
+
+def length_range(length):
+    """
+    @return: ключ и название диапазона продолжительности
+    @rtype: tuple
+    """
+
+    for key, label, start, end in LENGTH_RANGES:
+        if length >= start and (end is None or length <= end):
+            return key, label
+
+    return None
+
+
+def route_facet_values(route):
+    """
+    Значения фильтров, к которым относится маршрут
+
+    @param route: публичный маршрут
+    @type route: :class:`PublicRoute`
+
+    @return: список (фильтр, значение, название)
+    @rtype: list
+    """
+
+    values = [('tag', tag.slug, tag.name) for tag in route.tags.all()]
+
+    if route.month is not None:
+        values.append(('month', str(route.month), route.get_month_display()))
+
+    if route.year is not None:
+        values.append(('year', str(route.year), str(route.year)))
+
+    if route.length is not None and length_range(route.length) is not None:
+        values.append(('length', *length_range(route.length)))
+
+    return values
+
+
+def change_facet_counts(values, delta):
+    """
+    Изменение счётчиков фильтров на delta без пересчёта COUNT(*)
+
+    @param values: список (фильтр, значение, название)
+    @type values: list
+
+    @param delta: +1 при публикации маршрута, -1 при удалении
+    @type delta: int
+    """
+
+    if not values:
+        return
+
+    with transaction.atomic():
+        PublicRouteFacet.objects.bulk_create([
+            PublicRouteFacet(facet=facet, value=value, label=label) for facet, value, label in values
+        ], ignore_conflicts=True)
+
+        condition = Q()
+
+        for facet, value, _ in values:
+            condition |= Q(facet=facet, value=value)
+
+        PublicRouteFacet.objects.filter(condition).update(count=F('count') + delta)
+
+
+def rebuild_facet_counts():
+    """
+    Полный пересчёт счётчиков фильтров
+    """
+
+    counts = Counter()
+    labels = {}
+
+    for route in PublicRoute.objects.prefetch_related('tags').iterator(chunk_size=500):
+        for facet, value, label in route_facet_values(route):
+            counts[facet, value] += 1
+            labels[facet, value] = label
+
+    with transaction.atomic():
+        PublicRouteFacet.objects.all().delete()
+        PublicRouteFacet.objects.bulk_create([
+            PublicRouteFacet(facet=facet, value=value, label=labels[facet, value], count=count)
+            for (facet, value), count in counts.items()
+        ])
+
+
+def get_facet_counts():
+    """
+    Счётчики всех фильтров одним запросом
+
+    @return: словарь фильтр -> список {'value', 'label', 'count'}
+    @rtype: dict
+    """
+
+    facets = {facet: [] for facet in FACETS}
+
+    for item in PublicRouteFacet.objects.filter(count__gt=0).order_by('facet', '-count', 'value'):
+        facets[item.facet].append({'value': item.value, 'label': item.label, 'count': item.count})
+
+    facets['month'].sort(key=lambda item: int(item['value']))
+    facets['year'].sort(key=lambda item: int(item['value']), reverse=True)
+    facets['length'].sort(key=lambda item: [key for key, *_ in LENGTH_RANGES].index(item['value']))
+
+    return facets
+
+
+def filter_public_routes(queryset, params):
+    """
+    Фильтрация маршрутов по выбранным значениям фильтров.
+    Несколько тегов объединяются по И, некорректные значения игнорируются.
+
+    @param queryset: маршруты
+    @type queryset: :class:`django.db.models.QuerySet`
+
+    @param params: параметры строки запроса (tag, month, year, length)
+    @type params: :class:`django.http.QueryDict`
+
+    @return: отфильтрованные маршруты и словарь выбранных значений
+    @rtype: tuple
+    """
+
+    selected = {'tag': []}
+
+    for slug in params.getlist('tag'):
+        queryset = queryset.filter(tags__slug=slug)
+        selected['tag'].append(slug)
+
+    for facet in ('month', 'year'):
+        value = params.get(facet, '')
+
+        if value.isdigit():
+            queryset = queryset.filter(**{facet: int(value)})
+            selected[facet] = value
+
+    for key, label, start, end in LENGTH_RANGES:
+        if params.get('length') == key:
+            queryset = queryset.filter(length__gte=start)
+
+            if end is not None:
+                queryset = queryset.filter(length__lte=end)
+
+            selected['length'] = key
+
+    return queryset, selected
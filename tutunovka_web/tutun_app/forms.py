@@ -11,6 +11,7 @@ from django.contrib.auth.models import User
 from taggit.models import Tag
 
 from .models import PrivateRoute, PrivateDot, Note, Complaint
+from .tag_catalogue import get_tag_choices
 
 
 class UserRegisterForm(UserCreationForm):
@@ -119,6 +120,7 @@ class PrivateDotForm(forms.ModelForm):
     """
     Форма точки для приватного маршрута
     """
+    id = forms.IntegerField(required=False, widget=forms.HiddenInput)
     date = forms.DateField(
         label='Дата',
         required=False,
@@ -127,6 +129,7 @@ class PrivateDotForm(forms.ModelForm):
     note = forms.CharField(
         label='Заметка',
         required=False,
+        empty_value=None,
         widget=forms.Textarea(attrs={'class': 'form-control'})
     )
 
@@ -154,8 +157,9 @@ class PrivateRouteForm(forms.ModelForm):
     Форма приватного маршрута
     """
 
-    tags = forms.ModelMultipleChoiceField(
-        queryset=Tag.objects.all(),
+    tags = forms.TypedMultipleChoiceField(
+        choices=get_tag_choices,
+        coerce=int,
         widget=forms.CheckboxSelectMultiple,
         required=False,
         label='Теги'
@@ -201,12 +205,23 @@ class PrivateRouteForm(forms.ModelForm):
             'date_out': forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}),
         }
 
+    def clean_tags(self):
+        """
+        Выбранные теги, варианты выбора берутся из кэшированного каталога тегов
+
+        @return: список тегов
+        @rtype: list
+        """
+
+        return list(Tag.objects.filter(id__in=self.cleaned_data['tags']))
+
 
 class NoteForm(forms.ModelForm):
     """
     Форма заметок
     """
 
+    id = forms.IntegerField(required=False, widget=forms.HiddenInput)
     text = forms.CharField(label='Заметка')
 
     class Meta:
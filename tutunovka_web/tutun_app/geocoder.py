@@ -0,0 +1,334 @@
+"""
+geocoder for the tutun_app application
+"""
+
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from django.apps import apps
+
+from tutun.settings import API_YANDEX_MAPS_KEY, GEOCODE_CACHE_SIZE, GEOCODE_CACHE_TTL, \
+    GEOCODE_NEGATIVE_TTL, GEOCODE_CONCURRENCY, GEOCODE_TIMEOUT
+from .models import GeocodeCache
+from .tasks import enqueue
+
+GEOCODER_URL = 'https://geocode-maps.yandex.ru/1.x/'
+
+GeoPoint = namedtuple('GeoPoint', ['longitude', 'latitude', 'name'])
+
+_MISSING = object()
+
+
+def normalize_address(address):
+    """
+    Приведение адреса к ключу кэша
+
+    @param address: адрес или название точки
+    @type address: basestring
+
+    @return: адрес в нижнем регистре без лишних пробелов
+    @rtype: basestring
+    """
+
+    return ' '.join(str(address or '').split()).casefold()
+
+
+class LRUCache:
+    """
+    Потокобезопасный LRU-кэш процесса с ограничением времени жизни записей
+
+    @param maxsize: максимальное количество записей
+    @type maxsize: int
+
+    @param ttl: время жизни найденных адресов в секундах
+    @type ttl: int
+
+    @param negative_ttl: время жизни ненайденных адресов в секундах
+    @type negative_ttl: int
+    """
+
+    def __init__(self, maxsize, ttl, negative_ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        @return: закэшированное значение (None для ненайденного адреса) либо _MISSING
+        """
+
+        with self._lock:
+            item = self._data.get(key)
+
+            if item is None:
+                return _MISSING
+
+            expires, value = item
+
+            if expires < time.monotonic():
+                del self._data[key]
+                return _MISSING
+
+            self._data.move_to_end(key)
+
+            return value
+
+    def set(self, key, value):
+        """
+        Сохранение значения, None сохраняется на negative_ttl
+        """
+
+        ttl = self.ttl if value is not None else self.negative_ttl
+
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """
+        Очистка кэша
+        """
+
+        with self._lock:
+            self._data.clear()
+
+
+_memory_cache = LRUCache(GEOCODE_CACHE_SIZE, GEOCODE_CACHE_TTL, GEOCODE_NEGATIVE_TTL)
+
+# Общие для всего процесса пул соединений и пул потоков:
+# размер пула потоков ограничивает число одновременных запросов к геокодеру
+_session = requests.Session()
+_session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=GEOCODE_CONCURRENCY))
+_executor = ThreadPoolExecutor(max_workers=GEOCODE_CONCURRENCY, thread_name_prefix='geocoder')
+
+
+def _from_db(entry):
+    """
+    @return: точка из записи таблицы кэша, None для ненайденного адреса
+    либо _MISSING, если отрицательная запись устарела
+    """
+
+    if entry.longitude is not None:
+        return GeoPoint(entry.longitude, entry.latitude, entry.name)
+
+    if time.time() - entry.updated.timestamp() > GEOCODE_NEGATIVE_TTL:
+        return _MISSING
+
+    return None
+
+
+def _fetch(address):
+    """
+    Запрос координат точки у yandex api geocoder
+
+    @return: найденная точка либо None, если адрес не найден
+    @rtype: :class:`GeoPoint`
+
+    @raise: :class:`requests.exceptions.RequestException` если геокодер недоступен
+    """
+
+    response = _session.get(url=GEOCODER_URL, params={
+        'lang': 'ru_RU',
+        'apikey': API_YANDEX_MAPS_KEY,
+        'format': 'json',
+        'geocode': address,
+    }, timeout=GEOCODE_TIMEOUT)
+    response.raise_for_status()
+
+    try:
+        members = response.json()['response']['GeoObjectCollection']['featureMember']
+    except (KeyError, ValueError) as e:
+        raise requests.exceptions.RequestException(f'Некорректный ответ геокодера: {e}')
+
+    if not members:
+        return None
+
+    geo_object = members[0]['GeoObject']
+    longitude, latitude = geo_object['Point']['pos'].split()
+
+    return GeoPoint(float(longitude), float(latitude), geo_object['name'])
+
+
+def geocode_many(addresses):
+    """
+    Получение координат сразу для всех точек маршрута.
+    Сначала ищет адреса в кэше процесса, затем одним запросом в таблице кэша,
+    а оставшиеся адреса запрашивает у yandex api geocoder одновременно,
+    поэтому время ответа определяется самым медленным запросом, а не их суммой.
+
+    @param addresses: адреса или названия точек
+    @type addresses: list
+
+    @return: словарь адрес -> найденная точка (None, если адрес не найден);
+    адресов, для которых геокодер был недоступен, в словаре нет
+    @rtype: dict
+    """
+
+    keys = {}
+
+    for address in addresses:
+        key = normalize_address(address)
+
+        if key:
+            keys.setdefault(key, address)
+
+    # пустой адрес геокодировать бессмысленно, считаем его ненайденным
+    found = {'': None}
+
+    for key in keys:
+        point = _memory_cache.get(key)
+
+        if point is not _MISSING:
+            found[key] = point
+
+    missing = [key for key in keys if key not in found]
+
+    if missing:
+        for entry in GeocodeCache.objects.filter(address__in=missing):
+            point = _from_db(entry)
+
+            if point is not _MISSING:
+                found[entry.address] = point
+                _memory_cache.set(entry.address, point)
+
+    futures = {key: _executor.submit(_fetch, keys[key]) for key in keys if key not in found}
+
+    if futures:
+        wait(futures.values(), timeout=GEOCODE_TIMEOUT * 2)
+        fetched = {}
+
+        for key, future in futures.items():
+            if future.done() and future.exception() is None:
+                fetched[key] = future.result()
+
+        GeocodeCache.objects.bulk_create([
+            GeocodeCache(
+                address=key,
+                longitude=point.longitude if point else None,
+                latitude=point.latitude if point else None,
+                name=point.name if point else None,
+            ) for key, point in fetched.items()
+        ], update_conflicts=True, unique_fields=['address'],
+            update_fields=['longitude', 'latitude', 'name', 'updated'])
+
+        for key, point in fetched.items():
+            _memory_cache.set(key, point)
+
+        found.update(fetched)
+
+    return {address: found[key] for key, address in
+            ((normalize_address(address), address) for address in addresses) if key in found}
+
+
+def geocode_dots(model, dot_ids):
+    """
+    Сохранение координат в точках маршрута, задача фоновой очереди.
+    Обрабатывает только точки, у которых information изменилась
+    с момента последнего геокодирования.
+
+    @param model: модель точек, 'tutun_app.PrivateDot' или 'tutun_app.PublicDot'
+    @type model: basestring
+
+    @param dot_ids: id точек
+    @type dot_ids: list
+
+    @raise: :class:`requests.exceptions.RequestException` если геокодер был недоступен
+    хотя бы для одной точки, чтобы очередь повторила задачу
+    """
+
+    model = apps.get_model(model)
+    dots = [dot for dot in model.objects.filter(id__in=dot_ids) if dot.geocoded_information != dot.information]
+
+    if not dots:
+        return
+
+    points = geocode_many([dot.information for dot in dots])
+    geocoded = []
+
+    for dot in dots:
+        if dot.information not in points:
+            continue
+
+        point = points[dot.information]
+
+        dot.longitude = point.longitude if point else None
+        dot.latitude = point.latitude if point else None
+        dot.geo_name = point.name if point else None
+        dot.geocoded_information = dot.information
+
+        geocoded.append(dot)
+
+    model.objects.bulk_update(geocoded, ['longitude', 'latitude', 'geo_name', 'geocoded_information'])
+
+    if len(geocoded) < len(dots):
+        raise requests.exceptions.RequestException('Геокодер недоступен')
+
+
+def schedule_geocoding(model, dot_ids):
+    """
+    Постановка геокодирования точек в фоновую очередь,
+    чтобы запрос пользователя не ждал ответа геокодера
+
+    @param model: модель точек
+    @type model: :class:`PrivateDot` / `PublicDot`
+
+    @param dot_ids: id точек
+    @type dot_ids: list
+    """
+
+    dot_ids = list(dot_ids)
+
+    if dot_ids:
+        enqueue('tutun_app.geocoder.geocode_dots', model=model._meta.label, dot_ids=dot_ids)
+
+
+def map_points(dots, with_date=False):
+    """
+    Точки маршрута с сохранёнными координатами для отображения на карте
+
+    @param dots: точки маршрута
+    @type dots: list
+
+    @param with_date: добавлять ли дату точки
+    @type with_date: bool
+
+    @return: точки для карты, названия точек, которые геокодер не нашёл,
+    и есть ли точки, ещё не геокодированные
+    @rtype: tuple
+    """
+
+    points = []
+    missing = []
+    pending = False
+
+    for dot in dots:
+        if dot.geocoded_information != dot.information:
+            pending = True
+            continue
+
+        if dot.longitude is None:
+            missing.append(dot.name)
+            continue
+
+        point = {
+            'name': dot.name,
+            'coords': [dot.longitude, dot.latitude],
+            'inf': dot.geo_name,
+        }
+
+        if with_date:
+            point['date'] = str(dot.date)
+
+        points.append(point)
+
+    return points, missing, pending
@@ -0,0 +1,53 @@
+"""
+shared async http client for the tutun_app application
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+
+import httpx
+
+from tutun.settings import HTTP_TIMEOUT, HTTP_CONNECT_TIMEOUT, HTTP_MAX_CONNECTIONS, WEB_INTERFACE
+
+_clients = {}
+
+
+def _create_client():
+    """
+    @return: HTTP-клиент с ограничением соединений и таймаутами
+    @rtype: :class:`httpx.AsyncClient`
+    """
+
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                            max_keepalive_connections=HTTP_MAX_CONNECTIONS),
+    )
+
+
+@asynccontextmanager
+async def open_http_client():
+    """
+    Асинхронный HTTP-клиент для текущего цикла событий.
+    Под ASGI у воркера один цикл событий на все запросы, поэтому клиент общий
+    и соединения с внешними сервисами переиспользуются между запросами.
+    Под WSGI async_to_sync создаёт цикл событий на каждый запрос и закрывает его
+    вместе с запросом, поэтому клиент закрывается сразу после использования:
+    пул соединений закрытого цикла уже нельзя закрыть
+
+    @return: HTTP-клиент
+    @rtype: :class:`httpx.AsyncClient`
+    """
+
+    if WEB_INTERFACE != 'asgi':
+        async with _create_client() as client:
+            yield client
+        return
+
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+
+    if client is None:
+        client = _clients[loop] = _create_client()
+
+    yield client
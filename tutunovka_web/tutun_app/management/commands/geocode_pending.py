@@ -0,0 +1,32 @@
+"""
+geocode_pending command for the tutun_app application
+"""
+
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+
+from tutun_app.geocoder import schedule_geocoding
+from tutun_app.models import PrivateDot, PublicDot
+
+
+class Command(BaseCommand):
+    """
+    Повторная постановка в очередь геокодирования точек без координат
+    """
+
+    help = 'Ставит в очередь геокодирование точек, которые ещё не геокодированы ' \
+           '(например, после того как задачи исчерпали попытки)'
+
+    def handle(self, *args, **options):
+        """
+        Ставит задачи для приватных и публичных точек
+        """
+
+        for model in (PrivateDot, PublicDot):
+            dot_ids = list(model.objects.filter(
+                Q(geocoded_information__isnull=True) | ~Q(geocoded_information=F('information'))
+            ).values_list('id', flat=True))
+
+            schedule_geocoding(model, dot_ids)
+
+            self.stdout.write(f'{model._meta.label}: поставлено точек {len(dot_ids)}')
@@ -0,0 +1,37 @@
+"""
+rebuild_facets command for the tutun_app application
+"""
+
+from django.core.management.base import BaseCommand
+
+from tutun_app.facets import rebuild_facet_counts
+from tutun_app.models import PublicRouteFacet
+
+
+class Command(BaseCommand):
+    """
+    Пересчёт счётчиков фильтров публичных маршрутов
+    """
+
+    help = 'Пересчитывает счётчики фильтров публичных маршрутов с нуля'
+
+    def add_arguments(self, parser):
+        """
+        Аргументы команды
+        """
+
+        parser.add_argument('--if-empty', action='store_true',
+                            help='Пересчитать, только если счётчиков ещё нет (шаг migrate при развёртывании)')
+
+    def handle(self, *args, **options):
+        """
+        Пересчитывает счётчики
+        """
+
+        if options['if_empty'] and PublicRouteFacet.objects.exists():
+            self.stdout.write('Счётчики фильтров уже есть')
+            return
+
+        rebuild_facet_counts()
+
+        self.stdout.write('Счётчики фильтров пересчитаны')
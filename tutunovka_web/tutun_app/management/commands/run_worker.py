@@ -0,0 +1,121 @@
+"""
+run_worker command for the tutun_app application
+"""
+
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import InterfaceError, OperationalError, close_old_connections, connections
+
+from tutun.settings import JOB_POLL_INTERVAL, JOB_VISIBILITY_TIMEOUT
+from tutun_app.tasks import claim_job, run_job
+
+logger = logging.getLogger(__name__)
+
+# Пауза перед повтором, если база данных недоступна: удваивается до DB_RETRY_MAX секунд
+DB_RETRY_MIN = 1
+DB_RETRY_MAX = 60
+
+
+def work(poll_interval, visibility_timeout):
+    """
+    Цикл одного обработчика: забирает задачи из очереди, пока не получит SIGTERM/SIGINT.
+    Текущая задача при остановке дорабатывается до конца.
+
+    @param poll_interval: пауза в секундах, если очередь пуста
+    @type poll_interval: float
+
+    @param visibility_timeout: на сколько секунд задача закрепляется за обработчиком
+    @type visibility_timeout: int
+    """
+
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    retry_delay = DB_RETRY_MIN
+
+    try:
+        while not stopping:
+            try:
+                job = claim_job(visibility_timeout)
+
+                if job is None:
+                    time.sleep(poll_interval)
+                    continue
+
+                run_job(job)
+            except (OperationalError, InterfaceError):
+                # База перезапускается или соединение оборвалось: обработчик не завершается,
+                # а ждёт и подключается заново. Задача, которую не удалось сохранить,
+                # вернётся в очередь после visibility_timeout
+                logger.exception('Database is unavailable, retry in %s s', retry_delay)
+                close_old_connections()
+                time.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, DB_RETRY_MAX)
+            else:
+                retry_delay = DB_RETRY_MIN
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    """
+    Запуск обработчиков фоновой очереди задач
+    """
+
+    help = 'Запускает N процессов-обработчиков фоновой очереди задач'
+
+    def add_arguments(self, parser):
+        """
+        Аргументы команды
+        """
+
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                            help='Количество процессов-обработчиков')
+        parser.add_argument('--poll-interval', type=float, default=JOB_POLL_INTERVAL,
+                            help='Пауза в секундах, если очередь пуста')
+        parser.add_argument('--visibility-timeout', type=int, default=JOB_VISIBILITY_TIMEOUT,
+                            help='На сколько секунд задача закрепляется за обработчиком')
+
+    def handle(self, *args, **options):
+        """
+        Запускает обработчики и ждёт их завершения
+        """
+
+        args = (options['poll_interval'], options['visibility_timeout'])
+
+        if options['processes'] <= 1:
+            self.stdout.write('Запущен 1 обработчик')
+            work(*args)
+            return
+
+        # соединения с базой нельзя разделять между процессами
+        connections.close_all()
+
+        workers = [multiprocessing.Process(target=work, args=args, daemon=True)
+                   for _ in range(options['processes'])]
+
+        for worker in workers:
+            worker.start()
+
+        self.stdout.write(f'Запущено обработчиков: {len(workers)}')
+
+        def stop(signum, frame):
+            for worker in workers:
+                if worker.is_alive():
+                    os.kill(worker.pid, signal.SIGTERM)
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        for worker in workers:
+            worker.join()
@@ -0,0 +1,42 @@
+"""
+update_search_index command for the tutun_app application
+"""
+
+from django.core.management.base import BaseCommand
+
+from tutun_app.models import PublicRoute
+from tutun_app.search import update_search_index
+
+
+class Command(BaseCommand):
+    """
+    Пересчёт поисковых векторов публичных маршрутов
+    """
+
+    help = 'Пересчитывает поисковые векторы публичных маршрутов (по умолчанию только пустые)'
+
+    def add_arguments(self, parser):
+        """
+        Аргументы команды
+        """
+
+        parser.add_argument('--all', action='store_true',
+                            help='Пересчитать векторы всех маршрутов, а не только пустые')
+
+    def handle(self, *args, **options):
+        """
+        Пересчитывает векторы маршрутов
+        """
+
+        routes = PublicRoute.objects.prefetch_related('dots', 'tags')
+
+        if not options['all']:
+            routes = routes.filter(search_vector__isnull=True)
+
+        count = 0
+
+        for route in routes.iterator(chunk_size=500):
+            update_search_index(route)
+            count += 1
+
+        self.stdout.write(f'Обновлено маршрутов: {count}')
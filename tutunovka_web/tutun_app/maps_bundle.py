@@ -0,0 +1,267 @@
+"""
+cached proxy of the Yandex Maps JS bundle for the tutun_app application
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+
+import httpx
+
+from tutun.settings import API_YANDEX_MAPS_KEY, MAPS_BUNDLE_CACHE_DIR, MAPS_BUNDLE_TTL, \
+    MAPS_BUNDLE_REFRESH_AHEAD, WEB_INTERFACE
+from .http_client import open_http_client
+
+logger = logging.getLogger(__name__)
+
+YANDEX_MAPS_URL = "https://api-maps.yandex.ru/v3/"
+
+# Как часто устаревшая копия сверяется с копией на диске, секунды
+DISK_CHECK_INTERVAL = 5
+
+# Через сколько секунд повторять неудавшееся обновление
+REFRESH_RETRY_DELAY = 60
+
+
+@dataclass(frozen=True)
+class MapsBundle:
+    """
+    Скрипт Яндекс Карт с вырезанным ключом API
+
+    @param: body: тело скрипта
+    @type: body: bytes
+
+    @param: etag: ETag тела скрипта
+    @type: etag: basestring
+
+    @param: last_modified: время изменения скрипта, секунды от эпохи
+    @type: last_modified: float
+
+    @param: fetched: время последней проверки у Яндекса, секунды от эпохи
+    @type: fetched: float
+
+    @param: upstream_etag: ETag ответа Яндекса для условного запроса
+    @type: upstream_etag: basestring
+
+    @param: upstream_last_modified: Last-Modified ответа Яндекса для условного запроса
+    @type: upstream_last_modified: basestring
+    """
+
+    body: bytes
+    etag: str
+    last_modified: float
+    fetched: float
+    upstream_etag: str = ''
+    upstream_last_modified: str = ''
+
+
+class MapsBundleCache:
+    """
+    Кэш скрипта Яндекс Карт в памяти процесса и на диске.
+    Скрипт запрашивается у Яндекса один раз на ttl секунд условным запросом,
+    а запросы пользователей получают сохранённую копию. Под ASGI копия обновляется
+    в фоне за refresh_ahead секунд до истечения, под WSGI её обновляет первый запрос
+    после истечения. Если Яндекс недоступен, отдаётся устаревшая копия.
+    Копия на диске общая для воркеров и переживает перезапуск.
+
+    @param url: адрес скрипта
+    @type url: basestring
+
+    @param key: ключ API, который вырезается из скрипта
+    @type key: basestring
+
+    @param cache_dir: каталог копии на диске
+    @type cache_dir: basestring
+
+    @param ttl: сколько секунд копия считается свежей
+    @type ttl: float
+
+    @param refresh_ahead: за сколько секунд до истечения начинается фоновое обновление
+    @type refresh_ahead: float
+
+    @param background: можно ли обновлять в фоне: цикл событий живёт дольше запроса
+    @type background: bool
+    """
+
+    def __init__(self, url, key, cache_dir, ttl, refresh_ahead, background):
+        self.url = url
+        self.key = key
+        self.path = os.path.join(cache_dir, 'maps_bundle.js')
+        self.ttl = ttl
+        self.refresh_ahead = min(refresh_ahead, ttl)
+        self.background = background
+        self.bundle = None
+        self._refresh = None
+        self._checked = 0.0
+        self._retry_at = 0.0
+
+    async def get(self):
+        """
+        Копия скрипта для ответа пользователю.
+        Ждёт Яндекс только если копии нет ни в памяти, ни на диске
+
+        @return: скрипт
+        @rtype: :class:`MapsBundle`
+        """
+
+        now = time.time()
+
+        stale = self.bundle is None or now >= self.bundle.fetched + self.ttl - self.refresh_ahead
+
+        if stale and now >= self._checked + DISK_CHECK_INTERVAL:
+            # Копию мог обновить другой воркер
+            self._checked = now
+            stored = await asyncio.to_thread(self.load)
+            if stored is not None and (self.bundle is None or stored.fetched > self.bundle.fetched):
+                self.bundle = stored
+
+        if self.bundle is None:
+            # Одновременные первые запросы ждут один запрос к Яндексу
+            return await asyncio.shield(self.start_refresh())
+
+        if now < self._retry_at:
+            return self.bundle
+
+        if now >= self.bundle.fetched + self.ttl:
+            if self.refreshing_elsewhere():
+                return self.bundle
+
+            # Фонового обновления не было или оно не успело, запрос ждёт обновление сам
+            try:
+                return await asyncio.shield(self.start_refresh())
+            except httpx.HTTPError:
+                return self.bundle
+
+        if self.background and now >= self.bundle.fetched + self.ttl - self.refresh_ahead:
+            # Под WSGI цикл событий закрывается вместе с запросом и отменил бы
+            # фоновое обновление, не дав ему закончиться
+            self.start_refresh()
+
+        return self.bundle
+
+    def refreshing_elsewhere(self):
+        """
+        @return: идёт ли обновление в цикле событий другого запроса (под WSGI у каждого
+        запроса свой цикл), тогда запрос отдаёт текущую копию, а не запускает ещё одно
+        @rtype: bool
+        """
+
+        refresh = self._refresh
+
+        return (refresh is not None and not refresh.done() and refresh.get_loop() is not asyncio.get_running_loop()
+                and not refresh.get_loop().is_closed())
+
+    def start_refresh(self):
+        """
+        Запуск обновления, если оно ещё не идёт в текущем цикле событий
+
+        @return: задача обновления
+        @rtype: :class:`asyncio.Task`
+        """
+
+        loop = asyncio.get_running_loop()
+
+        if self._refresh is None or self._refresh.done() or self._refresh.get_loop() is not loop:
+            self._refresh = loop.create_task(self.refresh())
+            self._refresh.add_done_callback(self._log_refresh)
+
+        return self._refresh
+
+    @staticmethod
+    def _log_refresh(task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Maps bundle was not refreshed: %s", task.exception())
+
+    async def refresh(self):
+        """
+        Запрос скрипта у Яндекса. Если скрипт не изменился (304),
+        продлевается срок существующей копии
+
+        @return: скрипт
+        @rtype: :class:`MapsBundle`
+        """
+
+        headers = {}
+        if self.bundle is not None:
+            if self.bundle.upstream_etag:
+                headers['If-None-Match'] = self.bundle.upstream_etag
+            if self.bundle.upstream_last_modified:
+                headers['If-Modified-Since'] = self.bundle.upstream_last_modified
+
+        try:
+            async with open_http_client() as client:
+                response = await client.get(self.url, params={'apikey': self.key, 'lang': 'ru_RU'}, headers=headers)
+            if response.status_code != 304 or self.bundle is None:
+                response.raise_for_status()
+        except httpx.HTTPError:
+            # Пока Яндекс недоступен, запросы не ждут его на каждом обращении
+            self._retry_at = time.time() + REFRESH_RETRY_DELAY
+            raise
+
+        now = time.time()
+
+        if response.status_code == 304 and self.bundle is not None:
+            bundle = MapsBundle(**{**asdict(self.bundle), 'fetched': now})
+        else:
+            body = response.text.replace(self.key, 'api_key_hidden').encode()
+            etag = '"%s"' % hashlib.sha256(body).hexdigest()[:32]
+            unchanged = self.bundle is not None and self.bundle.etag == etag
+            bundle = MapsBundle(
+                body=body,
+                etag=etag,
+                last_modified=self.bundle.last_modified if unchanged else now,
+                fetched=now,
+                upstream_etag=response.headers.get('ETag', ''),
+                upstream_last_modified=response.headers.get('Last-Modified', ''),
+            )
+
+        self.bundle = bundle
+        await asyncio.to_thread(self.save, bundle)
+        return bundle
+
+    def load(self):
+        """
+        @return: копия с диска или None
+        @rtype: :class:`MapsBundle`
+        """
+
+        try:
+            with open(self.path + '.json', encoding='utf-8') as meta_file:
+                meta = json.load(meta_file)
+            with open(self.path, 'rb') as body_file:
+                body = body_file.read()
+            bundle = MapsBundle(body=body, **meta)
+        except (OSError, ValueError, TypeError):
+            return None
+
+        # Тело и метаданные записываются разными файлами, проверяем, что они от одной версии
+        return bundle if '"%s"' % hashlib.sha256(body).hexdigest()[:32] == bundle.etag else None
+
+    def save(self, bundle):
+        """
+        Атомарная запись копии на диск, ошибки записи не мешают отдавать копию из памяти
+
+        @param bundle: скрипт
+        @type bundle: :class:`MapsBundle`
+        """
+
+        meta = {key: value for key, value in asdict(bundle).items() if key != 'body'}
+
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            for path, content in ((self.path, bundle.body), (self.path + '.json', json.dumps(meta).encode())):
+                descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(self.path))
+                with os.fdopen(descriptor, 'wb') as temporary_file:
+                    temporary_file.write(content)
+                os.replace(temporary, path)
+        except OSError as e:
+            logger.warning("Maps bundle was not saved: %s", e)
+
+
+MAPS_BUNDLE = MapsBundleCache(YANDEX_MAPS_URL, API_YANDEX_MAPS_KEY, MAPS_BUNDLE_CACHE_DIR,
+                              MAPS_BUNDLE_TTL, MAPS_BUNDLE_REFRESH_AHEAD, background=WEB_INTERFACE == 'asgi')
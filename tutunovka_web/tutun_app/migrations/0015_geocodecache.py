@@ -0,0 +1,27 @@
+# Generated by Django 5.0.3 on 2026-10-17 10:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tutun_app', '0014_remove_privatedot_api_vision_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeocodeCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('address', models.CharField(max_length=700, unique=True)),
+                ('longitude', models.FloatField(default=None, null=True)),
+                ('latitude', models.FloatField(default=None, null=True)),
+                ('name', models.CharField(default=None, max_length=700, null=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'Geocode_Cache',
+            },
+        ),
+    ]
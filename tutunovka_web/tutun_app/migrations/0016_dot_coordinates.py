@@ -0,0 +1,53 @@
+# Generated by Django 5.0.3 on 2026-10-17 10:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tutun_app', '0015_geocodecache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='privatedot',
+            name='geo_name',
+            field=models.CharField(default=None, max_length=700, null=True),
+        ),
+        migrations.AddField(
+            model_name='privatedot',
+            name='geocoded_information',
+            field=models.CharField(default=None, max_length=700, null=True),
+        ),
+        migrations.AddField(
+            model_name='privatedot',
+            name='latitude',
+            field=models.FloatField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='privatedot',
+            name='longitude',
+            field=models.FloatField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='publicdot',
+            name='geo_name',
+            field=models.CharField(default=None, max_length=700, null=True),
+        ),
+        migrations.AddField(
+            model_name='publicdot',
+            name='geocoded_information',
+            field=models.CharField(default=None, max_length=700, null=True),
+        ),
+        migrations.AddField(
+            model_name='publicdot',
+            name='latitude',
+            field=models.FloatField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='publicdot',
+            name='longitude',
+            field=models.FloatField(default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.3 on 2026-10-17 10:30
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('taggit', '0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx'),
+        ('tutun_app', '0017_job'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='publicroute',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(default=None, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='publicroute',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='public_routes_search_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='publicroute',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['Name'], name='public_routes_name_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+    ]
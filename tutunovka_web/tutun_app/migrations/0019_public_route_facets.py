@@ -0,0 +1,79 @@
+# Generated by Django 5.0.3 on 2026-10-17 10:32
+
+import calendar
+import re
+
+from django.db import migrations, models
+
+# Ranges of the new integer fields: a value outside them would abort the AlterField below
+RANGES = {
+    'length': (-2 ** 31, 2 ** 31 - 1),
+    'month': (1, 12),
+    'year': (0, 2 ** 15 - 1),
+}
+
+
+def strings_to_numbers(apps, schema_editor):
+    """
+    Month was stored as calendar.month_name, length and year as digit strings:
+    convert month to its number and drop values that can not be cast to the new field
+    """
+
+    PublicRoute = apps.get_model('tutun_app', 'PublicRoute')
+    months = {name: str(number) for number, name in enumerate(calendar.month_name) if name}
+
+    for route in PublicRoute.objects.all():
+        route.month = months.get(route.month, route.month)
+
+        for field, (low, high) in RANGES.items():
+            value = getattr(route, field)
+
+            if value is not None:
+                value = value.strip()
+                number = int(value) if re.fullmatch(r'-?[0-9]+', value) else None
+                setattr(route, field, str(number) if number is not None and low <= number <= high else None)
+
+        route.save(update_fields=['length', 'month', 'year'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tutun_app', '0018_public_route_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PublicRouteFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(max_length=10)),
+                ('value', models.CharField(max_length=100)),
+                ('label', models.CharField(default='', max_length=100)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'Public_Route_Facets',
+            },
+        ),
+        migrations.RunPython(strings_to_numbers, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='publicroute',
+            name='length',
+            field=models.IntegerField(db_index=True, default=None, null=True),
+        ),
+        migrations.AlterField(
+            model_name='publicroute',
+            name='month',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'January'), (2, 'February'), (3, 'March'), (4, 'April'), (5, 'May'), (6, 'June'), (7, 'July'), (8, 'August'), (9, 'September'), (10, 'October'), (11, 'November'), (12, 'December')], db_index=True, default=None, null=True),
+        ),
+        migrations.AlterField(
+            model_name='publicroute',
+            name='year',
+            field=models.PositiveSmallIntegerField(db_index=True, default=None, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='publicroutefacet',
+            constraint=models.UniqueConstraint(fields=('facet', 'value'), name='public_route_facets_unique'),
+        ),
+    ]
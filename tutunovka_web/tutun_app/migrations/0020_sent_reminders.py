@@ -0,0 +1,36 @@
+# Generated by Django 5.0.3 on 2026-10-17 10:41
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tutun_app', '0019_public_route_facets'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='privateroute',
+            name='date_in',
+            field=models.DateField(db_index=True, default=None, null=True),
+        ),
+        migrations.CreateModel(
+            name='SentReminder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_in', models.DateField()),
+                ('sent', models.DateTimeField(default=django.utils.timezone.now)),
+                ('route', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tutun_app.privateroute')),
+            ],
+            options={
+                'db_table': 'Sent_Reminders',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='sentreminder',
+            constraint=models.UniqueConstraint(fields=('route', 'date_in'), name='sent_reminders_unique'),
+        ),
+    ]
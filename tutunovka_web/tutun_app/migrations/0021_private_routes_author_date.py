@@ -0,0 +1,20 @@
+# Generated by Django 5.0.3 on 2026-10-17 10:43
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('taggit', '0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx'),
+        ('tutun_app', '0020_sent_reminders'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='privateroute',
+            index=models.Index(fields=['author', 'date_in'], name='private_routes_author_date_idx'),
+        ),
+    ]
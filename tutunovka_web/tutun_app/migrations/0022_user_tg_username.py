@@ -0,0 +1,49 @@
+from django.contrib.auth.models import User
+from django.db import migrations
+
+# Поле tg_username добавляется в auth.User через User.add_to_class (models.py),
+# поэтому его миграция раньше создавалась makemigrations внутри django.contrib.auth
+# при запуске контейнера и в репозиторий не попадала. Здесь столбец и его уникальный
+# индекс создаются, если их ещё нет: в базах, созданных старым способом, столбец уже есть.
+# Созданный здесь столбец помечается комментарием, и откат удаляет только такой столбец.
+# Без поддержки комментариев к столбцам (SQLite) откат столбец не трогает.
+# Используется настоящая модель User: в исторической модели auth.User этого поля нет.
+ADDED_COMMENT = 'added by tutun_app.0022_user_tg_username'
+
+
+def tg_username_column(connection):
+    with connection.cursor() as cursor:
+        columns = connection.introspection.get_table_description(cursor, User._meta.db_table)
+
+    return next((column for column in columns if column.name == 'tg_username'), None)
+
+
+def add_tg_username(apps, schema_editor):
+    connection = schema_editor.connection
+
+    if tg_username_column(connection) is None:
+        field = User._meta.get_field('tg_username')
+        schema_editor.add_field(User, field)
+
+        if connection.features.supports_comments:
+            schema_editor.execute(f'COMMENT ON COLUMN {schema_editor.quote_name(User._meta.db_table)}.'
+                                  f'{schema_editor.quote_name(field.column)} IS %s', [ADDED_COMMENT])
+
+
+def remove_tg_username(apps, schema_editor):
+    column = tg_username_column(schema_editor.connection)
+
+    if column is not None and getattr(column, 'comment', None) == ADDED_COMMENT:
+        schema_editor.remove_field(User, User._meta.get_field('tg_username'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('tutun_app', '0021_private_routes_author_date'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_tg_username, remove_tg_username),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations
+
+# Для уникального CharField Django на PostgreSQL создаёт кроме уникального индекса
+# ещё индекс varchar_pattern_ops для LIKE. tg_username ищется только на равенство,
+# поэтому второй индекс лишь замедляет запись, а планировщик может выбрать его
+# вместо уникального auth_user_tg_username_key.
+LIKE_INDEX_DEF = '%(tg_username varchar_pattern_ops)%'
+
+
+def drop_like_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT indexname FROM pg_indexes WHERE tablename = 'auth_user' AND indexdef LIKE %s",
+                       [LIKE_INDEX_DEF])
+        for name, in cursor.fetchall():
+            cursor.execute(f'DROP INDEX {connection.ops.quote_name(name)}')
+
+
+def create_like_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('CREATE INDEX IF NOT EXISTS auth_user_tg_username_like '
+                              'ON auth_user (tg_username varchar_pattern_ops)')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tutun_app', '0022_user_tg_username'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_like_index, create_like_index),
+    ]
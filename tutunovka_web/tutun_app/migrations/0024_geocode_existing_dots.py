@@ -0,0 +1,35 @@
+from django.db import migrations
+from django.db.models import F, Q
+
+# Миграция 0016 добавила точкам координаты, но точки, созданные до неё, так и остались
+# негеокодированными, а просмотр маршрута задачи больше не ставит. Для них один раз
+# ставятся задачи фоновой очереди, как в команде geocode_pending, по CHUNK_SIZE точек.
+CHUNK_SIZE = 100
+
+
+def enqueue_existing_dots(apps, schema_editor):
+    Job = apps.get_model('tutun_app', 'Job')
+    jobs = []
+
+    for label in ('tutun_app.PrivateDot', 'tutun_app.PublicDot'):
+        dot_ids = list(apps.get_model(label).objects.filter(
+            Q(geocoded_information__isnull=True) | ~Q(geocoded_information=F('information'))
+        ).order_by('id').values_list('id', flat=True))
+
+        jobs.extend(
+            Job(task='tutun_app.geocoder.geocode_dots', payload={'model': label, 'dot_ids': dot_ids[start:start + CHUNK_SIZE]})
+            for start in range(0, len(dot_ids), CHUNK_SIZE)
+        )
+
+    Job.objects.bulk_create(jobs)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tutun_app', '0023_drop_tg_username_like_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(enqueue_existing_dots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.0.3 on 2026-10-17 11:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tutun_app', '0024_geocode_existing_dots'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='privatedot',
+            name='note',
+            field=models.CharField(max_length=700, null=True),
+        ),
+        migrations.AlterField(
+            model_name='privateroute',
+            name='baggage',
+            field=models.CharField(max_length=3000, null=True),
+        ),
+        migrations.AlterField(
+            model_name='privateroute',
+            name='comment',
+            field=models.CharField(max_length=700, null=True),
+        ),
+        migrations.AlterField(
+            model_name='privateroute',
+            name='date_out',
+            field=models.DateField(default=None, null=True),
+        ),
+        migrations.AlterField(
+            model_name='privateroute',
+            name='rate',
+            field=models.IntegerField(default='0'),
+        ),
+    ]
@@ -2,7 +2,12 @@
 models for the tutun_app application
 """
 
+import calendar
+
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import User
 
 from taggit.managers import TaggableManager
@@ -14,6 +19,8 @@ User.add_to_class('tg_username', models.CharField(
     null=True
 ))
 
+MONTHS = [(number, calendar.month_name[number]) for number in range(1, 13)]
+
 
 class PrivateDot(models.Model):
     """
@@ -30,6 +37,18 @@ class PrivateDot(models.Model):
 
     @param: information: информация о точке
     @type: information: basestring
+
+    @param: longitude: долгота точки, None если точка не найдена геокодером
+    @type: longitude: float
+
+    @param: latitude: широта точки, None если точка не найдена геокодером
+    @type: latitude: float
+
+    @param: geo_name: название, найденное геокодером
+    @type: geo_name: basestring
+
+    @param: geocoded_information: значение information, для которого получены координаты
+    @type: geocoded_information: basestring
     """
 
     class Meta:
@@ -40,6 +59,11 @@ class PrivateDot(models.Model):
     note = models.CharField(max_length=700, null=True)
     information = models.CharField(max_length=700)
 
+    longitude = models.FloatField(default=None, null=True)
+    latitude = models.FloatField(default=None, null=True)
+    geo_name = models.CharField(max_length=700, default=None, null=True)
+    geocoded_information = models.CharField(max_length=700, default=None, null=True)
+
 
 class PublicDot(models.Model):
     """
@@ -50,6 +74,18 @@ class PublicDot(models.Model):
 
     @param: information: информация о точке
     @type: information: basestring
+
+    @param: longitude: долгота точки, None если точка не найдена геокодером
+    @type: longitude: float
+
+    @param: latitude: широта точки, None если точка не найдена геокодером
+    @type: latitude: float
+
+    @param: geo_name: название, найденное геокодером
+    @type: geo_name: basestring
+
+    @param: geocoded_information: значение information, для которого получены координаты
+    @type: geocoded_information: basestring
     """
 
     class Meta:
@@ -58,6 +94,11 @@ class PublicDot(models.Model):
     name = models.CharField(max_length=125, default='Untitled dot')
     information = models.CharField(max_length=700)
 
+    longitude = models.FloatField(default=None, null=True)
+    latitude = models.FloatField(default=None, null=True)
+    geo_name = models.CharField(max_length=700, default=None, null=True)
+    geocoded_information = models.CharField(max_length=700, default=None, null=True)
+
 
 class Note(models.Model):
     """
@@ -122,11 +163,14 @@ class PrivateRoute(models.Model):
 
     class Meta:
         db_table = "Private_Routes"
+        indexes = [
+            models.Index(fields=['author', 'date_in'], name='private_routes_author_date_idx'),
+        ]
 
     Name = models.CharField(max_length=125, default='Untitled')
     author = models.ForeignKey(to=User, on_delete=models.CASCADE)
 
-    date_in = models.DateField(null=True, default=None)
+    date_in = models.DateField(null=True, default=None, db_index=True)
     date_out = models.DateField(null=True, default=None)
 
     comment = models.CharField(max_length=700, null=True)
@@ -164,18 +208,25 @@ class PublicRoute(models.Model):
 
     @param: tags: теги маршрута
 
-    @param: length: длинна маршрута
-    @type: length: basestring
+    @param: length: длинна маршрута в днях
+    @type: length: int
 
-    @param: month: месяц поездки
-    @type: month: basestring
+    @param: month: номер месяца поездки
+    @type: month: int
 
     @param: year: год поездки
-    @type: year: basestring
+    @type: year: int
+
+    @param: search_vector: поисковый вектор маршрута
+    @type: search_vector: basestring
     """
 
     class Meta:
         db_table = "Public_Routes"
+        indexes = [
+            GinIndex(fields=['search_vector'], name='public_routes_search_idx'),
+            GinIndex(fields=['Name'], name='public_routes_name_trgm_idx', opclasses=['gin_trgm_ops']),
+        ]
 
     Name = models.CharField(max_length=125, default='Untitled')
     author = models.ForeignKey(to=User, on_delete=models.CASCADE)
@@ -186,9 +237,11 @@ class PublicRoute(models.Model):
 
     tags = TaggableManager()
 
-    length = models.CharField(max_length=10, default=None, null=True)
-    month = models.CharField(max_length=20, default=None, null=True)
-    year = models.CharField(max_length=20, default=None, null=True)
+    length = models.IntegerField(default=None, null=True, db_index=True)
+    month = models.PositiveSmallIntegerField(default=None, null=True, db_index=True, choices=MONTHS)
+    year = models.PositiveSmallIntegerField(default=None, null=True, db_index=True)
+
+    search_vector = SearchVectorField(default=None, null=True)
 
 
 class Complaint(models.Model):
@@ -217,3 +270,155 @@ class Complaint(models.Model):
     answer = models.CharField(max_length=1000, default='')
 
     data = models.DateField()
+
+
+class GeocodeCache(models.Model):
+    """
+    Кэш ответов геокодера
+
+    @param: address: нормализованный адрес или название точки
+    @type: address: basestring
+
+    @param: longitude: долгота, None если адрес не найден
+    @type: longitude: float
+
+    @param: latitude: широта, None если адрес не найден
+    @type: latitude: float
+
+    @param: name: название найденного объекта
+    @type: name: basestring
+
+    @param: updated: время последнего обращения к геокодеру
+    @type: updated: datetime.datetime
+    """
+
+    class Meta:
+        db_table = "Geocode_Cache"
+
+    address = models.CharField(max_length=700, unique=True)
+
+    longitude = models.FloatField(default=None, null=True)
+    latitude = models.FloatField(default=None, null=True)
+    name = models.CharField(max_length=700, default=None, null=True)
+
+    updated = models.DateTimeField(auto_now=True)
+
+
+class Job(models.Model):
+    """
+    Задачи фоновой очереди
+
+    @param: task: путь до функции задачи
+    @type: task: basestring
+
+    @param: payload: именованные аргументы функции
+    @type: payload: dict
+
+    @param: status: состояние задачи
+    @type: status: basestring
+
+    @param: attempts: количество сделанных попыток
+    @type: attempts: int
+
+    @param: max_attempts: максимальное количество попыток
+    @type: max_attempts: int
+
+    @param: run_at: время, не раньше которого задачу можно выполнять
+    @type: run_at: datetime.datetime
+
+    @param: locked_until: до какого времени задача закреплена за обработчиком
+    @type: locked_until: datetime.datetime
+
+    @param: last_error: текст последней ошибки
+    @type: last_error: basestring
+
+    @param: created: время постановки задачи
+    @type: created: datetime.datetime
+    """
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FAILED = 'failed'
+
+    STATUSES = [
+        (QUEUED, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (FAILED, 'Ошибка'),
+    ]
+
+    class Meta:
+        db_table = "Jobs"
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='jobs_status_run_at_idx'),
+        ]
+
+    task = models.CharField(max_length=200)
+    payload = models.JSONField(default=dict)
+
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(default=None, null=True)
+    last_error = models.TextField(default='')
+
+    created = models.DateTimeField(auto_now_add=True)
+
+
+class PublicRouteFacet(models.Model):
+    """
+    Количество публичных маршрутов для каждого значения фильтра,
+    поддерживается при публикации и удалении маршрутов
+
+    @param: facet: фильтр: tag, month, year или length
+    @type: facet: basestring
+
+    @param: value: значение фильтра
+    @type: value: basestring
+
+    @param: label: отображаемое название значения
+    @type: label: basestring
+
+    @param: count: количество маршрутов
+    @type: count: int
+    """
+
+    class Meta:
+        db_table = "Public_Route_Facets"
+        constraints = [
+            models.UniqueConstraint(fields=['facet', 'value'], name='public_route_facets_unique'),
+        ]
+
+    facet = models.CharField(max_length=10)
+    value = models.CharField(max_length=100)
+    label = models.CharField(max_length=100, default='')
+    count = models.IntegerField(default=0)
+
+
+class SentReminder(models.Model):
+    """
+    Отправленные ботом напоминания о поездках.
+    Бот записывает напоминание до отправки, поэтому
+    после перезапуска напоминание не отправляется повторно.
+    Запись о неотправленном напоминании бот удаляет.
+
+    @param: route: маршрут, о котором напомнили
+    @type: route: object
+
+    @param: date_in: дата начала поездки, о которой напомнили
+    @type: date_in: datetime
+
+    @param: sent: время отправки
+    @type: sent: datetime
+    """
+
+    class Meta:
+        db_table = "Sent_Reminders"
+        constraints = [
+            models.UniqueConstraint(fields=['route', 'date_in'], name='sent_reminders_unique'),
+        ]
+
+    route = models.ForeignKey(to=PrivateRoute, on_delete=models.CASCADE)
+    date_in = models.DateField()
+    sent = models.DateTimeField(default=timezone.now)
@@ -0,0 +1,103 @@
+"""
+anonymous page cache for the tutun_app application
+"""
+
+import hashlib
+import time
+from functools import wraps
+
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from tutun.settings import PUBLIC_PAGE_CACHE_TTL, ROUTE_CARD_CACHE_TTL
+
+VERSION_KEY = 'public_pages:version'
+
+
+def get_public_pages_version():
+    """
+    @return: текущая версия публичных страниц и карточек маршрутов
+    @rtype: int
+    """
+
+    # если версия пропала из кэша, новая версия не должна совпасть ни с одной старой
+    return cache.get_or_set(VERSION_KEY, time.time_ns, timeout=None)
+
+
+def invalidate_public_pages():
+    """
+    Инвалидация публичных страниц и карточек маршрутов сменой версии,
+    старая версия просто перестаёт читаться и истекает по таймауту
+    """
+
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def _page_key(request):
+    """
+    @return: ключ кэша страницы в текущей версии
+    @rtype: basestring
+    """
+
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+
+    return f'public_page:{get_public_pages_version()}:{path}'
+
+
+def cache_public_page(view):
+    """
+    Кэширование страницы для анонимных посетителей.
+    Всем анонимным посетителям отдаётся одна и та же страница, поэтому она
+    строится один раз до изменения публичных маршрутов или тегов.
+    Авторизованные посетители и посетители с сообщениями получают страницу без кэша.
+
+    @param view: функция представления
+    @type view: function
+
+    @return: функция представления с кэшированием
+    @rtype: function
+    """
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method != 'GET' or request.user.is_authenticated or len(get_messages(request)):
+            return view(request, *args, **kwargs)
+
+        key = _page_key(request)
+        cached = cache.get(key)
+
+        if cached is not None:
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+
+        response = view(request, *args, **kwargs)
+
+        if hasattr(response, 'render') and not response.is_rendered:
+            response.render()
+
+        # Сообщения могли появиться во время построения страницы
+        if response.status_code == 200 and not response.cookies and not len(get_messages(request)):
+            cache.set(key, (response.content, response['Content-Type']), PUBLIC_PAGE_CACHE_TTL)
+
+        return response
+
+    return wrapper
+
+
+def route_cards_context():
+    """
+    Контекст фрагментов карточек маршрутов (шаблон route_card.html):
+    карточка хранится в кэше по id маршрута до смены версии
+
+    @return: версия и время жизни карточек
+    @rtype: dict
+    """
+
+    return {
+        'cards_version': get_public_pages_version(),
+        'cards_timeout': ROUTE_CARD_CACHE_TTL,
+    }
@@ -0,0 +1,184 @@
+"""
+keyset pagination for the tutun_app application
+"""
+
+import base64
+import binascii
+import json
+import math
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from django.db.models.query import EmptyQuerySet
+
+
+def encode_cursor(values):
+    """
+    Кодирование курсора страницы
+
+    @param values: значения полей сортировки последнего элемента страницы
+    @type values: list
+
+    @return: курсор для строки запроса
+    @rtype: basestring
+    """
+
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    """
+    Декодирование курсора страницы
+
+    @param cursor: курсор из строки запроса
+    @type cursor: basestring
+
+    @param size: ожидаемое количество значений
+    @type size: int
+
+    @return: значения полей сортировки либо None, если курсор некорректен
+    @rtype: list
+    """
+
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        return None
+
+    if not isinstance(values, list) or len(values) != size:
+        return None
+
+    return values
+
+
+def clean_cursor(values, model, fields):
+    """
+    Проверка значений курсора по полям сортировки: курсор приходит из строки запроса,
+    и значение не того типа или вне диапазона поля иначе дошло бы до запроса к базе данных
+
+    @param values: значения из курсора
+    @type values: list
+
+    @param model: модель элементов страницы
+    @type model: :class:`django.db.models.Model`
+
+    @param fields: имена полей сортировки
+    @type fields: list
+
+    @return: значения, приведённые к типам полей, либо None, если курсор некорректен
+    @rtype: list
+    """
+
+    cleaned = []
+
+    for value, field in zip(values, fields):
+        # Поля сортировки не бывают пустыми, а True не должен сойти за 1
+        if value is None or isinstance(value, bool):
+            return None
+
+        try:
+            model_field = model._meta.get_field(field)
+        except FieldDoesNotExist:
+            # Аннотация, например ранг поиска, - число
+            if not isinstance(value, (int, float)) or not math.isfinite(value):
+                return None
+            cleaned.append(value)
+            continue
+
+        try:
+            cleaned.append(model_field.clean(value, None))
+        except ValidationError:
+            return None
+
+    return cleaned
+
+
+class KeysetPaginationMixin:
+    """
+    Постраничный вывод по курсору (keyset pagination) для generic.ListView.
+    Вместо OFFSET следующая страница выбирается условием по полям сортировки
+    последнего показанного элемента, поэтому стоимость запроса не растёт
+    с номером страницы.
+
+    @type page_size: int
+    @param page_size: Количество элементов на страницу
+
+    @type cursor_ordering: tuple
+    @param cursor_ordering: Поля сортировки, последнее поле должно быть уникальным
+
+    @type cursor_param: str
+    @param cursor_param: Имя параметра курсора в строке запроса
+    """
+
+    page_size = 20
+    cursor_ordering = ('-id',)
+    cursor_param = 'cursor'
+
+    def paginate_keyset(self, queryset):
+        """
+        Выбор текущей страницы
+
+        @param queryset: все подходящие элементы
+        @type queryset: :class:`django.db.models.QuerySet`
+
+        @return: элементы страницы и курсор следующей страницы (None, если страница последняя)
+        @rtype: tuple
+        """
+
+        if isinstance(queryset, EmptyQuerySet):
+            return [], None
+
+        fields = [(field.lstrip('-'), field.startswith('-')) for field in self.cursor_ordering]
+        values = decode_cursor(self.request.GET.get(self.cursor_param, ''), len(fields))
+
+        if values is not None:
+            values = clean_cursor(values, queryset.model, [field for field, _ in fields])
+
+        if values is not None:
+            condition = Q()
+
+            for index, (field, descending) in enumerate(fields):
+                step = Q(**{f'{field}__{"lt" if descending else "gt"}': values[index]})
+
+                for previous_index, (previous, _) in enumerate(fields[:index]):
+                    step &= Q(**{previous: values[previous_index]})
+
+                condition |= step
+
+            queryset = queryset.filter(condition)
+
+        page = list(queryset.order_by(*self.cursor_ordering)[:self.page_size + 1])
+
+        if len(page) <= self.page_size:
+            return page, None
+
+        page = page[:self.page_size]
+        last = page[-1]
+
+        return page, encode_cursor([getattr(last, field) for field, _ in fields])
+
+    def get_context_data(self, **kwargs):
+        """
+        Добавление страницы и ссылки на следующую страницу в контекст
+
+        @param kwargs: Дополнительные аргументы контекста
+        @return: Обновленный контекст
+        @rtype: dict
+        """
+
+        page, next_cursor = self.paginate_keyset(self.object_list)
+        kwargs['object_list'] = page
+
+        context = super().get_context_data(**kwargs)
+        next_page_query = None
+
+        if next_cursor is not None:
+            query = self.request.GET.copy()
+            query[self.cursor_param] = next_cursor
+            next_page_query = query.urlencode()
+
+        context.update({
+            'next_page_query': next_page_query,
+        })
+
+        return context
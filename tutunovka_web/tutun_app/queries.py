@@ -0,0 +1,506 @@
+"""
+queries for the tutun_app application shared with the telegram bot
+"""
+
+import datetime
+import json
+import logging
+import select
+import threading
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set
+
+from django.contrib.auth.models import User
+from django.db import Error, connection, transaction
+from django.db.models import Case, Exists, F, OuterRef, Value, When
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .models import Note, PrivateRoute, SentReminder
+
+logger = logging.getLogger(__name__)
+
+# Хуки инвалидации кэшей. Отправляются после коммита транзакции:
+# routes_changed с user_id - изменились маршруты пользователя,
+# notes_changed с note_ids - изменились заметки.
+# Изменения, сделанные другими процессами, ChangeListener отправляет с sender=ChangeListener,
+# а после переподключения отправляет changes_lost: уведомления за время разрыва потеряны
+routes_changed = Signal()
+notes_changed = Signal()
+changes_lost = Signal()
+
+# Канал PostgreSQL NOTIFY, через который процессы узнают об изменениях друг друга
+CHANGES_CHANNEL = 'tutun_changes'
+# Собственные изменения процесс получает сигналами, а не через канал
+ORIGIN = uuid.uuid4().hex
+
+# Глубина вложенных блоков batch_changes в текущем потоке
+_batch = threading.local()
+
+
+@dataclass(frozen=True)
+class UserInfo:
+    """
+    Пользователь
+
+    @param: id: id пользователя
+    @type: id: int
+
+    @param: username: имя пользователя
+    @type: username: basestring
+    """
+
+    id: int
+    username: str
+
+
+@dataclass(frozen=True)
+class RouteInfo:
+    """
+    Приватный маршрут без точек и заметок
+
+    @param: id: id маршрута
+    @type: id: int
+
+    @param: name: название маршрута
+    @type: name: basestring
+
+    @param: date_in: дата начала маршрута
+    @type: date_in: datetime.date
+
+    @param: date_out: дата окончания маршрута
+    @type: date_out: datetime.date
+
+    @param: comment: коментарий маршрута
+    @type: comment: basestring
+
+    @param: baggage: вещи в путь
+    @type: baggage: basestring
+    """
+
+    id: int
+    name: str
+    date_in: Optional[datetime.date]
+    date_out: Optional[datetime.date]
+    comment: Optional[str]
+    baggage: Optional[str]
+
+
+@dataclass(frozen=True)
+class NoteInfo:
+    """
+    Заметка маршрута
+
+    @param: id: id заметки
+    @type: id: int
+
+    @param: done: отмечена ли заметка
+    @type: done: bool
+
+    @param: text: текст заметки
+    @type: text: basestring
+    """
+
+    id: int
+    done: bool
+    text: str
+
+
+@dataclass(frozen=True)
+class ReminderInfo:
+    """
+    Напоминание о поездке
+
+    @param: route_id: id маршрута
+    @type: route_id: int
+
+    @param: name: название маршрута
+    @type: name: basestring
+
+    @param: chat_id: id чата Telegram автора маршрута
+    @type: chat_id: basestring
+    """
+
+    route_id: int
+    name: str
+    chat_id: str
+
+
+ROUTE_FIELDS = ('id', 'date_in', 'date_out', 'comment', 'baggage')
+
+
+def chat_username(chat_id) -> str:
+    """
+    Значение tg_username для чата. Колонка текстовая, поэтому сравнение
+    как текст использует её уникальный индекс
+
+    @param chat_id: id чата Telegram
+    @type chat_id: int
+
+    @return: значение tg_username
+    @rtype: basestring
+    """
+
+    return str(chat_id)
+
+
+def get_user_by_username(username: str) -> Optional[UserInfo]:
+    """
+    Поиск пользователя по имени
+
+    @param username: имя пользователя
+    @type username: basestring
+
+    @return: пользователь или None
+    @rtype: :class:`UserInfo`
+    """
+
+    row = User.objects.filter(username=username).values('id', 'username').first()
+    return UserInfo(**row) if row else None
+
+
+def get_user_by_chat(chat_id) -> Optional[UserInfo]:
+    """
+    Поиск пользователя, привязавшего чат Telegram
+
+    @param chat_id: id чата Telegram
+    @type chat_id: int
+
+    @return: пользователь или None
+    @rtype: :class:`UserInfo`
+    """
+
+    row = User.objects.filter(tg_username=chat_username(chat_id)).values('id', 'username').first()
+    return UserInfo(**row) if row else None
+
+
+def link_chat(user_id: int, chat_id) -> bool:
+    """
+    Привязка чата Telegram к пользователю
+
+    @param user_id: id пользователя
+    @type user_id: int
+
+    @param chat_id: id чата Telegram
+    @type chat_id: int
+
+    @return: найден ли пользователь
+    @rtype: bool
+    """
+
+    return User.objects.filter(id=user_id).update(tg_username=chat_username(chat_id)) > 0
+
+
+def unlink_chat(chat_id) -> bool:
+    """
+    Отвязка чата Telegram от пользователя
+
+    @param chat_id: id чата Telegram
+    @type chat_id: int
+
+    @return: был ли чат привязан
+    @rtype: bool
+    """
+
+    return User.objects.filter(tg_username=chat_username(chat_id)).update(tg_username=None) > 0
+
+
+def get_nearest_route(user_id: int, today: Optional[datetime.date] = None) -> Optional[RouteInfo]:
+    """
+    Ближайшая поездка пользователя, использует индекс (author_id, date_in)
+
+    @param user_id: id автора
+    @type user_id: int
+
+    @param today: дата, начиная с которой ищется поездка, по умолчанию сегодня
+    @type today: :class:`datetime.date`
+
+    @return: маршрут или None
+    @rtype: :class:`RouteInfo`
+    """
+
+    row = (PrivateRoute.objects
+           .filter(author_id=user_id, date_in__gte=today or timezone.localdate())
+           .order_by('date_in', 'id')
+           .values(*ROUTE_FIELDS, name=F('Name'))
+           .first())
+    return RouteInfo(**row) if row else None
+
+
+def get_route_notes(route_id: int) -> List[NoteInfo]:
+    """
+    Заметки маршрута, выбираются через связующую таблицу без обращения к маршрутам
+
+    @param route_id: id маршрута
+    @type route_id: int
+
+    @return: заметки в порядке создания
+    @rtype: list
+    """
+
+    return [NoteInfo(**row) for row in
+            Note.objects.filter(privateroute=route_id).order_by('id').values('id', 'done', 'text')]
+
+
+def set_notes_done(route_id: int, states: Dict[int, bool]) -> int:
+    """
+    Запись отметок нескольких заметок маршрута одним UPDATE.
+    Заметки других маршрутов не изменяются
+
+    @param route_id: id маршрута
+    @type route_id: int
+
+    @param states: новые отметки по id заметок
+    @type states: dict
+
+    @return: количество изменённых заметок
+    @rtype: int
+    """
+
+    if not states:
+        return 0
+
+    done_ids = [note_id for note_id, done in states.items() if done]
+
+    updated = (Note.objects
+               .filter(id__in=list(states), privateroute=route_id)
+               .update(done=Case(When(id__in=done_ids, then=Value(True)), default=Value(False))))
+    if updated:
+        note_ids = list(states)
+        notify_changes(note_ids=note_ids)
+        transaction.on_commit(lambda: notes_changed.send(sender=Note, note_ids=note_ids))
+
+    return updated
+
+
+def get_reminders(date_in: datetime.date) -> List[ReminderInfo]:
+    """
+    Маршруты, начинающиеся в date_in, авторы которых привязали Telegram,
+    без уже отправленных напоминаний. Использует индекс по date_in
+
+    @param date_in: дата начала поездки
+    @type date_in: :class:`datetime.date`
+
+    @return: напоминания в порядке id маршрутов
+    @rtype: list
+    """
+
+    sent = SentReminder.objects.filter(route=OuterRef('pk'), date_in=OuterRef('date_in'))
+    rows = (PrivateRoute.objects
+            .filter(~Exists(sent), date_in=date_in, author__tg_username__isnull=False)
+            .order_by('id')
+            .values(route_id=F('id'), name=F('Name'), chat_id=F('author__tg_username')))
+    return [ReminderInfo(**row) for row in rows]
+
+
+def claim_reminders(route_ids: List[int], date_in: datetime.date) -> Set[int]:
+    """
+    Запись напоминаний до отправки. Возвращаются только маршруты,
+    о которых ещё никто не напомнил, поэтому повторной отправки не бывает
+    даже при нескольких запущенных ботах. Если отправка не удалась,
+    запись удаляется через release_reminders
+
+    @param route_ids: id маршрутов
+    @type route_ids: list
+
+    @param date_in: дата начала поездки
+    @type date_in: :class:`datetime.date`
+
+    @return: id маршрутов, напоминания о которых нужно отправить
+    @rtype: set
+    """
+
+    if not route_ids:
+        return set()
+
+    # bulk_create(ignore_conflicts=True) не сообщает, какие строки вставлены
+    quote = connection.ops.quote_name
+    route = SentReminder._meta.get_field('route').column
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {quote(SentReminder._meta.db_table)} ({quote(route)}, date_in, sent)
+            SELECT route_id, %s, %s FROM unnest(%s::bigint[]) AS route_id
+            ON CONFLICT ({quote(route)}, date_in) DO NOTHING
+            RETURNING {quote(route)}
+            """,
+            [date_in, timezone.now(), list(route_ids)]
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+
+
+def release_reminders(route_ids: List[int], date_in: datetime.date) -> int:
+    """
+    Удаление записей о напоминаниях, которые не удалось отправить,
+    чтобы их можно было отправить снова
+
+    @param route_ids: id маршрутов
+    @type route_ids: list
+
+    @param date_in: дата начала поездки
+    @type date_in: :class:`datetime.date`
+
+    @return: количество удалённых записей
+    @rtype: int
+    """
+
+    deleted, _ = SentReminder.objects.filter(route_id__in=route_ids, date_in=date_in).delete()
+    return deleted
+
+def notify_changes(user_ids=(), note_ids=()):
+    """
+    Уведомление других процессов об изменениях через PostgreSQL NOTIFY.
+    Уведомление отправляется в текущей транзакции, поэтому доставляется
+    только после её коммита, а при откате не доставляется
+
+    @param user_ids: id пользователей, маршруты которых изменились
+    @type user_ids: list
+
+    @param note_ids: id изменившихся заметок
+    @type note_ids: list
+    """
+
+    if connection.vendor != 'postgresql':
+        return
+
+    payload = json.dumps({'origin': ORIGIN, 'user_ids': list(user_ids), 'note_ids': list(note_ids)})
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_notify(%s, %s)', [CHANGES_CHANNEL, payload])
+
+
+@contextmanager
+def batch_changes():
+    """
+    Блок массовых изменений строк (например, удаление заметок queryset.delete()).
+    Хуки отдельных строк (signals.py) внутри блока не уведомляют об изменениях,
+    вызывающий код уведомляет один раз через notify_batch, поэтому количество
+    запросов не зависит от количества строк
+    """
+
+    _batch.depth = getattr(_batch, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _batch.depth -= 1
+
+
+def in_batch() -> bool:
+    """
+    @return: идёт ли в текущем потоке блок batch_changes
+    @rtype: bool
+    """
+
+    return getattr(_batch, 'depth', 0) > 0
+
+
+def notify_batch(user_ids=(), note_ids=()):
+    """
+    Одно уведомление других процессов в текущей транзакции
+    и хуки инвалидации после коммита для всех изменений блока batch_changes
+
+    @param user_ids: id пользователей, маршруты которых изменились
+    @type user_ids: list
+
+    @param note_ids: id изменившихся заметок
+    @type note_ids: list
+    """
+
+    user_ids = list(user_ids)
+    note_ids = list(note_ids)
+
+    if not user_ids and not note_ids:
+        return
+
+    notify_changes(user_ids=user_ids, note_ids=note_ids)
+
+    def send_hooks():
+        for user_id in user_ids:
+            routes_changed.send(sender=PrivateRoute, user_id=user_id)
+        if note_ids:
+            notes_changed.send(sender=Note, note_ids=note_ids)
+
+    transaction.on_commit(send_hooks)
+
+
+def dispatch_changes(payload):
+    """
+    Отправка хуков инвалидации по уведомлению другого процесса
+
+    @param payload: текст уведомления
+    @type payload: basestring
+    """
+
+    changes = json.loads(payload)
+    if changes.get('origin') == ORIGIN:
+        return
+
+    for user_id in changes.get('user_ids', []):
+        routes_changed.send(sender=ChangeListener, user_id=user_id)
+
+    if changes.get('note_ids'):
+        notes_changed.send(sender=ChangeListener, note_ids=changes['note_ids'])
+
+
+class ChangeListener:
+    """
+    Получение уведомлений канала CHANGES_CHANNEL на отдельном соединении.
+    run() блокирует поток до вызова stop(), при разрыве соединения
+    переподключается и отправляет changes_lost
+
+    @param timeout: как часто проверяется остановка, секунды
+    @type timeout: float
+
+    @param reconnect_delay: пауза перед переподключением, секунды
+    @type reconnect_delay: float
+    """
+
+    def __init__(self, timeout=5, reconnect_delay=3):
+        self.timeout = timeout
+        self.reconnect_delay = reconnect_delay
+        self.stopped = threading.Event()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        if connection.vendor != 'postgresql':
+            return
+
+        connected = False
+
+        while not self.stopped.is_set():
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN {CHANGES_CHANNEL}')
+
+                if connected:
+                    changes_lost.send(sender=ChangeListener)
+                connected = True
+
+                self._receive(connection.connection)
+            except (Error, connection.Database.Error) as e:
+                # poll() вызывается у соединения драйвера, его ошибки Django не оборачивает
+                logger.warning("Change listener disconnected: %s", e)
+                connection.close()
+                self.stopped.wait(self.reconnect_delay)
+
+        connection.close()
+
+    def _receive(self, raw_connection):
+        while not self.stopped.is_set():
+            if not select.select([raw_connection], [], [], self.timeout)[0]:
+                continue
+
+            raw_connection.poll()
+
+            while raw_connection.notifies:
+                notify = raw_connection.notifies.pop(0)
+                try:
+                    dispatch_changes(notify.payload)
+                except Exception:
+                    logger.exception("Error dispatching change %s", notify.payload)
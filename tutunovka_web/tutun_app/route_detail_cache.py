@@ -0,0 +1,79 @@
+"""
+public route detail cache for the tutun_app application
+"""
+
+from django.core.cache import cache
+from django.db.models import F
+
+from taggit.models import Tag
+
+from tutun.settings import PUBLIC_ROUTE_CACHE_TTL
+from .geocoder import map_points
+from .models import MONTHS, PublicDot, PublicRoute
+
+
+def _detail_key(route_id):
+    """
+    @return: ключ кэша данных публичного маршрута
+    @rtype: basestring
+    """
+
+    return f'public_route_detail:{route_id}'
+
+
+def get_public_route_detail(route_id):
+    """
+    Данные страницы публичного маршрута: поля маршрута, имя автора, точки для карты и теги.
+    Опубликованный маршрут почти не меняется, поэтому данные хранятся в кэше
+    до изменения маршрута, его точек или тегов, и просмотр маршрута
+    не обращается к базе данных.
+    В общем кэше лежат только показываемые значения, а не объекты моделей:
+    объект маршрута тянул бы за собой автора с хешем пароля и почтой.
+    Маршрут с ещё не геокодированными точками не кэшируется: геокодер сохраняет
+    координаты через bulk_update без сигналов.
+
+    @param route_id: id маршрута
+    @type route_id: int
+
+    @return: {'route', 'tags', 'dots_vis', 'missing', 'pending'} либо None, если маршрута нет
+    @rtype: dict
+    """
+
+    key = _detail_key(route_id)
+    detail = cache.get(key)
+
+    if detail is None:
+        route = PublicRoute.objects.filter(id=route_id).values(
+            'id', 'Name', 'comment', 'rate', 'length', 'month', 'year', author_name=F('author__username'),
+        ).first()
+
+        if route is None:
+            return None
+
+        route['month_name'] = dict(MONTHS).get(route['month'])
+        dots_vis, missing, pending = map_points(PublicDot.objects.filter(publicroute=route_id).order_by('id'))
+
+        detail = {
+            'route': route,
+            'tags': sorted(Tag.objects.filter(publicroute=route_id).values_list('name', flat=True)),
+            'dots_vis': dots_vis,
+            'missing': missing,
+            'pending': pending,
+        }
+
+        if not pending:
+            cache.set(key, detail, PUBLIC_ROUTE_CACHE_TTL)
+
+    return detail
+
+
+def invalidate_public_route_details(route_ids):
+    """
+    Удаление данных маршрутов из кэша
+
+    @param route_ids: id маршрутов
+    @type route_ids: list
+    """
+
+    if route_ids:
+        cache.delete_many([_detail_key(route_id) for route_id in route_ids])
@@ -0,0 +1,188 @@
+"""
+bulk writing of route dots and notes for the tutun_app application
+"""
+
+import re
+
+from .models import PrivateRoute, PrivateDot, Note
+from .queries import batch_changes, notify_batch
+
+# Поля строк, которые пользователь может изменить при редактировании маршрута
+DOT_FIELDS = ('name', 'information', 'date', 'note')
+NOTE_FIELDS = ('text',)
+
+
+def bind_row_forms(data, prefix, form_class, field):
+    """
+    Формы строк маршрута (точек или заметок) из данных запроса.
+    Номера строк берутся из имён полей вида <prefix>-<номер>-<field>,
+    а не перебором всех возможных номеров.
+
+    @param data: данные запроса
+    @type data: :class:`django.http.QueryDict`
+
+    @param prefix: префикс строк, например 'dots'
+    @type prefix: basestring
+
+    @param form_class: класс формы строки
+    @type form_class: type
+
+    @param field: обязательное поле строки, по которому строка находится
+    @type field: basestring
+
+    @return: формы строк в порядке номеров
+    @rtype: list
+    """
+
+    pattern = re.compile(rf'^{re.escape(prefix)}-(\d+)-{re.escape(field)}$')
+    indexes = sorted({int(match.group(1)) for match in map(pattern.match, data) if match})
+
+    return [form_class(data, prefix=f'{prefix}-{index}') for index in indexes]
+
+
+def validate_dot_dates(dot_forms, date_in, date_out):
+    """
+    Проверка, что даты точек находятся в пределах путешествия.
+    Формы точек должны быть уже проверены, ошибка добавляется к полю date.
+
+    @param dot_forms: формы точек
+    @type dot_forms: list
+
+    @param date_in: дата начала путешествия
+    @type date_in: :class:`datetime.date`
+
+    @param date_out: дата окончания путешествия
+    @type date_out: :class:`datetime.date`
+
+    @return: все ли даты корректны
+    @rtype: bool
+    """
+
+    valid = True
+
+    for dot_form in dot_forms:
+        dot_date = dot_form.cleaned_data.get('date')
+
+        if dot_date is not None and not date_in <= dot_date <= date_out:
+            dot_form.add_error('date', 'Дата точки должна находиться в пределах путешествия.')
+            valid = False
+
+    return valid
+
+
+def add_route_rows(route, dots, notes):
+    """
+    Добавление новых точек и заметок к маршруту пачкой:
+    по одному INSERT на точки, заметки и каждую связующую таблицу
+    независимо от количества строк. Вызывается внутри транзакции.
+
+    @param route: маршрут
+    @type route: :class:`PrivateRoute`
+
+    @param dots: несохранённые точки
+    @type dots: list
+
+    @param notes: несохранённые заметки
+    @type notes: list
+
+    @return: сохранённые точки
+    @rtype: list
+    """
+
+    dots = PrivateDot.objects.bulk_create(dots)
+    notes = Note.objects.bulk_create(notes)
+
+    PrivateRoute.dots.through.objects.bulk_create([
+        PrivateRoute.dots.through(privateroute_id=route.id, privatedot_id=dot.id) for dot in dots
+    ])
+    PrivateRoute.note.through.objects.bulk_create([
+        PrivateRoute.note.through(privateroute_id=route.id, note_id=note.id) for note in notes
+    ])
+
+    return dots
+
+
+def diff_rows(stored, row_forms, fields):
+    """
+    Сравнение отправленных строк с сохранёнными по id строки.
+    Строки без id или с чужим id считаются новыми,
+    сохранённые строки, которых нет среди отправленных, - удалёнными.
+
+    @param stored: сохранённые строки маршрута
+    @type stored: :class:`django.db.models.QuerySet`
+
+    @param row_forms: проверенные формы отправленных строк
+    @type row_forms: list
+
+    @param fields: сравниваемые поля
+    @type fields: tuple
+
+    @return: изменённые строки, новые несохранённые строки и id удалённых строк
+    @rtype: tuple
+    """
+
+    stored = {row.id: row for row in stored}
+    changed = []
+    new = []
+
+    for row_form in row_forms:
+        row = stored.pop(row_form.cleaned_data.get('id'), None)
+
+        if row is None:
+            new.append(row_form.save(commit=False))
+            continue
+
+        values = {field: row_form.cleaned_data[field] for field in fields}
+
+        if any(getattr(row, field) != value for field, value in values.items()):
+            for field, value in values.items():
+                setattr(row, field, value)
+
+            changed.append(row)
+
+    return changed, new, list(stored)
+
+
+def update_route_rows(route, dot_forms, note_forms):
+    """
+    Применение изменений точек и заметок маршрута:
+    записываются только изменённые строки (bulk_update), новые строки (bulk_create)
+    и удаления, поэтому количество запросов не зависит от размера маршрута.
+    Об изменённых и удалённых заметках другие процессы уведомляются одним запросом.
+    Вызывается внутри транзакции.
+
+    @param route: маршрут
+    @type route: :class:`PrivateRoute`
+
+    @param dot_forms: проверенные формы точек
+    @type dot_forms: list
+
+    @param note_forms: проверенные формы заметок
+    @type note_forms: list
+
+    @return: точки, которым нужно геокодирование (новые и с изменённым адресом)
+    @rtype: list
+    """
+
+    changed_dots, new_dots, deleted_dots = diff_rows(route.dots.all(), dot_forms, DOT_FIELDS)
+    changed_notes, new_notes, deleted_notes = diff_rows(route.note.all(), note_forms, NOTE_FIELDS)
+
+    with batch_changes():
+        if changed_dots:
+            PrivateDot.objects.bulk_update(changed_dots, DOT_FIELDS)
+
+        if changed_notes:
+            Note.objects.bulk_update(changed_notes, NOTE_FIELDS)
+
+        if deleted_dots:
+            PrivateDot.objects.filter(id__in=deleted_dots).delete()
+
+        if deleted_notes:
+            Note.objects.filter(id__in=deleted_notes).delete()
+
+        if new_dots or new_notes:
+            new_dots = add_route_rows(route, new_dots, new_notes)
+
+    notify_batch(note_ids=[note.id for note in changed_notes] + list(deleted_notes))
+
+    return new_dots + [dot for dot in changed_dots if dot.information != dot.geocoded_information]
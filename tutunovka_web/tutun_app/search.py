@@ -0,0 +1,85 @@
+"""
+full-text search for the tutun_app application
+"""
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramSimilarity
+from django.db.models import F, FloatField, Q, TextField, Value
+from django.db.models.functions import Cast, Coalesce
+
+from .models import PublicRoute
+
+# Поиск ведётся сразу с русской и английской морфологией
+SEARCH_CONFIGS = ('russian', 'english')
+
+
+def build_search_vector(route):
+    """
+    Поисковый вектор маршрута: название (вес A), комментарий (вес B),
+    а также названия и адреса точек и теги (вес C)
+
+    @param route: публичный маршрут
+    @type route: :class:`PublicRoute`
+
+    @return: выражение для записи в поле search_vector
+    @rtype: :class:`django.contrib.postgres.search.SearchVector`
+    """
+
+    document = ' '.join(
+        [f'{dot.name} {dot.information}' for dot in route.dots.all()] +
+        list(route.tags.names())
+    )
+
+    vector = None
+
+    for config in SEARCH_CONFIGS:
+        part = (
+            SearchVector('Name', weight='A', config=config) +
+            SearchVector('comment', weight='B', config=config) +
+            SearchVector(Value(document, output_field=TextField()), weight='C', config=config)
+        )
+        vector = part if vector is None else vector + part
+
+    return vector
+
+
+def update_search_index(route):
+    """
+    Обновление поискового вектора маршрута, вызывается при публикации маршрута
+
+    @param route: публичный маршрут
+    @type route: :class:`PublicRoute`
+    """
+
+    PublicRoute.objects.filter(id=route.id).update(search_vector=build_search_vector(route))
+
+
+def search_public_routes(queryset, query):
+    """
+    Полнотекстовый поиск маршрутов с ранжированием.
+    Совпадения по словам ищутся по GIN-индексу поискового вектора,
+    а опечатки в названии находятся по триграммному GIN-индексу.
+
+    @param queryset: маршруты, среди которых ищем
+    @type queryset: :class:`django.db.models.QuerySet`
+
+    @param query: поисковый запрос
+    @type query: basestring
+
+    @return: QuerySet найденных маршрутов с аннотацией rank
+    @rtype: :class:`django.db.models.QuerySet`
+    """
+
+    search_query = None
+
+    for config in SEARCH_CONFIGS:
+        part = SearchQuery(query, config=config, search_type='websearch')
+        search_query = part if search_query is None else search_query | part
+
+    return queryset.annotate(
+        rank=Cast(
+            Coalesce(SearchRank(F('search_vector'), search_query), Value(0.0)) + TrigramSimilarity('Name', query),
+            FloatField()
+        )
+    ).filter(
+        Q(search_vector=search_query) | Q(Name__trigram_similar=query)
+    )
@@ -0,0 +1,171 @@
+"""
+signals for the tutun_app application
+"""
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from taggit.models import Tag, TaggedItem
+
+from .facets import change_facet_counts, route_facet_values
+from .models import Note, PrivateRoute, PublicDot, PublicRoute
+from .page_cache import invalidate_public_pages
+from .queries import in_batch, notes_changed, notify_changes, routes_changed
+from .route_detail_cache import invalidate_public_route_details
+from .tag_catalogue import invalidate_tag_catalogue
+
+
+@receiver(pre_delete, sender=PublicRoute)
+def remove_route_from_facets(sender, instance, **kwargs):
+    """
+    Уменьшение счётчиков фильтров при удалении публичного маршрута.
+    Вызывается до удаления, пока теги маршрута ещё доступны.
+    """
+
+    change_facet_counts(route_facet_values(instance), -1)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_changed(sender, instance, signal, created=False, **kwargs):
+    """
+    Инвалидация каталога тегов при создании, переименовании или удалении тега.
+    Публичные страницы сбрасываются, только если переименован тег публичных маршрутов:
+    использования удаляемого тега удаляются по одному и обрабатываются в tagged_item_changed
+    """
+
+    transaction.on_commit(invalidate_tag_catalogue)
+
+    if signal is post_save and not created and TaggedItem.objects.filter(
+            tag=instance, content_type=ContentType.objects.get_for_model(PublicRoute)).exists():
+        transaction.on_commit(invalidate_public_pages)
+
+
+@receiver(post_save, sender=TaggedItem)
+@receiver(post_delete, sender=TaggedItem)
+def tagged_item_changed(sender, instance, **kwargs):
+    """
+    Инвалидация каталога тегов и публичных страниц при изменении тегов публичного маршрута.
+    Теги приватных маршрутов не попадают ни в облако, ни на публичные страницы.
+    taggit добавляет и удаляет использования тегов по одному, поэтому m2m_changed
+    с пустым pk_set, который add() отправляет всегда, здесь не нужен.
+    """
+
+    if instance.content_type_id == ContentType.objects.get_for_model(PublicRoute).id:
+        transaction.on_commit(invalidate_tag_catalogue)
+        transaction.on_commit(invalidate_public_pages)
+
+
+@receiver(post_save, sender=PublicRoute)
+@receiver(post_delete, sender=PublicRoute)
+def public_route_changed(sender, instance, **kwargs):
+    """
+    Инвалидация кэша публичных страниц, карточек и данных маршрута после коммита,
+    чтобы страница не закэшировалась заново до появления изменений в базе данных
+    """
+
+    route_id = instance.id
+    transaction.on_commit(invalidate_public_pages)
+    transaction.on_commit(lambda: invalidate_public_route_details([route_id]))
+
+
+def invalidate_route_details_on_commit(route_ids):
+    """
+    Инвалидация кэша данных маршрутов после коммита
+
+    @param route_ids: id маршрутов
+    @type route_ids: list
+    """
+
+    route_ids = list(route_ids)
+
+    if route_ids:
+        transaction.on_commit(lambda: invalidate_public_route_details(route_ids))
+
+
+@receiver(post_save, sender=PublicDot)
+@receiver(pre_delete, sender=PublicDot)
+def public_dot_changed(sender, instance, created=False, **kwargs):
+    """
+    Инвалидация данных маршрутов с изменённой точкой.
+    Одна точка может входить в несколько маршрутов, у новой точки маршрутов ещё нет.
+    При удалении маршруты ищутся до удаления, пока связи с ними ещё есть.
+    """
+
+    if not created:
+        invalidate_route_details_on_commit(instance.publicroute_set.values_list('id', flat=True))
+
+
+@receiver(m2m_changed, sender=PublicRoute.dots.through)
+def public_route_dots_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Инвалидация данных маршрутов при изменении состава точек
+    """
+
+    if action in ('post_add', 'post_remove', 'post_clear') and not reverse:
+        invalidate_route_details_on_commit([instance.id])
+    elif action in ('post_add', 'post_remove') and reverse:
+        invalidate_route_details_on_commit(pk_set)
+    elif action == 'pre_clear' and reverse:
+        invalidate_route_details_on_commit(instance.publicroute_set.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=TaggedItem)
+@receiver(post_delete, sender=TaggedItem)
+@receiver(m2m_changed, sender=TaggedItem)
+def public_route_tags_changed(sender, instance, **kwargs):
+    """
+    Инвалидация данных маршрутов при изменении их тегов или переименовании тега.
+    При удалении тега удаляются и его использования, они обрабатываются по одному.
+    """
+
+    if not kwargs.get('action', 'post_').startswith('post_'):
+        return
+
+    content_type = ContentType.objects.get_for_model(PublicRoute)
+
+    if isinstance(instance, PublicRoute):
+        invalidate_route_details_on_commit([instance.id])
+    elif isinstance(instance, TaggedItem) and instance.content_type_id == content_type.id:
+        invalidate_route_details_on_commit([instance.object_id])
+    elif isinstance(instance, Tag) and not kwargs.get('created'):
+        invalidate_route_details_on_commit(
+            TaggedItem.objects.filter(tag=instance, content_type=content_type).values_list('object_id', flat=True)
+        )
+
+
+@receiver(post_save, sender=PrivateRoute)
+@receiver(post_delete, sender=PrivateRoute)
+def private_route_changed(sender, instance, **kwargs):
+    """
+    Хук инвалидации кэшей маршрутов автора после коммита
+    и уведомление других процессов.
+    Внутри batch_changes уведомляет вызывающий код
+    """
+
+    if in_batch():
+        return
+
+    author_id = instance.author_id
+    notify_changes(user_ids=[author_id])
+    transaction.on_commit(lambda: routes_changed.send(sender=PrivateRoute, user_id=author_id))
+
+
+@receiver(post_save, sender=Note)
+@receiver(post_delete, sender=Note)
+def note_changed(sender, instance, **kwargs):
+    """
+    Хук инвалидации кэшей заметки после коммита
+    и уведомление других процессов.
+    Внутри batch_changes уведомляет вызывающий код
+    """
+
+    if in_batch():
+        return
+
+    note_id = instance.id
+    notify_changes(note_ids=[note_id])
+    transaction.on_commit(lambda: notes_changed.send(sender=Note, note_ids=[note_id]))
@@ -0,0 +1,135 @@
+"""
+tag catalogue for the tutun_app application
+"""
+
+import time
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from taggit.models import Tag
+
+from tutun.settings import TAG_CLOUD_SIZE
+from .models import PublicRoute
+
+VERSION_KEY = 'tag_catalogue:version'
+
+
+def _catalogue_key(part):
+    """
+    @param part: часть каталога: 'all', 'cloud' или 'slugs'
+    @type part: basestring
+
+    @return: ключ кэша части текущей версии каталога
+    @rtype: basestring
+    """
+
+    # если версия пропала из кэша, новая версия не должна совпасть ни с одной старой
+    version = cache.get_or_set(VERSION_KEY, time.time_ns, timeout=None)
+
+    return f'tag_catalogue:{version}:{part}'
+
+
+def _get_catalogue_part(part):
+    """
+    Часть каталога из кэша. Все части строятся одним запросом и кэшируются вместе,
+    чтобы страницам не приходилось читать из кэша весь каталог ради облака или одного тега:
+    all - весь каталог, cloud - первая часть облака тегов, slugs - теги публичных маршрутов по slug
+
+    @param part: часть каталога
+    @type part: basestring
+
+    @return: часть каталога
+    @rtype: list / tuple / dict
+    """
+
+    key = _catalogue_key(part)
+    value = cache.get(key)
+
+    if value is None:
+        content_type = ContentType.objects.get_for_model(PublicRoute)
+        # Считаются только публичные маршруты: тег только приватных маршрутов
+        # не должен вести в облаке на пустую страницу
+        catalogue = list(
+            Tag.objects.annotate(count=Count('taggit_taggeditem_items', filter=Q(
+                taggit_taggeditem_items__content_type=content_type)))
+            .order_by('-count', 'name')
+            .values('id', 'name', 'slug', 'count')
+        )
+        public = [tag for tag in catalogue if tag['count']]
+        parts = {
+            'all': catalogue,
+            'cloud': (public[:TAG_CLOUD_SIZE], len(public) > TAG_CLOUD_SIZE),
+            'slugs': {tag['slug']: tag for tag in public},
+        }
+        cache.set_many({_catalogue_key(name): content for name, content in parts.items()}, timeout=None)
+        value = parts[part]
+
+    return value
+
+
+def get_tag_catalogue():
+    """
+    Каталог всех тегов, отсортированный по количеству публичных маршрутов.
+    Хранится в кэше до изменения тегов, поэтому таблица тегов
+    читается только после инвалидации.
+
+    @return: список {'id', 'name', 'slug', 'count'}
+    @rtype: list
+    """
+
+    return _get_catalogue_part('all')
+
+
+def invalidate_tag_catalogue():
+    """
+    Инвалидация каталога сменой версии, старая версия просто перестаёт читаться.
+    Вызывается после коммита, иначе параллельный запрос успеет закэшировать
+    каталог до изменения навсегда
+    """
+
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def get_tag_cloud(offset=0, size=TAG_CLOUD_SIZE):
+    """
+    Часть облака тегов
+
+    @param offset: с какого тега начинать
+    @type offset: int
+
+    @param size: количество тегов
+    @type size: int
+
+    @return: теги и есть ли теги дальше
+    @rtype: tuple
+    """
+
+    if offset == 0 and size == TAG_CLOUD_SIZE:
+        return _get_catalogue_part('cloud')
+
+    public = [tag for tag in get_tag_catalogue() if tag['count']]
+
+    return public[offset:offset + size], len(public) > offset + size
+
+
+def get_tag_by_slug(slug):
+    """
+    @return: тег публичных маршрутов с указанным slug либо None
+    @rtype: dict
+    """
+
+    return _get_catalogue_part('slugs').get(slug)
+
+
+def get_tag_choices():
+    """
+    @return: варианты выбора тегов для форм
+    @rtype: list
+    """
+
+    return [(tag['id'], tag['name']) for tag in sorted(get_tag_catalogue(), key=lambda tag: tag['name'])]
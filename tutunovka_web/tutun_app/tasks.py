@@ -0,0 +1,120 @@
+"""
+background task queue for the tutun_app application
+"""
+
+import datetime
+import logging
+import traceback
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from tutun.settings import JOB_RETRY_BACKOFF, JOB_RETRY_BACKOFF_MAX, JOB_VISIBILITY_TIMEOUT
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(task, max_attempts=5, delay=0, **payload):
+    """
+    Постановка задачи в очередь.
+    Задача сохраняется в той же транзакции, что и изменения, которые её породили,
+    поэтому обработчик увидит её только после фиксации этих изменений.
+
+    @param task: путь до функции задачи, например 'tutun_app.geocoder.geocode_dots'
+    @type task: basestring
+
+    @param max_attempts: максимальное количество попыток
+    @type max_attempts: int
+
+    @param delay: через сколько секунд можно начать выполнение
+    @type delay: int
+
+    @param payload: именованные аргументы функции, должны сериализоваться в JSON
+
+    @return: созданная задача
+    @rtype: :class:`Job`
+    """
+
+    return Job.objects.create(
+        task=task,
+        payload=payload,
+        max_attempts=max_attempts,
+        run_at=timezone.now() + datetime.timedelta(seconds=delay),
+    )
+
+
+def claim_job(visibility_timeout=JOB_VISIBILITY_TIMEOUT):
+    """
+    Захват одной готовой к выполнению задачи.
+    Строка блокируется через SELECT ... FOR UPDATE SKIP LOCKED, поэтому несколько
+    обработчиков не получат одну и ту же задачу. Задача, обработчик которой
+    не уложился в visibility_timeout (например, упал), снова становится доступной,
+    если у неё остались попытки, иначе помечается как ошибочная.
+
+    @param visibility_timeout: на сколько секунд задача закрепляется за обработчиком
+    @type visibility_timeout: int
+
+    @return: захваченная задача либо None, если очередь пуста
+    @rtype: :class:`Job`
+    """
+
+    now = timezone.now()
+
+    with transaction.atomic():
+        Job.objects.filter(status=Job.RUNNING, locked_until__lt=now, attempts__gte=F('max_attempts')).update(
+            status=Job.FAILED, locked_until=None, last_error='Visibility timeout expired on the last attempt')
+
+        job = Job.objects.select_for_update(skip_locked=True).filter(
+            Q(status=Job.QUEUED) | Q(status=Job.RUNNING, locked_until__lt=now, attempts__lt=F('max_attempts')),
+            run_at__lte=now,
+        ).order_by('run_at').first()
+
+        if job is None:
+            return None
+
+        job.status = Job.RUNNING
+        job.attempts += 1
+        job.locked_until = now + datetime.timedelta(seconds=visibility_timeout)
+        job.save(update_fields=['status', 'attempts', 'locked_until'])
+
+    return job
+
+
+def run_job(job):
+    """
+    Выполнение захваченной задачи.
+    Успешно выполненная задача удаляется, неудачная откладывается с экспоненциальной
+    задержкой, а после max_attempts попыток помечается как ошибочная.
+
+    @param job: захваченная задача
+    @type job: :class:`Job`
+
+    @return: выполнилась ли задача успешно
+    @rtype: bool
+    """
+
+    try:
+        import_string(job.task)(**job.payload)
+    except Exception:
+        job.last_error = traceback.format_exc()
+        job.locked_until = None
+
+        if job.attempts >= job.max_attempts:
+            job.status = Job.FAILED
+            logger.error('Job %s (%s) failed after %s attempts', job.id, job.task, job.attempts)
+        else:
+            job.status = Job.QUEUED
+            job.run_at = timezone.now() + datetime.timedelta(
+                seconds=min(JOB_RETRY_BACKOFF * 2 ** (job.attempts - 1), JOB_RETRY_BACKOFF_MAX))
+            logger.warning('Job %s (%s) failed, retry at %s', job.id, job.task, job.run_at)
+
+        job.save(update_fields=['status', 'run_at', 'locked_until', 'last_error'])
+
+        return False
+
+    Job.objects.filter(id=job.id).delete()
+
+    return True
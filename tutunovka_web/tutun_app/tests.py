@@ -1,3 +1,1078 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import dataclasses
+import datetime
+import io
+import json
+import os
+import pickle
+import signal
+import tempfile
+import threading
+import time
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+import httpx
+import requests
+
+from tutun.settings import API_YANDEX_MAPS_KEY, GEOCODE_NEGATIVE_TTL, JOB_RETRY_BACKOFF
+
+from . import geocoder, http_client, maps_bundle, queries, tasks, views
+from .facets import change_facet_counts, route_facet_values
+from .management.commands import run_worker
+from .maps_bundle import MAPS_BUNDLE
+from .models import GeocodeCache, Job, Note, PrivateRoute, PublicDot, PublicRoute, PublicRouteFacet
+from .page_cache import invalidate_public_pages
+from .pagination import clean_cursor, encode_cursor
+from .route_detail_cache import invalidate_public_route_details
+from .tag_catalogue import get_tag_by_slug, get_tag_catalogue, get_tag_cloud, invalidate_tag_catalogue
+
+
+class PublicRoutesQueriesTest(TestCase):
+    """
+    Количество запросов к базе данных на страницах публичных маршрутов
+    не должно зависеть от количества маршрутов на странице
+    """
+
+    # маршруты, теги маршрутов (prefetch); облако тегов берётся из кэша
+    LIST_QUERIES = 2
+    # + счётчики фильтров
+    PUBLIC_ROUTES_QUERIES = LIST_QUERIES + 1
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author', password='password')
+
+        for index in range(45):
+            route = PublicRoute.objects.create(Name=f'Маршрут {index}', author=author, comment='')
+            route.tags.add('sea', f'tag {index % 5}')
+
+    def setUp(self):
+        # кэш не откатывается вместе с транзакцией теста
+        invalidate_tag_catalogue()
+        invalidate_public_pages()
+        get_tag_catalogue()
+
+    def test_public_routes_page(self):
+        with self.assertNumQueries(self.PUBLIC_ROUTES_QUERIES):
+            response = self.client.get(reverse('public_routes'))
+
+        self.assertEqual(len(response.context['routes_list']), 20)
+        self.assertIsNotNone(response.context['next_page_query'])
+
+    def test_invalid_cursor_shows_first_page(self):
+        first = self.client.get(reverse('public_routes')).context['routes_list']
+
+        for values in (['a'], [{}], [None], [True], [10 ** 30], [[1]]):
+            response = self.client.get(reverse('public_routes'), {'cursor': encode_cursor(values)})
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.context['routes_list'], first)
+
+    def test_search_cursor_rank_must_be_number(self):
+        self.assertEqual(clean_cursor([0.5, '7'], PublicRoute, ['rank', 'id']), [0.5, 7])
+
+        for rank in ('0.5', None, True, float('nan'), [0.5]):
+            self.assertIsNone(clean_cursor([rank, 7], PublicRoute, ['rank', 'id']))
+
+    def test_public_routes_pages_do_not_overlap(self):
+        seen = []
+        url = reverse('public_routes')
+
+        while url:
+            with self.assertNumQueries(self.PUBLIC_ROUTES_QUERIES):
+                response = self.client.get(url)
+
+            seen.extend(route.id for route in response.context['routes_list'])
+            next_page_query = response.context['next_page_query']
+            url = f"{reverse('public_routes')}?{next_page_query}" if next_page_query else None
+
+        self.assertEqual(seen, list(PublicRoute.objects.order_by('-id').values_list('id', flat=True)))
+
+    def test_public_routes_by_tag_page(self):
+        with self.assertNumQueries(self.LIST_QUERIES):
+            response = self.client.get(reverse('public_routes_by_tags', kwargs={'tag': 'sea'}))
+
+        self.assertEqual(len(response.context['routes_list']), 20)
+
+    def test_search_results_page(self):
+        with self.assertNumQueries(self.LIST_QUERIES):
+            response = self.client.get(reverse('search_results_public'), {'q': 'Маршрут'})
+
+        self.assertEqual(len(response.context['routes_list']), 20)
+
+    def test_search_without_query(self):
+        response = self.client.get(reverse('search_results_public'))
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_tag_cloud_invalidated_on_tag_change(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            PublicRoute.objects.first().tags.add('mountains')
+            # до коммита в кэше остаётся прежний каталог
+            self.assertNotIn('mountains', [tag['name'] for tag in get_tag_catalogue()])
+
+        self.assertIn('mountains', [tag['name'] for tag in get_tag_catalogue()])
+        self.assertEqual(get_tag_by_slug('mountains')['count'], 1)
+
+    def test_private_tags_are_not_in_tag_cloud(self):
+        route = PrivateRoute.objects.create(Name='Приватный', author=User.objects.get(username='author'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            route.tags.add('secret', 'sea')
+
+        self.assertNotIn('secret', [tag['name'] for tag in get_tag_cloud(size=100)[0]])
+        self.assertIsNone(get_tag_by_slug('secret'))
+        self.assertEqual(get_tag_by_slug('sea')['count'], 45)
+        self.assertIn('secret', [tag['name'] for tag in get_tag_catalogue()])
+
+    def test_tag_cloud_load_more(self):
+        tags, tags_more = get_tag_cloud(size=4)
+        data = self.client.get(reverse('public_routes_tag_cloud'), {'offset': 4}).json()
+
+        self.assertEqual(tags[0]['name'], 'sea')
+        self.assertTrue(tags_more)
+        self.assertEqual(len(data['tags']), 2)
+        self.assertFalse(data['more'])
+
+
+class PublicRoutesFacetsTest(TestCase):
+    """
+    Фильтры публичных маршрутов и их счётчики
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author', password='password')
+
+        for index, (month, length, tags) in enumerate([(5, 2, ['sea']), (5, 10, ['sea', 'mountains']),
+                                                       (7, 2, ['mountains'])]):
+            route = PublicRoute.objects.create(Name=f'Маршрут {index}', author=author, comment='',
+                                               month=month, year=2024, length=length)
+            route.tags.add(*tags)
+            change_facet_counts(route_facet_values(route), 1)
+
+    def setUp(self):
+        invalidate_public_pages()
+
+    def test_facet_counts(self):
+        with self.assertNumQueries(1):
+            facets = self.client.get(reverse('public_routes_facets')).json()
+
+        self.assertEqual({item['value']: item['count'] for item in facets['tag']}, {'sea': 2, 'mountains': 2})
+        self.assertEqual({item['value']: item['count'] for item in facets['month']}, {'5': 2, '7': 1})
+        self.assertEqual({item['value']: item['count'] for item in facets['length']}, {'0-3': 2, '8-14': 1})
+
+    def test_deleted_route_leaves_facet_counts(self):
+        PublicRoute.objects.get(Name='Маршрут 2').delete()
+        facets = self.client.get(reverse('public_routes_facets')).json()
+
+        self.assertEqual({item['value']: item['count'] for item in facets['month']}, {'5': 2})
+
+    def test_rebuild_if_empty(self):
+        PublicRouteFacet.objects.filter(facet='month', value='7').delete()
+        call_command('rebuild_facets', '--if-empty', stdout=io.StringIO())
+        self.assertFalse(PublicRouteFacet.objects.filter(facet='month', value='7').exists())
+
+        PublicRouteFacet.objects.all().delete()
+        call_command('rebuild_facets', '--if-empty', stdout=io.StringIO())
+        self.assertEqual(PublicRouteFacet.objects.get(facet='month', value='5').count, 2)
+
+    def test_combined_filters(self):
+        response = self.client.get(reverse('public_routes'), {'tag': ['sea', 'mountains'], 'month': '5'})
+
+        self.assertEqual([route.Name for route in response.context['routes_list']], ['Маршрут 1'])
+
+
+class PublicPageCacheTest(TestCase):
+    """
+    Публичные страницы для анонимных посетителей строятся один раз
+    до изменения публичных маршрутов
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='password')
+        cls.route = PublicRoute.objects.create(Name='Море', author=cls.author, comment='')
+        cls.route.tags.add('sea')
+
+    def setUp(self):
+        invalidate_public_pages()
+
+    def test_anonymous_page_is_cached(self):
+        first = self.client.get(reverse('public_routes'))
+
+        with self.assertNumQueries(0):
+            second = self.client.get(reverse('public_routes'))
+
+        self.assertEqual(second.content, first.content)
+        self.assertContains(second, 'Море')
+
+    def test_authenticated_page_is_not_cached(self):
+        self.client.get(reverse('public_routes'))
+        self.client.force_login(self.author)
+
+        response = self.client.get(reverse('public_routes'))
+
+        self.assertIsNotNone(response.context)
+        self.assertContains(response, reverse('new_route'))
+
+    def test_page_with_messages_is_not_cached(self):
+        self.client.get(reverse('index'))
+        self.client.force_login(self.author)
+        self.client.get(reverse('logout'))
+
+        self.assertContains(self.client.get(reverse('index')), 'Вы успешно вышли')
+        self.assertNotContains(self.client.get(reverse('index')), 'Вы успешно вышли')
+
+    def test_route_change_invalidates_page_and_card(self):
+        self.client.get(reverse('public_routes_by_tags', kwargs={'tag': 'sea'}))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.route.Name = 'Горы'
+            self.route.save()
+
+        response = self.client.get(reverse('public_routes_by_tags', kwargs={'tag': 'sea'}))
+
+        self.assertContains(response, 'Горы')
+        self.assertNotContains(response, 'Море')
+
+    def test_published_route_appears(self):
+        self.client.get(reverse('public_routes'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            PublicRoute.objects.create(Name='Лес', author=self.author, comment='')
+
+        self.assertContains(self.client.get(reverse('public_routes')), 'Лес')
+
+    def test_private_route_tags_keep_page(self):
+        route = PrivateRoute.objects.create(Name='Дача', author=self.author, date_in=datetime.date(2024, 5, 1),
+                                            date_out=datetime.date(2024, 5, 2))
+        self.client.get(reverse('public_routes'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            route.tags.add('sea')
+            route.tags.set(['sea', 'дача'])
+            route.tags.set(['sea', 'дача'])
+            route.tags.remove('sea')
+
+        with self.assertNumQueries(0):
+            self.client.get(reverse('public_routes'))
+
+
+class PublicRouteDetailCacheTest(TestCase):
+    """
+    Страница публичного маршрута берётся из кэша до изменения маршрута, точек или тегов
+    """
+
+    # сессия и пользователь
+    AUTH_QUERIES = 2
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='password')
+        cls.route = PublicRoute.objects.create(Name='Море', author=cls.author, comment='')
+        cls.dot = PublicDot.objects.create(name='Пляж', information='Сочи', longitude=39.7, latitude=43.6,
+                                           geo_name='Сочи', geocoded_information='Сочи')
+        cls.route.dots.add(cls.dot)
+        cls.route.tags.add('sea')
+
+    def setUp(self):
+        invalidate_public_route_details([self.route.id])
+        self.client.force_login(self.author)
+
+    def get_detail(self):
+        return self.client.get(reverse('public_route_detail', kwargs={'route_id': self.route.id}))
+
+    def test_cached_detail_does_not_read_route(self):
+        self.get_detail()
+
+        with self.assertNumQueries(self.AUTH_QUERIES):
+            response = self.get_detail()
+
+        self.assertContains(response, 'Пляж')
+        self.assertContains(response, 'Теги: sea')
+
+    def test_cached_detail_has_no_model_instances(self):
+        self.get_detail()
+        cached = cache.get(f'public_route_detail:{self.route.id}')
+
+        self.assertEqual(cached['route']['author_name'], 'author')
+        self.assertNotIn(self.author.password.encode(), pickle.dumps(cached))
+        self.assertNotIn(b'django.db.models', pickle.dumps(cached))
+
+    def test_missing_route(self):
+        response = self.client.get(reverse('public_route_detail', kwargs={'route_id': self.route.id + 1}))
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_dot_change_invalidates_detail(self):
+        self.get_detail()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dot.name = 'Набережная'
+            self.dot.save()
+
+        self.assertContains(self.get_detail(), 'Набережная')
+
+    def test_tag_change_invalidates_detail(self):
+        self.get_detail()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.route.tags.add('mountains')
+
+        self.assertContains(self.get_detail(), 'mountains')
+
+    def test_dots_change_invalidates_detail(self):
+        self.get_detail()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.route.dots.add(PublicDot.objects.create(name='Гора', information='Красная Поляна', longitude=40.2,
+                                                         latitude=43.7, geo_name='Красная Поляна',
+                                                         geocoded_information='Красная Поляна'))
+
+        self.assertContains(self.get_detail(), 'Гора')
+
+    def test_detail_with_pending_dots_is_not_cached(self):
+        PublicDot.objects.filter(id=self.dot.id).update(geocoded_information=None)
+        self.get_detail()
+
+        with CaptureQueriesContext(connection) as captured:
+            self.get_detail()
+
+        self.assertGreater(len(captured), self.AUTH_QUERIES)
+
+    def test_viewing_pending_route_does_not_enqueue(self):
+        PublicDot.objects.filter(id=self.dot.id).update(geocoded_information=None)
+
+        for _ in range(3):
+            self.assertContains(self.get_detail(), 'обновите страницу позже')
+
+        self.assertFalse(Job.objects.exists())
+
+    def test_saved_route_geocodes_pending_dots(self):
+        self.route.dots.add(PublicDot.objects.create(name='Гора', information='Красная Поляна'))
+
+        self.client.post(reverse('save_route', kwargs={'pk': self.route.id}))
+
+        copy = PrivateRoute.objects.get(author=self.author)
+        self.assertEqual(sorted(copy.dots.values_list('name', 'longitude', 'geocoded_information')),
+                         [('Гора', None, None), ('Пляж', 39.7, 'Сочи')])
+        self.assertEqual(Job.objects.get().payload,
+                         {'model': 'tutun_app.PrivateDot', 'dot_ids': [copy.dots.get(name='Гора').id]})
+
+
+class RouteCreationTest(TestCase):
+    """
+    Создание маршрута пишет точки и заметки пачкой в одной транзакции
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='password')
+
+    def setUp(self):
+        self.client.force_login(self.author)
+        ContentType.objects.get_for_model(PrivateRoute)
+
+    @staticmethod
+    def route_data(dots, dot_date='2024-05-02'):
+        data = {'Name': 'Маршрут', 'date_in': '2024-05-01', 'date_out': '2024-05-10', 'rate': 0,
+                'notes-0-text': 'Паспорт', 'notes-1-text': 'Билеты'}
+
+        for index in range(dots):
+            data.update({f'dots-{index}-name': f'Точка {index}', f'dots-{index}-information': f'Город {index}',
+                         f'dots-{index}-date': dot_date})
+
+        return data
+
+    def create_route(self, data):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('new_route'), data)
+
+        return response, len(queries)
+
+    def test_queries_do_not_depend_on_dots(self):
+        _, few = self.create_route(self.route_data(2))
+        response, many = self.create_route(self.route_data(50))
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(few, many)
+        self.assertEqual(PrivateRoute.objects.last().dots.count(), 50)
+        self.assertEqual(PrivateRoute.objects.last().note.count(), 2)
+
+    def test_invalid_dot_date_writes_nothing(self):
+        response, _ = self.create_route(self.route_data(3, dot_date='2024-06-01'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(PrivateRoute.objects.exists())
+
+
+class RouteEditingTest(TestCase):
+    """
+    Редактирование маршрута записывает только изменённые строки
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='password')
+
+    def setUp(self):
+        self.client.force_login(self.author)
+        ContentType.objects.get_for_model(PrivateRoute)
+
+    def create_route(self, dots, notes=0):
+        data = RouteCreationTest.route_data(dots)
+        data.update({f'notes-{index}-text': f'Заметка {index}' for index in range(2, 2 + notes)})
+        self.client.post(reverse('new_route'), data)
+        route = PrivateRoute.objects.last()
+
+        data = {'Name': route.Name, 'date_in': '2024-05-01', 'date_out': '2024-05-10', 'rate': 0}
+
+        for index, dot in enumerate(route.dots.order_by('id')):
+            data.update({f'dots-{index}-id': dot.id, f'dots-{index}-name': dot.name,
+                         f'dots-{index}-information': dot.information, f'dots-{index}-date': '2024-05-02'})
+
+        for index, note in enumerate(route.note.order_by('id')):
+            data.update({f'notes-{index}-id': note.id, f'notes-{index}-text': note.text})
+
+        return route, data
+
+    def edit_route(self, route, data):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('editing_route', kwargs={'route_id': route.id}), data)
+
+        self.assertEqual(response.status_code, 302)
+
+        return len(queries)
+
+    def test_queries_do_not_depend_on_dots(self):
+        counts = []
+
+        for dots in (5, 50):
+            route, data = self.create_route(dots)
+            data['dots-3-name'] += '!'
+            counts.append(self.edit_route(route, data))
+
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(route.dots.filter(name__endswith='!').count(), 1)
+
+    def test_deletions_do_not_depend_on_rows(self):
+        counts = []
+
+        for notes in (1, 20):
+            route, data = self.create_route(5, notes)
+            for key in [key for key in data if key.startswith('notes-') and not key.startswith('notes-0-')]:
+                del data[key]
+            for key in [key for key in data if key.startswith('dots-') and not key.startswith('dots-0-')]:
+                del data[key]
+
+            with self.captureOnCommitCallbacks(execute=True):
+                counts.append(self.edit_route(route, data))
+
+            self.assertEqual(route.note.count(), 1)
+            self.assertEqual(route.dots.count(), 1)
+
+        self.assertEqual(counts[0], counts[1])
+
+    def test_rows_added_and_deleted(self):
+        route, data = self.create_route(3)
+        kept_id = data['dots-0-id']
+
+        for key in ('dots-1-id', 'dots-1-name', 'dots-1-information', 'dots-1-date', 'notes-1-id', 'notes-1-text'):
+            del data[key]
+
+        data.update({'dots-7-name': 'Новая точка', 'dots-7-information': 'Город', 'notes-4-text': 'Зонт'})
+        self.edit_route(route, data)
+
+        self.assertEqual(route.dots.count(), 3)
+        self.assertTrue(route.dots.filter(id=kept_id).exists())
+        self.assertTrue(route.dots.filter(name='Новая точка').exists())
+        self.assertEqual(sorted(route.note.values_list('text', flat=True)), ['Зонт', 'Паспорт'])
+
+
+class LRUCacheTest(SimpleTestCase):
+    """
+    Время жизни записей и вытеснение в кэше геокодера процесса
+    """
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(geocoder.time, 'monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = geocoder.LRUCache(maxsize=2, ttl=100, negative_ttl=10)
+
+    def test_entry_expires_after_ttl(self):
+        self.cache.set('сочи', 'точка')
+
+        self.now += 99
+        self.assertEqual(self.cache.get('сочи'), 'точка')
+        self.now += 2
+        self.assertIs(self.cache.get('сочи'), geocoder._MISSING)
+
+    def test_not_found_address_uses_negative_ttl(self):
+        self.cache.set('нигде', None)
+
+        self.now += 9
+        self.assertIsNone(self.cache.get('нигде'))
+        self.now += 2
+        self.assertIs(self.cache.get('нигде'), geocoder._MISSING)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.cache.set('сочи', 1)
+        self.cache.set('казань', 2)
+        self.cache.get('сочи')
+        self.cache.set('пермь', 3)
+
+        self.assertIs(self.cache.get('казань'), geocoder._MISSING)
+        self.assertEqual((self.cache.get('сочи'), self.cache.get('пермь')), (1, 3))
+
+
+class GeocodeManyTest(TestCase):
+    """
+    Геокодирование точек маршрута через кэш процесса, таблицу кэша и геокодер
+    """
+
+    SOCHI = geocoder.GeoPoint(39.7, 43.6, 'Сочи')
+
+    def setUp(self):
+        geocoder._memory_cache.clear()
+        self.addCleanup(geocoder._memory_cache.clear)
+
+        self.fetched = []
+        patcher = mock.patch.object(geocoder, '_fetch', self.fetch)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fetch(self, address):
+        self.fetched.append(address)
+
+        if address == 'Недоступно':
+            raise requests.exceptions.ConnectionError('Геокодер недоступен')
+
+        return {'Сочи': self.SOCHI, 'Нигде': None}[address]
+
+    def test_fetched_addresses_are_upserted(self):
+        GeocodeCache.objects.create(address='сочи', name='Старое название')
+        GeocodeCache.objects.filter(address='сочи').update(
+            updated=timezone.now() - datetime.timedelta(seconds=GEOCODE_NEGATIVE_TTL + 1))
+
+        points = geocoder.geocode_many(['Сочи', ' сочи ', 'Нигде', 'Недоступно', ''])
+
+        self.assertEqual(points, {'Сочи': self.SOCHI, ' сочи ': self.SOCHI, 'Нигде': None, '': None})
+        self.assertEqual(sorted(self.fetched), ['Недоступно', 'Нигде', 'Сочи'])
+        self.assertEqual(
+            sorted(GeocodeCache.objects.values_list('address', 'longitude', 'latitude', 'name')),
+            [('нигде', None, None, None), ('сочи', 39.7, 43.6, 'Сочи')])
+
+    def test_cached_addresses_are_not_fetched(self):
+        geocoder.geocode_many(['Сочи', 'Нигде'])
+        self.fetched.clear()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(geocoder.geocode_many(['Сочи', 'Нигде']), {'Сочи': self.SOCHI, 'Нигде': None})
+
+        # после перезапуска процесса адреса берутся из таблицы кэша одним запросом
+        geocoder._memory_cache.clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(geocoder.geocode_many(['Сочи', 'Нигде']), {'Сочи': self.SOCHI, 'Нигде': None})
+
+        self.assertEqual(self.fetched, [])
+
+
+def failing_task(**kwargs):
+    """
+    Задача фоновой очереди, которая всегда завершается ошибкой
+    """
+
+    raise RuntimeError('Задача не выполнилась')
+
+
+class JobQueueTest(TestCase):
+    """
+    Повторы, ошибочные задачи и возврат задач упавших обработчиков в фоновой очереди
+    """
+
+    TASK = 'tutun_app.tests.failing_task'
+
+    @staticmethod
+    def make_ready(job):
+        Job.objects.filter(id=job.id).update(run_at=timezone.now())
+
+    def test_failed_job_is_retried_with_backoff(self):
+        job = tasks.enqueue(self.TASK)
+
+        for attempt in range(1, 3):
+            self.make_ready(job)
+            claimed = tasks.claim_job()
+            self.assertEqual((claimed.id, claimed.attempts), (job.id, attempt))
+
+            before = timezone.now()
+            self.assertFalse(tasks.run_job(claimed))
+
+            job.refresh_from_db()
+            self.assertEqual(job.status, Job.QUEUED)
+            self.assertIn('Задача не выполнилась', job.last_error)
+            self.assertAlmostEqual((job.run_at - before).total_seconds(), JOB_RETRY_BACKOFF * 2 ** (attempt - 1),
+                                   delta=5)
+            # до run_at задача не выдаётся
+            self.assertIsNone(tasks.claim_job())
+
+    def test_job_fails_after_max_attempts(self):
+        job = tasks.enqueue(self.TASK, max_attempts=2)
+
+        for _ in range(2):
+            self.make_ready(job)
+            self.assertFalse(tasks.run_job(tasks.claim_job()))
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.make_ready(job)
+        self.assertIsNone(tasks.claim_job())
+
+    def test_expired_job_is_reclaimed(self):
+        job = tasks.enqueue(self.TASK, max_attempts=2)
+        tasks.claim_job()
+
+        self.assertIsNone(tasks.claim_job())
+        Job.objects.filter(id=job.id).update(locked_until=timezone.now() - datetime.timedelta(seconds=1))
+
+        claimed = tasks.claim_job()
+        self.assertEqual((claimed.id, claimed.attempts, claimed.status), (job.id, 2, Job.RUNNING))
+
+    def test_expired_last_attempt_is_failed(self):
+        job = tasks.enqueue(self.TASK, max_attempts=1)
+        tasks.claim_job()
+        Job.objects.filter(id=job.id).update(locked_until=timezone.now() - datetime.timedelta(seconds=1))
+
+        self.assertIsNone(tasks.claim_job())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 1))
+
+
+class RunWorkerTest(SimpleTestCase):
+    """
+    Обработчик очереди переживает недоступность базы данных
+    """
+
+    def test_worker_survives_database_errors(self):
+        handlers = {}
+        calls = []
+
+        def claim(visibility_timeout):
+            calls.append(visibility_timeout)
+            if len(calls) < 3:
+                raise OperationalError('server closed the connection unexpectedly')
+            handlers[signal.SIGTERM](signal.SIGTERM, None)
+
+        with mock.patch.object(run_worker.signal, 'signal', lambda signum, handler: handlers.update({signum: handler})), \
+                mock.patch.object(run_worker, 'claim_job', claim), \
+                mock.patch.object(run_worker, 'close_old_connections') as close_old_connections, \
+                mock.patch.object(run_worker, 'connections'), \
+                mock.patch.object(run_worker.time, 'sleep') as sleep, \
+                self.assertLogs(run_worker.logger, 'ERROR'):
+            run_worker.work(poll_interval=0, visibility_timeout=30)
+
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(close_old_connections.call_count, 2)
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [1, 2, 0])
+
+
+class HealthTest(TestCase):
+    """
+    Проверки живости и готовности для балансировщика и оркестратора
+    """
+
+    def test_live(self):
+        self.assertEqual(self.client.get(reverse('health_live')).status_code, 200)
+
+    def test_ready_checks_migrations_once(self):
+        views.MIGRATIONS_APPLIED = False
+
+        self.assertEqual(self.client.get(reverse('health_ready')).status_code, 200)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(reverse('health_ready')).status_code, 200)
+
+
+class YandexMapsProxyTest(TestCase):
+    """
+    Асинхронное представление yandex_maps не раскрывает ключ API
+    и отдаёт сохранённую копию скрипта
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        for name, value in (('bundle', None), ('_refresh', None), ('_checked', 0.0), ('_retry_at', 0.0),
+                            ('path', os.path.join(directory.name, 'maps_bundle.js'))):
+            patcher = mock.patch.object(MAPS_BUNDLE, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.upstream_requests = []
+
+    def upstream(self, handler):
+        def counted(request):
+            self.upstream_requests.append(request)
+            return handler(request)
+
+        @contextlib.asynccontextmanager
+        async def open_client():
+            async with httpx.AsyncClient(transport=httpx.MockTransport(counted)) as client:
+                yield client
+
+        return mock.patch.object(maps_bundle, 'open_http_client', open_client)
+
+    def get_with_upstream(self, handler, **headers):
+        with self.upstream(handler):
+            return self.client.get(reverse('api_yn_map'), headers=headers)
+
+    @staticmethod
+    def script(request):
+        return httpx.Response(200, text=f"load('{request.url.params['apikey']}')", headers={'ETag': '"v1"'})
+
+    def test_key_is_hidden(self):
+        response = self.get_with_upstream(self.script)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(API_YANDEX_MAPS_KEY, response.content.decode())
+        self.assertIn('api_key_hidden', response.content.decode())
+
+    def test_upstream_error_hides_key(self):
+        def handler(request):
+            raise httpx.ConnectTimeout('timed out', request=request)
+
+        response = self.get_with_upstream(handler)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn(API_YANDEX_MAPS_KEY, response.content.decode())
+
+    def test_bundle_is_cached(self):
+        first = self.get_with_upstream(self.script)
+        second = self.get_with_upstream(self.script)
+
+        self.assertEqual(len(self.upstream_requests), 1)
+        self.assertEqual(second.content, first.content)
+        self.assertTrue(first['ETag'])
+        self.assertIn('max-age', first['Cache-Control'])
+
+    def test_unchanged_bundle_is_not_sent_again(self):
+        etag = self.get_with_upstream(self.script)['ETag']
+
+        response = self.get_with_upstream(self.script, if_none_match=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_stale_bundle_is_served_on_upstream_error(self):
+        content = self.get_with_upstream(self.script).content
+        MAPS_BUNDLE.bundle = dataclasses.replace(MAPS_BUNDLE.bundle, fetched=0)
+
+        def handler(request):
+            raise httpx.ConnectTimeout('timed out', request=request)
+
+        response = self.get_with_upstream(handler)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, content)
+
+    def test_expired_bundle_is_refreshed_by_request(self):
+        self.get_with_upstream(self.script)
+        MAPS_BUNDLE.bundle = dataclasses.replace(MAPS_BUNDLE.bundle, fetched=0)
+
+        response = self.get_with_upstream(lambda request: httpx.Response(200, text='updated'))
+
+        self.assertEqual(response.content, b'updated')
+
+    def test_failed_refresh_is_not_retried_at_once(self):
+        content = self.get_with_upstream(self.script).content
+        MAPS_BUNDLE.bundle = dataclasses.replace(MAPS_BUNDLE.bundle, fetched=0)
+
+        def handler(request):
+            raise httpx.ConnectTimeout('timed out', request=request)
+
+        self.get_with_upstream(handler)
+        response = self.get_with_upstream(handler)
+
+        self.assertEqual(response.content, content)
+        self.assertEqual(len(self.upstream_requests), 2)
+
+    def age_bundle(self, seconds):
+        MAPS_BUNDLE.bundle = dataclasses.replace(MAPS_BUNDLE.bundle, fetched=time.time() - seconds)
+
+    def test_no_refresh_ahead_under_wsgi(self):
+        self.get_with_upstream(self.script)
+        self.age_bundle(MAPS_BUNDLE.ttl - MAPS_BUNDLE.refresh_ahead / 2)
+
+        self.assertEqual(self.get_with_upstream(self.script).status_code, 200)
+        self.assertEqual(len(self.upstream_requests), 1)
+
+    def test_refresh_ahead_in_long_lived_loop(self):
+        content = self.get_with_upstream(self.script).content
+        self.age_bundle(MAPS_BUNDLE.ttl - MAPS_BUNDLE.refresh_ahead / 2)
+        async def get_and_wait():
+            bundle = await MAPS_BUNDLE.get()
+            await MAPS_BUNDLE._refresh
+            return bundle
+
+        with mock.patch.object(MAPS_BUNDLE, 'background', True), \
+                self.upstream(lambda request: httpx.Response(200, text='updated')):
+            bundle = async_to_sync(get_and_wait)()
+
+        self.assertEqual(bundle.body, content)
+        self.assertEqual(MAPS_BUNDLE.bundle.body, b'updated')
+
+    def test_refresh_in_other_loop_is_not_repeated(self):
+        content = self.get_with_upstream(self.script).content
+        self.age_bundle(MAPS_BUNDLE.ttl + 1)
+
+        # обновление, которое идёт в цикле событий другого запроса
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever)
+        thread.start()
+
+        async def start_refresh():
+            return asyncio.get_running_loop().create_task(asyncio.sleep(60))
+
+        MAPS_BUNDLE._refresh = asyncio.run_coroutine_threadsafe(start_refresh(), loop).result()
+
+        try:
+            response = self.get_with_upstream(self.script)
+        finally:
+            loop.call_soon_threadsafe(MAPS_BUNDLE._refresh.cancel)
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+        self.assertEqual(response.content, content)
+        self.assertEqual(len(self.upstream_requests), 1)
+
+    def test_conditional_refresh(self):
+        self.get_with_upstream(self.script)
+        body = MAPS_BUNDLE.bundle.body
+        with self.upstream(lambda request: httpx.Response(304)):
+            bundle = async_to_sync(MAPS_BUNDLE.refresh)()
+
+        self.assertEqual(self.upstream_requests[-1].headers['If-None-Match'], '"v1"')
+        self.assertEqual(bundle.body, body)
+        self.assertEqual(MAPS_BUNDLE.load(), bundle)
+
+
+class HttpClientTest(SimpleTestCase):
+    """
+    Общий HTTP-клиент под ASGI и закрытие клиента запроса под WSGI
+    """
+
+    @staticmethod
+    async def open_twice():
+        async with http_client.open_http_client() as first:
+            pass
+        async with http_client.open_http_client() as second:
+            pass
+        return first, second
+
+    def test_client_is_closed_under_wsgi(self):
+        first, second = async_to_sync(self.open_twice)()
+
+        self.assertTrue(first.is_closed)
+        self.assertTrue(second.is_closed)
+
+    def test_client_is_shared_under_asgi(self):
+        async def open_and_close():
+            clients = await self.open_twice()
+            await clients[0].aclose()
+            return clients
+
+        with mock.patch.object(http_client, 'WEB_INTERFACE', 'asgi'), mock.patch.object(http_client, '_clients', {}):
+            first, second = async_to_sync(open_and_close)()
+
+        self.assertIs(first, second)
+
+
+class BotQueriesTest(TestCase):
+    """
+    Общие с ботом запросы (queries.py) и хуки инвалидации
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='password')
+        cls.past = PrivateRoute.objects.create(Name='Прошедший', author=cls.author,
+                                               date_in=datetime.date(2024, 4, 1),
+                                               date_out=datetime.date(2024, 4, 2))
+        cls.route = PrivateRoute.objects.create(Name='Ближайший', author=cls.author,
+                                                date_in=datetime.date(2024, 5, 1),
+                                                date_out=datetime.date(2024, 5, 3), baggage='Зонт')
+        cls.note = cls.route.note.create(text='Паспорт')
+
+    def test_chat_link(self):
+        self.assertTrue(queries.link_chat(self.author.id, 42))
+        self.assertEqual(queries.get_user_by_chat(42), queries.UserInfo(self.author.id, 'author'))
+
+        self.assertTrue(queries.unlink_chat(42))
+        self.assertIsNone(queries.get_user_by_chat(42))
+
+    def test_nearest_route(self):
+        route = queries.get_nearest_route(self.author.id, datetime.date(2024, 4, 15))
+
+        self.assertEqual(route, queries.RouteInfo(self.route.id, 'Ближайший', datetime.date(2024, 5, 1),
+                                                  datetime.date(2024, 5, 3), None, 'Зонт'))
+        self.assertIsNone(queries.get_nearest_route(self.author.id, datetime.date(2024, 6, 1)))
+
+    def test_set_notes_done_sends_hook_after_commit(self):
+        received = []
+        queries.notes_changed.connect(lambda sender, note_ids, **kwargs: received.extend(note_ids),
+                                      weak=False, dispatch_uid='test_set_notes_done')
+        self.addCleanup(queries.notes_changed.disconnect, dispatch_uid='test_set_notes_done')
+        umbrella = self.route.note.create(text='Зонт', done=True)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as captured:
+                self.assertEqual(queries.set_notes_done(self.route.id, {self.note.id: True, umbrella.id: False}), 2)
+            self.assertEqual(len([query for query in captured if query['sql'].startswith('UPDATE')]), 1)
+            self.assertEqual(received, [])
+
+        self.assertEqual(received, [self.note.id, umbrella.id])
+        self.assertEqual(queries.get_route_notes(self.route.id), [queries.NoteInfo(self.note.id, True, 'Паспорт'),
+                                                                  queries.NoteInfo(umbrella.id, False, 'Зонт')])
+
+    def test_set_notes_done_ignores_other_routes(self):
+        self.assertEqual(queries.set_notes_done(self.past.id, {self.note.id: True}), 0)
+        self.assertFalse(Note.objects.get(id=self.note.id).done)
+
+    def test_dispatch_changes_from_other_process(self):
+        received = []
+        queries.routes_changed.connect(lambda sender, user_id, **kwargs: received.append(user_id),
+                                       sender=queries.ChangeListener, weak=False, dispatch_uid='test_dispatch')
+        self.addCleanup(queries.routes_changed.disconnect, sender=queries.ChangeListener, dispatch_uid='test_dispatch')
+
+        queries.dispatch_changes(json.dumps({'origin': queries.ORIGIN, 'user_ids': [1]}))
+        queries.dispatch_changes(json.dumps({'origin': 'other', 'user_ids': [2]}))
+
+        self.assertEqual(received, [2])
+
+    def test_route_save_sends_hook(self):
+        received = []
+        queries.routes_changed.connect(lambda sender, user_id, **kwargs: received.append(user_id),
+                                       weak=False, dispatch_uid='test_route_save')
+        self.addCleanup(queries.routes_changed.disconnect, dispatch_uid='test_route_save')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.route.save()
+
+        self.assertEqual(received, [self.author.id])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Поисковые векторы есть только на PostgreSQL')
+class UpdateSearchIndexCommandTest(TestCase):
+    """
+    Маршруты, опубликованные до появления поиска, получают вектор при развёртывании
+    """
+
+    def test_fills_only_empty_vectors(self):
+        author = User.objects.create_user('author', password='password')
+        old = PublicRoute.objects.create(Name='Старое море', author=author, comment='')
+        indexed = PublicRoute.objects.create(Name='Горы', author=author, comment='')
+        PublicRoute.objects.filter(id=indexed.id).update(search_vector='marker')
+
+        call_command('update_search_index', stdout=io.StringIO())
+
+        self.assertEqual(PublicRoute.objects.get(id=indexed.id).search_vector, "'marker'")
+        self.assertIn('мор', PublicRoute.objects.get(id=old.id).search_vector)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'EXPLAIN проверяется только на PostgreSQL')
+class BotQueriesExplainTest(TestCase):
+    """
+    Запросы бота (queries.py) находят строки по индексам.
+    Последовательное чтение запрещено, поэтому без подходящего индекса
+    или при условии, которое индекс не может использовать, в плане не будет Index Scan.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='password', tg_username='42')
+
+        for index in range(3):
+            cls.route = PrivateRoute.objects.create(Name=f'Маршрут {index}', author=cls.author,
+                                                    date_in=datetime.date(2024, 5, index + 1),
+                                                    date_out=datetime.date(2024, 5, index + 5))
+            cls.route.note.create(text='Паспорт')
+
+    @staticmethod
+    def plan_indexes(function, *args):
+        with CaptureQueriesContext(connection) as captured:
+            function(*args)
+
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {captured[-1]["sql"]}')
+            nodes = [cursor.fetchone()[0][0]['Plan']]
+
+        indexes = set()
+
+        while nodes:
+            node = nodes.pop()
+            indexes.add(node.get('Index Name'))
+            nodes.extend(node.get('Plans', []))
+
+        return indexes - {None}
+
+    @staticmethod
+    def table_indexes(table, first_column):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, table)
+
+        # Индекс уникального ограничения get_constraints отдаёт с index=False
+        return {name for name, constraint in constraints.items()
+                if (constraint['index'] or constraint['unique']) and constraint['columns'][0] == first_column}
+
+    def test_next_route_uses_author_date_index(self):
+        indexes = self.plan_indexes(queries.get_nearest_route, self.author.id, datetime.date(2024, 5, 2))
+
+        self.assertIn('private_routes_author_date_idx', indexes)
+
+    def test_reminders_use_date_index(self):
+        indexes = self.plan_indexes(queries.get_reminders, datetime.date(2024, 5, 2))
+
+        self.assertTrue(indexes & self.table_indexes('Private_Routes', 'date_in'))
+
+    def test_route_notes_use_through_table_index(self):
+        indexes = self.plan_indexes(queries.get_route_notes, self.route.id)
+
+        self.assertTrue(indexes & self.table_indexes('Private_Routes_note', 'privateroute_id'))
+
+    def test_user_by_chat_uses_unique_index(self):
+        indexes = self.plan_indexes(queries.get_user_by_chat, 42)
+
+        self.assertIn('auth_user_tg_username_key', indexes)
+        self.assertIn('auth_user_tg_username_key', self.table_indexes('auth_user', 'tg_username'))
+
+    def test_claim_reminders_once(self):
+        date_in = datetime.date(2024, 5, 1)
+        route_ids = list(PrivateRoute.objects.filter(date_in=date_in).values_list('id', flat=True))
+
+        self.assertEqual(queries.claim_reminders(route_ids, date_in), set(route_ids))
+        self.assertEqual(queries.claim_reminders(route_ids, date_in), set())
+        self.assertEqual(queries.get_reminders(date_in), [])
+
+    def test_release_reminders(self):
+        date_in = datetime.date(2024, 5, 1)
+        route_ids = list(PrivateRoute.objects.filter(date_in=date_in).values_list('id', flat=True))
+        queries.claim_reminders(route_ids, date_in)
+
+        self.assertEqual(queries.release_reminders(route_ids, date_in), len(route_ids))
+        self.assertEqual(queries.claim_reminders(route_ids, date_in), set(route_ids))
@@ -6,13 +6,10 @@ import calendar
 import datetime
 import json
 
-import requests
+import httpx
 import jwt
 
-from taggit.models import Tag
-
-from django.db.models import Q
-from django.http import JsonResponse, HttpResponse, HttpResponseNotAllowed
+from django.http import JsonResponse, HttpResponse, HttpResponseNotAllowed, Http404
 
 from django.contrib.auth import logout, views
 from django.contrib.auth.decorators import login_required
@@ -20,16 +17,79 @@ from django.contrib.messages.views import SuccessMessageMixin, messages
 from django.shortcuts import redirect, get_object_or_404
 from django.shortcuts import render
 
+from django.db import connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+
 from django.urls import reverse
 from django.urls import reverse_lazy
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.decorators import method_decorator
+from django.utils.http import http_date
 
 from django.views import generic
 from django.views.generic import CreateView
 
-from tutun.settings import API_YANDEX_MAPS_KEY, SECRET_JWT_KEY
+from tutun.settings import API_YANDEX_MAPS_KEY, MAPS_BUNDLE_MAX_AGE, SECRET_JWT_KEY
 from .forms import UserRegisterForm, PrivateRouteForm, PrivateDotForm, ProfileForm, \
     NoteForm, ComplaintForm, AnswerComplaintForm, AuthTokenBotForm
+from .facets import change_facet_counts, filter_public_routes, get_facet_counts, route_facet_values
+from .geocoder import map_points, schedule_geocoding
+from .maps_bundle import MAPS_BUNDLE
 from .models import User, PrivateRoute, PublicRoute, PrivateDot, Note, Complaint, PublicDot
+from .page_cache import cache_public_page, route_cards_context
+from .pagination import KeysetPaginationMixin
+from .route_detail_cache import get_public_route_detail
+from .route_rows import add_route_rows, bind_row_forms, update_route_rows, validate_dot_dates
+from .search import search_public_routes, update_search_index
+from .tag_catalogue import get_tag_by_slug, get_tag_cloud
+
+
+# Миграции проверяются, пока не окажутся применёнными, дальше только соединение с базой данных
+MIGRATIONS_APPLIED = False
+
+
+def health_live(request):
+    """
+    Проверка того, что процесс отвечает на запросы
+
+    @param request: Запрос на страницу
+    @type request: :class:`django.http.HttpRequest`
+
+    @return: Возвращает ответ ok с кодом 200
+    @rtype: :class:`django.http.HttpResponse`
+    """
+
+    return HttpResponse('ok', content_type='text/plain')
+
+
+def health_ready(request):
+    """
+    Проверка готовности к приёму запросов: база данных доступна
+    и все миграции применены. Миграции применяет отдельный шаг запуска,
+    до его завершения экземпляр не получает трафик
+
+    @param request: Запрос на страницу
+    @type request: :class:`django.http.HttpRequest`
+
+    @return: Возвращает ответ с кодом 200, если экземпляр готов, иначе 503
+    @rtype: :class:`django.http.HttpResponse`
+    """
+
+    global MIGRATIONS_APPLIED
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+
+        if not MIGRATIONS_APPLIED:
+            executor = MigrationExecutor(connection)
+            if executor.migration_plan(executor.loader.graph.leaf_nodes()):
+                return HttpResponse('migrations pending', status=503, content_type='text/plain')
+            MIGRATIONS_APPLIED = True
+    except Exception as e:
+        return HttpResponse(f'database unavailable: {e.__class__.__name__}', status=503, content_type='text/plain')
+
+    return HttpResponse('ok', content_type='text/plain')
 
 
 def get_bar_context(request):
@@ -59,6 +119,53 @@ def get_bar_context(request):
     return menu
 
 
+def get_dots_vis(request, dots, with_date=False):
+    """
+    Координаты точек маршрута для отображения на карте.
+    Координаты сохраняются в точках фоновым геокодированием при их создании и изменении,
+    поэтому здесь к yandex api geocoder не обращаемся.
+
+    @param request: запрос на страницу
+    @type request: :class:`django.http.HttpRequest`
+
+    @param dots: точки маршрута
+    @type dots: list
+
+    @param with_date: добавлять ли дату точки
+    @type with_date: bool
+
+    @return: список точек с координатами
+    @rtype: list
+    """
+
+    dots_vis, missing, pending = map_points(dots, with_date)
+    show_map_messages(request, missing, pending)
+
+    return dots_vis
+
+
+def show_map_messages(request, missing, pending):
+    """
+    Сообщения о точках, которые не отмечены на карте
+
+    @param request: запрос на страницу
+    @type request: :class:`django.http.HttpRequest`
+
+    @param missing: названия точек, которые геокодер не нашёл
+    @type missing: list
+
+    @param pending: есть ли точки, ещё не геокодированные
+    @type pending: bool
+    """
+
+    for name in missing:
+        messages.error(request, f'Не удалось найти точку "{name}" на карте.')
+
+    if pending:
+        # Геокодирование ставится в очередь при сохранении точек, а не при просмотре
+        messages.info(request, 'Некоторые точки ещё не отмечены на карте, обновите страницу позже.')
+
+
 class MyLoginView(views.LoginView):
     """
     Переопределенние view авторизации
@@ -159,9 +266,11 @@ def logout_view(request):
     return redirect('index')
 
 
+@cache_public_page
 def index_page(request):
     """
-    Отображение приветственной страницы
+    Отображение приветственной страницы.
+    Анонимным посетителям отдаётся из кэша
 
     @param request: запрос на страницу
     @type request: :class:`django.http.HttpRequest`
@@ -177,17 +286,51 @@ def index_page(request):
     return render(request, 'index.html', context)
 
 
-class PublicRoutesPage(generic.ListView):
+def get_public_routes():
+    """
+    Публичные маршруты вместе с авторами и тегами
+
+    Авторы подгружаются через JOIN, а теги всех маршрутов страницы
+    одним дополнительным запросом, поэтому число запросов не зависит
+    от количества маршрутов на странице.
+
+    @return: QuerySet публичных маршрутов
+    @rtype: :class:`django.db.models.QuerySet`
+    """
+
+    return PublicRoute.objects.select_related('author').prefetch_related('tags')
+
+
+@method_decorator(cache_public_page, name='dispatch')
+class PublicRoutesPage(KeysetPaginationMixin, generic.ListView):
+    """
+    Отображение страницы публичных маршрутов.
+    Анонимным посетителям отдаётся из кэша
+
+    @type template_name: str
+    @param template_name: Имя шаблона для рендеринга страницы
+
+    @type context_object_name: str
+    @param context_object_name: Имя контекстного объекта
+
+    @return: Возвращает объект  ответа сервера с html-кодом внутри
+    @rtype: object
+    """
     template_name = 'public_routes.html'
     context_object_name = 'routes_list'
 
+    selected = None
+
     def get_queryset(self):
         """
-        Получение списка публичных маршрутов
+        Получение списка публичных маршрутов,
+        отфильтрованных по тегам, месяцу, году и продолжительности поездки
 
-        @return: список всех маршрутов из базы данных
+        @return: QuerySet маршрутов из базы данных
+        @rtype: :class:`django.db.models.QuerySet`
         """
-        return PublicRoute.objects.all()
+        queryset, self.selected = filter_public_routes(get_public_routes(), self.request.GET)
+        return queryset
 
     def get_context_data(self, **kwargs):
         """
@@ -197,21 +340,63 @@ class PublicRoutesPage(generic.ListView):
         """
 
         context = super().get_context_data(**kwargs)
-        routes = self.get_queryset()
-        tags = Tag.objects.all()
+        tags, tags_more = get_tag_cloud()
 
         context.update({
             'bar': get_bar_context(self.request),
-            'routes_list': routes,
             'tags': tags,
+            'tags_more': tags_more,
+            'facets': get_facet_counts(),
+            'selected': self.selected,
+            **route_cards_context(),
         })
 
         return context
 
 
-class PublicRoutesTagsPage(generic.ListView):
+def public_routes_facets(request):
+    """
+    Счётчики маршрутов для каждого значения фильтров публичных маршрутов.
+    Счётчики хранятся в отдельной таблице и поддерживаются при публикации
+    и удалении маршрутов, поэтому COUNT(*) при запросе не выполняется.
+
+    @param request: запрос на страницу
+    @type request: :class:`django.http.HttpRequest`
+
+    @return: Возвращает объект JSON ответа сервера
+    @rtype: :class:`django.http.JsonResponse`
     """
-    Отображение страницы маршрутов по тегу
+
+    return JsonResponse(get_facet_counts())
+
+
+def public_routes_tag_cloud(request):
+    """
+    Следующая часть облака тегов для кнопки «Ещё теги»
+
+    @param request: запрос на страницу, параметр offset - количество уже показанных тегов
+    @type request: :class:`django.http.HttpRequest`
+
+    @return: Возвращает объект JSON ответа сервера
+    @rtype: :class:`django.http.JsonResponse`
+    """
+
+    offset = request.GET.get('offset', '')
+    tags, tags_more = get_tag_cloud(int(offset) if offset.isdigit() else 0)
+
+    return JsonResponse({
+        'tags': [
+            {'name': tag['name'], 'url': reverse('public_routes_by_tags', args=[tag['slug']])} for tag in tags
+        ],
+        'more': tags_more,
+    })
+
+
+@method_decorator(cache_public_page, name='dispatch')
+class PublicRoutesTagsPage(KeysetPaginationMixin, generic.ListView):
+    """
+    Отображение страницы маршрутов по тегу.
+    Анонимным посетителям отдаётся из кэша
 
     @type template_name: str
     @param template_name: Имя шаблона для рендеринга страницы
@@ -219,22 +404,14 @@ class PublicRoutesTagsPage(generic.ListView):
     @type context_object_name: str
     @param context_object_name: Имя контекстного объекта
 
-    @type model: :class:`django.db.models.Model`
-    @param model: Модель данных для маршрутов
-
-    @type paginate_by: int
-    @param paginate_by: Количество элементов на страницу
-
-    @type tag: :class:`Tag`
-    @param tag: Текущий тег для фильтрации маршрутов
+    @type tag: dict
+    @param tag: Текущий тег для фильтрации маршрутов из каталога тегов
 
     @return: Возвращает объект  ответа сервера с html-кодом внутри
     @rtype: object
     """
     template_name = 'public_routes.html'
     context_object_name = 'routes_list'
-    model = PublicRoute
-    paginate_by = 10
     tag = None
 
     def get_queryset(self):
@@ -244,8 +421,12 @@ class PublicRoutesTagsPage(generic.ListView):
         @return: QuerySet с отфильтрованными маршрутами
         @rtype: :class:`django.db.models.QuerySet`
         """
-        self.tag = Tag.objects.get(slug=self.kwargs['tag'])
-        queryset = PublicRoute.objects.all().filter(tags__slug=self.tag.slug)
+        self.tag = get_tag_by_slug(self.kwargs['tag'])
+
+        if self.tag is None:
+            raise Http404('Тег не найден')
+
+        queryset = get_public_routes().filter(tags__id=self.tag['id'])
         return queryset
 
     def get_context_data(self, **kwargs):
@@ -257,18 +438,22 @@ class PublicRoutesTagsPage(generic.ListView):
         @rtype: dict
         """
         context = super().get_context_data(**kwargs)
-        tags = Tag.objects.all()
+        tags, tags_more = get_tag_cloud()
         context.update({
             'bar': get_bar_context(self.request),
-            'title': f'Маршруты по тегу: {self.tag.name}',
+            'title': f'Маршруты по тегу: {self.tag["name"]}',
             'tags': tags,
+            'tags_more': tags_more,
+            **route_cards_context(),
         })
         return context
 
 
-class PublicRoutesSearchResults(generic.ListView):
+class PublicRoutesSearchResults(KeysetPaginationMixin, generic.ListView):
     """
-    Отображение страницы результатов поиска маршрутов
+    Отображение страницы результатов поиска маршрутов.
+    Ищет по названию, комментарию, точкам и тегам маршрута,
+    результаты упорядочены по релевантности.
 
     @type template_name: str
     @param template_name: Имя шаблона для рендеринга страницы
@@ -281,6 +466,7 @@ class PublicRoutesSearchResults(generic.ListView):
     """
     template_name = 'search_results_public.html'
     context_object_name = 'routes_list'
+    cursor_ordering = ('-rank', '-id')
 
     def get_queryset(self):
         """
@@ -289,10 +475,12 @@ class PublicRoutesSearchResults(generic.ListView):
         @return: QuerySet с найденными маршрутами
         @rtype: :class:`django.db.models.QuerySet`
         """
-        query = self.request.GET.get('q')
-        object_list = PublicRoute.objects.filter(
-            Q(Name__icontains=query)
-        )
+        query = self.request.GET.get('q', '').strip()
+
+        if not query:
+            return PublicRoute.objects.none()
+
+        object_list = search_public_routes(get_public_routes(), query)
         return object_list
 
     def get_context_data(self, **kwargs):
@@ -304,10 +492,12 @@ class PublicRoutesSearchResults(generic.ListView):
         @rtype: dict
         """
         context = super().get_context_data(**kwargs)
-        tags = Tag.objects.all()
+        tags, tags_more = get_tag_cloud()
         context.update({
             'bar': get_bar_context(self.request),
             'tags': tags,
+            'tags_more': tags_more,
+            **route_cards_context(),
         })
         return context
 
@@ -405,14 +595,17 @@ def create_route(request):
 
     if request.method == 'POST':
         route_form = PrivateRouteForm(request.POST)
+        dot_forms = bind_row_forms(request.POST, 'dots', PrivateDotForm, 'name')
+        note_forms = bind_row_forms(request.POST, 'notes', NoteForm, 'text')
 
-        dot_forms = [PrivateDotForm(request.POST,
-                                    prefix=str(x)) for x in range(len(request.POST)) if
-                     f'dots-{x}-name' in request.POST]
-        note_forms = [NoteForm(request.POST, prefix=str(x)) for x in range(len(request.POST)) if
-                      f'notes-{x}-text' in request.POST]
+        forms_valid = all([form.is_valid() for form in [route_form, *dot_forms, *note_forms]])
 
-        if route_form.is_valid() and len(dot_forms) != 0:
+        if len(dot_forms) == 0:
+            messages.error(request, 'Необходимо добавить хотя бы одну точку.')
+        elif forms_valid and not validate_dot_dates(dot_forms, route_form.cleaned_data['date_in'],
+                                                    route_form.cleaned_data['date_out']):
+            messages.error(request, 'Даты точек должны находиться в пределах путешествия.')
+        elif forms_valid:
             route = route_form.save(commit=False)
 
             route.author = request.user
@@ -420,59 +613,23 @@ def create_route(request):
             route.month = calendar.month_name[route.date_in.month]
             route.year = route.date_in.year
 
-            route.save()
-
-            for dot_form in dot_forms:
-                dot_data = dot_form.data
-                if dot_data[f'dots-{dot_form.prefix}-date']:
-                    dot_date = datetime.datetime.strptime(
-                        dot_data[f'dots-{dot_form.prefix}-date'],
-                        '%Y-%m-%d').date()
-
-                    if dot_date > route.date_out or dot_date < route.date_in:
-                        messages.error(request, 'Даты точек должны находиться в пределах путешествия.')
-
-                        context = {
-                            'bar': get_bar_context(request),
-                            'route_form': route_form,
-                            'dot_forms': dot_forms,
-                            'note_forms': note_forms,
-                        }
-
-                        route.delete()
-
-                        return render(request, 'new_route.html', context)
-
-                dot = PrivateDot(
-                    name=dot_data[f'dots-{dot_form.prefix}-name'],
-                    date=None,
-                    note=dot_data.get(f'dots-{dot_form.prefix}-note'),
-                    information=dot_data.get(f'dots-{dot_form.prefix}-information'),
-                )
-
-                if (f'dots-{dot_form.prefix}-date' in dot_data and
-                        dot_data[f'dots-{dot_form.prefix}-date']):
-                    dot.date = dot_data[f'dots-{dot_form.prefix}-date']
-
-                dot.save()
-                route.dots.add(dot)
-
-            for note_form in note_forms:
-                note_data = note_form.data
-
-                note = Note(
-                    text=note_data[f'notes-{note_form.prefix}-text']
+            with transaction.atomic():
+                route.save()
+                dots = add_route_rows(
+                    route,
+                    [dot_form.save(commit=False) for dot_form in dot_forms],
+                    [note_form.save(commit=False) for note_form in note_forms],
                 )
+                if route_form.cleaned_data.get('tags'):
+                    route.tags.add(*route_form.cleaned_data['tags'])
 
-                note.save()
-                route.note.add(note)
+                schedule_geocoding(PrivateDot, [dot.id for dot in dots])
 
             messages.success(request, 'Маршрут успешно создан.')
-            route.tags.set(route_form.cleaned_data.get('tags', []))
 
             return redirect(reverse('profile', kwargs={'stat': 'reading'}))
-
-        messages.error(request, 'Необходимо добавить хотя бы одну точку.')
+        else:
+            messages.error(request, 'Проверьте правильность заполнения маршрута.')
 
     else:
         route_form = PrivateRouteForm()
@@ -498,26 +655,33 @@ def save_route(request, pk=None):
     if request.method == 'POST':
         public_route = get_object_or_404(PublicRoute, pk=pk)
 
-        private_route = PrivateRoute.objects.create(
-            Name=public_route.Name,
-            author=request.user,
-            comment=public_route.comment,
-            rate=public_route.rate if public_route.rate is not None else 0,
-            length=public_route.length,
-            month=public_route.month,
-            year=public_route.year
-        )
-
-        # Копирование точек маршрута
-        for public_dot in public_route.dots.all():
-            private_dot = PrivateDot.objects.create(
-                name=public_dot.name,
-                information=public_dot.information
+        with transaction.atomic():
+            private_route = PrivateRoute.objects.create(
+                Name=public_route.Name,
+                author=request.user,
+                comment=public_route.comment,
+                rate=public_route.rate if public_route.rate is not None else 0,
+                length=public_route.length,
+                month=public_route.get_month_display() if public_route.month else None,
+                year=public_route.year
             )
-            private_route.dots.add(private_dot)
 
-        # Копирование тегов
-        private_route.tags.set(public_route.tags.all())
+            # Копирование точек маршрута пачкой, вместе с сохранёнными координатами
+            dots = add_route_rows(private_route, [
+                PrivateDot(
+                    name=public_dot.name,
+                    information=public_dot.information,
+                    longitude=public_dot.longitude,
+                    latitude=public_dot.latitude,
+                    geo_name=public_dot.geo_name,
+                    geocoded_information=public_dot.geocoded_information,
+                ) for public_dot in public_route.dots.order_by('id')
+            ], [])
+            # Точки, которые у публичного маршрута ещё не геокодированы, геокодируются для копии
+            schedule_geocoding(PrivateDot, [dot.id for dot in dots if dot.geocoded_information != dot.information])
+
+            # Копирование тегов
+            private_route.tags.set(public_route.tags.all())
 
         messages.success(request, "Маршрут успешно скопирован в приватные!")
         return redirect(reverse('route_detail', kwargs={'route_id': private_route.pk}))
@@ -530,8 +694,8 @@ def save_route(request, pk=None):
 def route_detail(request, route_id):
     """
     Демонстрация конкретного приватного маршрута.
-    Функция получате из базы данных данные, а также
-    получает от yandex api geocoder координаты точек по их адресу илил названию.
+    Функция получает из базы данных данные маршрута и координаты точек,
+    сохранённые фоновым геокодированием, к внешним API не обращается.
     @param request: Запрос на страницу
     @type request: :class:`django.http.HttpRequest`
 
@@ -545,38 +709,7 @@ def route_detail(request, route_id):
     dots = sorted(route.dots.all(), key=lambda dot: dot.date if dot.date else datetime.date.min)
     notes = route.note.all().order_by("id")
 
-    url = 'https://geocode-maps.yandex.ru/1.x/'
-    apikey = API_YANDEX_MAPS_KEY
-
-    getparams = {
-        'lang': 'ru_RU',
-        'apikey': apikey,
-        'format': 'json'
-    }
-
-    dots_vis = []
-
-    for dot in dots:
-        getparams['geocode'] = dot.information
-
-        try:
-            response = requests.get(url=url, params=getparams)
-            data = response.json()
-            try:
-                geo_object = data['response']['GeoObjectCollection']['featureMember'][0]['GeoObject']
-                coords = geo_object['Point']['pos'].split()
-                inf = geo_object['name']
-
-                dots_vis.append({
-                    'name': dot.name,
-                    'coords': coords,
-                    'inf': inf,
-                    'date': str(dot.date)
-                })
-            except KeyError:
-                messages.error(request, 'Произошла непредведенная ошибка.')
-        except ConnectionError:
-            messages.error(request, 'Эта страница в данный момент не доступна, попробуйте позже.')
+    dots_vis = get_dots_vis(request, dots, with_date=True)
 
     context = {
         'bar': get_bar_context(request),
@@ -594,8 +727,8 @@ def route_detail(request, route_id):
 def public_route_detail(request, route_id):
     """
     Демонстрация конкретного публичного маршрута.
-    Функция получате из базы данных данные, а также
-    получает от yandex api geocoder координаты точек по их адресу илил названию.
+    Данные маршрута, координаты точек, сохранённые фоновым геокодированием,
+    и теги берутся из кэша, к базе данных и внешним API функция не обращается.
     @param request: Запрос на страницу
     @type request: :class:`django.http.HttpRequest`
 
@@ -605,44 +738,18 @@ def public_route_detail(request, route_id):
     @return: Возвращает объект ответа сервера с html-кодом внутри
     @rtype: :class:`django.http.HttpResponse`
     """
-    route = get_object_or_404(PublicRoute, id=route_id)
-    dots = route.dots.all()
-
-    url = 'https://geocode-maps.yandex.ru/1.x/'
-    apikey = API_YANDEX_MAPS_KEY
-    getparams = {
-        'lang': 'ru_RU',
-        'apikey': apikey,
-        'format': 'json'
-    }
-
-    dots_vis = []
+    detail = get_public_route_detail(route_id)
 
-    for dot in dots:
-        getparams['geocode'] = dot.information
+    if detail is None:
+        raise Http404('Маршрут не найден')
 
-        try:
-            response = requests.get(url=url, params=getparams)
-            data = response.json()
-            try:
-                geo_object = data['response']['GeoObjectCollection']['featureMember'][0]['GeoObject']
-                coords = geo_object['Point']['pos'].split()
-                inf = geo_object['name']
-                dots_vis.append({
-                    'name': dot.name,
-                    'coords': coords,
-                    'inf': inf,
-                })
-            except KeyError:
-                messages.error(request, 'Произошла непредведенная ошибка.')
-        except ConnectionError:
-            messages.error(request, 'Эта страница в данный момент не доступна, попробуйте позже.')
+    show_map_messages(request, detail['missing'], detail['pending'])
 
     context = {
         'bar': get_bar_context(request),
-        'route': route,
-        'dots': dots,
-        'dots_vis': dots_vis,
+        'route': detail['route'],
+        'tags': detail['tags'],
+        'dots_vis': detail['dots_vis'],
         'API_YANDEX_MAPS_KEY': API_YANDEX_MAPS_KEY
     }
 
@@ -654,7 +761,8 @@ def editing_route(request, route_id):
     """
     Редактирование маршрута
     Функция, сохраняющая изменения в параметрах уже существующих точек, заметок и самого маршурта,
-     а также обрабатывает добавление новых точек и заметок.
+     а также обрабатывает добавление и удаление точек и заметок.
+     Точки и заметки сопоставляются с сохранёнными по id, записываются только изменённые строки.
     @param request: Запрос на страницу
     @type request: :class:`django.http.HttpRequest`
 
@@ -665,180 +773,72 @@ def editing_route(request, route_id):
     который перенаправляет клиента на указанный URL
     @rtype: :class:`django.http.HttpResponse` / `HttpResponseRedirect`
     """
-    if request.user != PrivateRoute.objects.get(id=route_id).author:
+    route = get_object_or_404(PrivateRoute, id=route_id)
+
+    if request.user.id != route.author_id:
         return redirect(reverse('main_menu'))
 
     if request.method == 'POST':
-        route = PrivateRoute.objects.get(id=route_id)
-        route_form = PrivateRouteForm(request.POST)
-
-        if route_form.is_valid():
-            PrivateRoute.objects.filter(id=route_id).update(
-                Name=route_form.data['Name'],
-                date_in=route_form.data['date_in'],
-                date_out=route_form.data['date_out'],
-                comment=route_form.data['comment'],
-                baggage=route_form.data['baggage'],
-                rate=route_form.data['rate'],
-                length=(route.date_out - route.date_in).days,
-                month=calendar.month_name[route.date_in.month],
-                year=route.date_in.year
-            )
-            route.tags.set(route_form.cleaned_data.get('tags', []))
-            new_notes = {"new_text": request.POST.getlist('text')}
-            notes = route.note.all()
-
-            for index_note in range(len(notes)):
-                Note.objects.filter(id=notes[index_note].id).update(
-                    text=new_notes["new_text"][index_note])
-
-            for index_note in range(len(notes), len(new_notes["new_text"])):
-                note = Note(text=new_notes["new_text"][index_note])
-
-                note.save()
-                route.note.add(note)
-
-            new_dots = {"new_name": request.POST.getlist('name'),
-                        "new_note": request.POST.getlist('note'),
-                        "new_information": request.POST.getlist('information'),
-                        "new_date": request.POST.getlist('date'),
-                        }
-
-            dots = route.dots.all()
-
-            for index_dot in range(len(dots)):
-                if new_dots['new_date'][index_dot]:
-                    dot_date = datetime.datetime.strptime(
-                        new_dots['new_date'][index_dot],
-                        '%Y-%m-%d').date()
-
-                    if dot_date > route.date_out or dot_date < route.date_in:
-                        messages.error(request, 'Даты точек должны находиться в пределах путешествия.')
-
-                        notes = route.note.all().order_by("id")
-                        notes_form = []
-
-                        for note in notes:
-                            notes_form.append(NoteForm(initial={'text': note.text, }))
-
-                        dots = sorted(route.dots.all(), key=lambda dot: dot.date if dot.date else datetime.date.min)
-                        dots_form = []
-
-                        for dot in dots:
-                            dots_form.append(PrivateDotForm(initial={
-                                'name': dot.name,
-                                'note': dot.note,
-                                'date': dot.date,
-                                'information': dot.information,
-                            }))
-
-                        context = {
-                            'bar': get_bar_context(request),
-                            'route_form': route_form,
-                            'dots_form': dots_form,
-                            'notes_form': notes_form,
-                            'url_back': reverse('route_detail', kwargs={'route_id': route_id})
-                        }
-
-                        return render(request, 'editing_route.html', context)
-
-                PrivateDot.objects.filter(id=dots[index_dot].id).update(
-                    name=new_dots['new_name'][index_dot],
-                    note=new_dots['new_note'][index_dot] if new_dots['new_note'][index_dot] else None,
-                    information=new_dots['new_information'][index_dot],
-                    date=new_dots['new_date'][index_dot] if new_dots['new_date'][index_dot] else None,
-                )
-
-            for index_dot in range(len(dots), len(new_dots["new_name"])):
-                dot = PrivateDot(
-                    name=new_dots['new_name'][index_dot],
-                    note=new_dots['new_note'][index_dot] if new_dots['new_note'][index_dot] else None,
-                    information=new_dots['new_information'][index_dot],
-                    date=new_dots['new_date'][index_dot] if new_dots['new_date'][index_dot] else None,
-                )
-
-                if new_dots['new_date'][index_dot]:
-                    dot_date = datetime.datetime.strptime(
-                        new_dots['new_date'][index_dot],
-                        '%Y-%m-%d').date()
-
-                    if dot_date > route.date_out or dot_date < route.date_in:
-                        messages.error(request, 'Даты точек должны находиться в пределах путешествия.')
-
-                        notes = route.note.all().order_by("id")
-                        notes_form = []
-
-                        for note in notes:
-                            notes_form.append(NoteForm(initial={'text': note.text, }))
+        route_form = PrivateRouteForm(request.POST, instance=route)
+        dots_form = bind_row_forms(request.POST, 'dots', PrivateDotForm, 'name')
+        notes_form = bind_row_forms(request.POST, 'notes', NoteForm, 'text')
 
-                        dots = sorted(route.dots.all(), key=lambda dot: dot.date if dot.date else datetime.date.min)
-                        dots_form = []
+        forms_valid = all([form.is_valid() for form in [route_form, *dots_form, *notes_form]])
 
-                        for dot in dots:
-                            dots_form.append(PrivateDotForm(initial={
-                                'name': dot.name,
-                                'note': dot.note,
-                                'date': dot.date,
-                                'information': dot.information,
-                            }))
-
-                        context = {
-                            'bar': get_bar_context(request),
-                            'route_form': route_form,
-                            'dots_form': dots_form,
-                            'notes_form': notes_form,
-                            'url_back': reverse('route_detail', kwargs={'route_id': route_id})
-                        }
+        if forms_valid and validate_dot_dates(dots_form, route_form.cleaned_data['date_in'],
+                                              route_form.cleaned_data['date_out']):
+            route = route_form.save(commit=False)
 
-                        return render(request, 'editing_route.html', context)
+            route.length = (route.date_out - route.date_in).days
+            route.month = calendar.month_name[route.date_in.month]
+            route.year = route.date_in.year
 
-                dot.save()
-                route.dots.add(dot)
+            with transaction.atomic():
+                route.save()
+                route.tags.set(route_form.cleaned_data.get('tags', []))
+                dots = update_route_rows(route, dots_form, notes_form)
+                schedule_geocoding(PrivateDot, [dot.id for dot in dots])
 
             messages.success(request, "Вы успешно изменили маршрут!")
 
             return redirect(reverse('route_detail', kwargs={'route_id': route_id}))
 
-        messages.error(request, "Во время изменения маршрута, произошла ошибка")
+        if forms_valid:
+            messages.error(request, 'Даты точек должны находиться в пределах путешествия.')
+        else:
+            messages.error(request, "Во время изменения маршрута, произошла ошибка")
     else:
-        route = PrivateRoute.objects.get(id=route_id)
-
-        route_form = PrivateRouteForm(initial={
-            'Name': route.Name,
-            'date_in': route.date_in,
-            'date_out': route.date_out,
-            'baggage': route.baggage,
-            'comment': route.comment,
-            'rate': route.rate,
+        route_form = PrivateRouteForm(instance=route, initial={
             'tags': route.tags.values_list('id', flat=True)
         })
 
         notes = route.note.all().order_by("id")
-        notes_form = []
-
-        for note in notes:
-            notes_form.append(NoteForm(initial={'text': note.text, }))
+        notes_form = [
+            NoteForm(prefix=f'notes-{index}', initial={'id': note.id, 'text': note.text})
+            for index, note in enumerate(notes)
+        ]
 
         dots = sorted(route.dots.all(), key=lambda dot: dot.date if dot.date else datetime.date.min)
-        dots_form = []
-
-        for dot in dots:
-            dots_form.append(PrivateDotForm(initial={
+        dots_form = [
+            PrivateDotForm(prefix=f'dots-{index}', initial={
+                'id': dot.id,
                 'name': dot.name,
                 'note': dot.note,
                 'date': dot.date,
                 'information': dot.information,
-            }))
+            })
+            for index, dot in enumerate(dots)
+        ]
 
-        context = {
-            'bar': get_bar_context(request),
-            'route_form': route_form,
-            'dots_form': dots_form,
-            'notes_form': notes_form,
-            'url_back': reverse('route_detail', kwargs={'route_id': route_id})
-        }
+    context = {
+        'bar': get_bar_context(request),
+        'route_form': route_form,
+        'dots_form': dots_form,
+        'notes_form': notes_form,
+        'url_back': reverse('route_detail', kwargs={'route_id': route_id})
+    }
 
-        return render(request, 'editing_route.html', context)
+    return render(request, 'editing_route.html', context)
 
 
 @login_required
@@ -1001,28 +1001,39 @@ def post_route(request, id):
     private_route = get_object_or_404(PrivateRoute, id=id)
     public_dots = []
 
-    public_route = PublicRoute.objects.create(
-        Name=private_route.Name,
-        author=request.user,
-        comment=private_route.comment,
-        rate=private_route.rate,
-        length=private_route.length,
-        month=private_route.month,
-        year=private_route.year,
-    )
-
-    public_route.save()
-
-    for dot in private_route.dots.all():
-        public_dot, created = PublicDot.objects.get_or_create(
-            name=dot.name,
-            information=dot.information
+    # Кэш публичных страниц сбрасывается один раз, после публикации маршрута целиком
+    with transaction.atomic():
+        public_route = PublicRoute.objects.create(
+            Name=private_route.Name,
+            author=request.user,
+            comment=private_route.comment,
+            rate=private_route.rate,
+            length=int(private_route.length) if private_route.length else None,
+            month=private_route.date_in.month if private_route.date_in else None,
+            year=private_route.date_in.year if private_route.date_in else None,
         )
 
-        public_dots.append(public_dot)
+        public_route.save()
+
+        for dot in private_route.dots.all():
+            public_dot, created = PublicDot.objects.get_or_create(
+                name=dot.name,
+                information=dot.information,
+                defaults={
+                    'longitude': dot.longitude,
+                    'latitude': dot.latitude,
+                    'geo_name': dot.geo_name,
+                    'geocoded_information': dot.geocoded_information,
+                }
+            )
 
-    public_route.dots.set(public_dots)
-    public_route.tags.add(*private_route.tags.names())
+            public_dots.append(public_dot)
+
+        public_route.dots.set(public_dots)
+        schedule_geocoding(PublicDot, [dot.id for dot in public_dots if dot.geocoded_information != dot.information])
+        public_route.tags.add(*private_route.tags.names())
+        update_search_index(public_route)
+        change_facet_counts(route_facet_values(public_route), 1)
 
     messages.success(request, "Вы успешно опубликоватли маршрут!")
 
@@ -1061,27 +1072,31 @@ def get_tg_token(request):
     return render(request, 'get_token_bot.html', context)
 
 
-def yandex_maps(request):
+async def yandex_maps(request):
     """
     Функция подключения к яндекс карте.
-    Отправляет запрос к API и передаёт ответ.
+    Отдаёт сохранённую копию скрипта API без ключа, к Яндексу обращается
+    только при обновлении копии. Браузер кэширует скрипт и проверяет его
+    условным запросом, на который при неизменном скрипте отвечаем 304.
 
     @param request: запрос на страницу
     @type request: :class:`django.http.HttpRequest`
 
-    @return: Возвращает объект ответа сервера с html-кодом внутри,
+    @return: Возвращает объект ответа сервера со скриптом,
     либо json в котом указывается какая ошибка именно ошибка произошла
     @rtype: :class:`django.http.HttpResponse` / `django.http.JsonResponse`
     """
-    url = "https://api-maps.yandex.ru/v3/"
-    params = {
-        "apikey": API_YANDEX_MAPS_KEY,
-        "lang": "ru_RU"
-    }
     try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        safe_response = response.text.replace(API_YANDEX_MAPS_KEY, "api_key_hidden")
-        return HttpResponse(safe_response, content_type="application/x-javascript")
-    except requests.exceptions.RequestException as e:
-        return JsonResponse({"error": str(e)}, status=400)
\ No newline at end of file
+        bundle = await MAPS_BUNDLE.get()
+    except httpx.HTTPError as e:
+        # Текст ошибки содержит адрес запроса вместе с ключом
+        return JsonResponse({"error": str(e).replace(API_YANDEX_MAPS_KEY, "api_key_hidden")}, status=400)
+
+    response = get_conditional_response(request, etag=bundle.etag, last_modified=int(bundle.last_modified))
+    if response is None:
+        response = HttpResponse(bundle.body, content_type="application/x-javascript")
+
+    response['ETag'] = bundle.etag
+    response['Last-Modified'] = http_date(bundle.last_modified)
+    patch_cache_control(response, public=True, max_age=MAPS_BUNDLE_MAX_AGE)
+    return response